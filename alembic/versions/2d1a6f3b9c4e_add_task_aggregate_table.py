@@ -0,0 +1,37 @@
+"""add task aggregate table
+
+Revision ID: 2d1a6f3b9c4e
+Revises: 4893d060429b
+Create Date: 2019-04-02 10:12:45.318277
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d1a6f3b9c4e'
+down_revision = '4893d060429b'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'task_aggregate',
+        sa.Column('task_id', sa.Integer, sa.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('project_id', sa.Integer, sa.ForeignKey('project.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('n_task_runs', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('last_finish_time', sa.Text)
+    )
+    op.create_index('task_aggregate_project_id_idx', 'task_aggregate', ['project_id'])
+    op.execute('''
+        INSERT INTO task_aggregate (task_id, project_id, n_task_runs, last_finish_time)
+        SELECT task.id, task.project_id, COUNT(task_run.id),
+               MAX(task_run.finish_time)
+        FROM task JOIN task_run ON task_run.task_id = task.id
+        GROUP BY task.id
+        ''')
+
+
+def downgrade():
+    op.drop_index('task_aggregate_project_id_idx')
+    op.drop_table('task_aggregate')
@@ -0,0 +1,79 @@
+"""add task and task run timestamp columns
+
+Revision ID: 5c7e9a1d3b2f
+Revises: 2d1a6f3b9c4e
+Create Date: 2019-04-16 09:31:27.604118
+
+The columns are filled in by triggers for the rows written from now on.
+The existing rows and the indexes are left to the backfill_timestamps
+command of cli.py, which updates them in batches and builds the indexes
+concurrently, without locking the tables.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c7e9a1d3b2f'
+down_revision = '2d1a6f3b9c4e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TEXT_TO_TIMESTAMP = '''
+    CREATE OR REPLACE FUNCTION text_to_timestamp(value TEXT)
+    RETURNS TIMESTAMP AS $$
+    BEGIN
+        RETURN value::TIMESTAMP;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql STABLE;'''
+
+TASK_TRIGGER = '''
+    CREATE OR REPLACE FUNCTION task_sync_timestamps()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.created_ts := text_to_timestamp(NEW.created);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER task_sync_timestamps
+    BEFORE INSERT OR UPDATE OF created ON task
+    FOR EACH ROW EXECUTE PROCEDURE task_sync_timestamps();'''
+
+TASK_RUN_TRIGGER = '''
+    CREATE OR REPLACE FUNCTION task_run_sync_timestamps()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.created_ts := text_to_timestamp(NEW.created);
+        NEW.finish_time_ts := text_to_timestamp(NEW.finish_time);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER task_run_sync_timestamps
+    BEFORE INSERT OR UPDATE OF created, finish_time ON task_run
+    FOR EACH ROW EXECUTE PROCEDURE task_run_sync_timestamps();'''
+
+
+def upgrade():
+    op.add_column('task', sa.Column('created_ts', sa.DateTime))
+    op.add_column('task_run', sa.Column('created_ts', sa.DateTime))
+    op.add_column('task_run', sa.Column('finish_time_ts', sa.DateTime))
+    op.execute(TEXT_TO_TIMESTAMP)
+    op.execute(TASK_TRIGGER)
+    op.execute(TASK_RUN_TRIGGER)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER task_run_sync_timestamps ON task_run')
+    op.execute('DROP TRIGGER task_sync_timestamps ON task')
+    op.execute('DROP FUNCTION task_run_sync_timestamps()')
+    op.execute('DROP FUNCTION task_sync_timestamps()')
+    op.execute('DROP FUNCTION text_to_timestamp(TEXT)')
+    op.execute('DROP INDEX IF EXISTS task_run_project_id_finish_time_ts_idx')
+    op.execute('DROP INDEX IF EXISTS task_run_finish_time_ts_brin_idx')
+    op.execute('DROP INDEX IF EXISTS task_created_ts_brin_idx')
+    op.drop_column('task_run', 'finish_time_ts')
+    op.drop_column('task_run', 'created_ts')
+    op.drop_column('task', 'created_ts')
@@ -0,0 +1,57 @@
+"""partition task tables by project
+
+Revision ID: 8b3e5d2c7a19
+Revises: 5c7e9a1d3b2f
+Create Date: 2019-04-23 14:05:12.913406
+
+Optional: the tables are only converted when the migration is run with
+-x partition-by-project=true, see pybossa.partitioning.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8b3e5d2c7a19'
+down_revision = '5c7e9a1d3b2f'
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from pybossa import partitioning
+from pybossa.model import sync_timestamps_ddl
+
+
+TABLES = [
+    dict(name='task',
+         foreign_keys=['(project_id) REFERENCES project (id) '
+                       'ON DELETE CASCADE'],
+         unique_indexes=[],
+         indexes=[('task_project_id_idx', '(project_id)'),
+                  ('task_info_idx', '(md5(info::text))'),
+                  ('task_created_ts_brin_idx', 'USING brin (created_ts)')],
+         triggers=sync_timestamps_ddl('task', [('created', 'created_ts')])),
+    dict(name='task_run',
+         foreign_keys=['(project_id) REFERENCES project (id)',
+                       '(user_id) REFERENCES "user" (id)'],
+         unique_indexes=[('unique_user_id_task_id_idx',
+                          '(task_id, user_id, user_ip, external_uid)')],
+         indexes=[('task_run_task_id_idx', '(task_id)'),
+                  ('task_run_user_id_idx', '(user_id)'),
+                  ('task_run_project_id_idx', '(project_id)'),
+                  ('task_run_project_id_finish_time_ts_idx',
+                   '(project_id, finish_time_ts)'),
+                  ('task_run_finish_time_ts_brin_idx',
+                   'USING brin (finish_time_ts)')],
+         triggers=sync_timestamps_ddl('task_run',
+                                      [('created', 'created_ts'),
+                                       ('finish_time', 'finish_time_ts')]))]
+
+
+def upgrade():
+    xargs = context.get_x_argument(as_dictionary=True)
+    if xargs.get('partition-by-project', '').lower() in ('true', '1'):
+        partitioning.partition_tables(op.get_bind(), TABLES)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if partitioning.is_partitioned(conn):
+        partitioning.unpartition_tables(conn, TABLES)
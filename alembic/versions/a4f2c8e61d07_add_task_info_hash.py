@@ -0,0 +1,96 @@
+"""add task info hash
+
+Revision ID: a4f2c8e61d07
+Revises: 8b3e5d2c7a19
+Create Date: 2019-04-30 11:47:52.270841
+
+Ongoing tasks repeating the info of an older ongoing task of their project
+are left without a hash, so that the unique index can be built; they take
+the hash over when the older task is completed, edited or deleted.
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4f2c8e61d07'
+down_revision = '8b3e5d2c7a19'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TASK_INFO_HASH = '''
+    CREATE OR REPLACE FUNCTION task_info_hash()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        deduplicate BOOLEAN := TG_OP = 'INSERT' AND NEW.info_hash IS NOT NULL;
+    BEGIN
+        NEW.info_hash := md5(NEW.info::text);
+        IF NOT deduplicate AND NEW.state = 'ongoing' AND EXISTS (
+                SELECT 1 FROM task WHERE project_id = NEW.project_id
+                AND state = 'ongoing' AND info_hash = NEW.info_hash
+                AND id <> NEW.id) THEN
+            NEW.info_hash := NULL;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER task_info_hash
+    BEFORE INSERT OR UPDATE OF info, state ON task
+    FOR EACH ROW EXECUTE PROCEDURE task_info_hash();
+
+    CREATE OR REPLACE FUNCTION task_info_hash_release()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF OLD.state = 'ongoing' AND OLD.info_hash IS NOT NULL AND (
+                TG_OP = 'DELETE' OR NEW.state <> 'ongoing'
+                OR NEW.info_hash IS DISTINCT FROM OLD.info_hash) THEN
+            UPDATE task SET info_hash = OLD.info_hash
+            WHERE id = (SELECT id FROM task
+                        WHERE project_id = OLD.project_id
+                        AND state = 'ongoing' AND info_hash IS NULL
+                        AND md5(info::text) = OLD.info_hash
+                        ORDER BY id LIMIT 1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER task_info_hash_release
+    AFTER UPDATE OF info, state OR DELETE ON task
+    FOR EACH ROW EXECUTE PROCEDURE task_info_hash_release();'''
+
+
+def upgrade():
+    op.add_column('task', sa.Column('info_hash', sa.Text))
+    op.execute('''
+        UPDATE task SET info_hash = md5(info::text)
+        WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY project_id, md5(info::text)
+                    ORDER BY id) AS n
+                FROM task WHERE state = 'ongoing') AS ongoing
+            WHERE n > 1)
+        ''')
+    op.execute(TASK_INFO_HASH)
+    op.execute('''
+        CREATE UNIQUE INDEX task_project_id_info_hash_idx
+        ON task (project_id, info_hash) WHERE state = 'ongoing'
+        ''')
+    op.execute('''
+        CREATE INDEX task_project_id_info_md5_idx
+        ON task (project_id, md5(info::text))
+        WHERE state = 'ongoing' AND info_hash IS NULL
+        ''')
+    op.drop_index('task_info_idx', 'task')
+
+
+def downgrade():
+    op.create_index('task_info_idx', 'task', [sa.text('md5(info::text)')])
+    op.drop_index('task_project_id_info_md5_idx', 'task')
+    op.drop_index('task_project_id_info_hash_idx', 'task')
+    op.execute('DROP TRIGGER task_info_hash_release ON task')
+    op.execute('DROP TRIGGER task_info_hash ON task')
+    op.execute('DROP FUNCTION task_info_hash_release()')
+    op.execute('DROP FUNCTION task_info_hash()')
+    op.drop_column('task', 'info_hash')
@@ -0,0 +1,451 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+#!/usr/bin/env python
+"""
+Benchmarks of the hot paths of PYBOSSA.
+
+The benchmarks create a synthetic project of the given scale in the
+database of the current settings, and measure the schedulers, task run
+submissions, task imports, exports, the browse tasks query and the cache
+decorators. Results are printed, or written with --output, as JSON with
+ops/s, latency percentiles and SQL queries per operation, so that the
+results of two commits can be compared with --compare.
+
+The database is dropped and created again: run them with ./run_benchmarks,
+which uses the test settings, and never against a database you want to
+keep.
+"""
+import os
+import sys
+import json
+import time
+import random
+import optparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.sql import text
+
+os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = '1'
+
+from pybossa.core import create_app, db, sentinel, task_repo
+from pybossa.model.category import Category
+from pybossa.model.project import Project
+from pybossa.model.task import Task
+from pybossa.model.user import User
+
+app = create_app(run_as_server=False)
+
+SCHEDULERS = ['locked_scheduler', 'user_pref_scheduler',
+              'task_queue_scheduler', 'breadth_first', 'depth_first',
+              'depth_first_all', 'incremental']
+
+
+class QueryCounter(object):
+
+    """Count the SQL statements run on the master and slave engines."""
+
+    def __init__(self):
+        self.count = 0
+        self.engines = set([db.engine, db.get_engine(app, bind='slave')])
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._count)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(name, op, repeat, before=None, after=None, items=1):
+    """Time repeat calls of op(i), after a warm up call.
+
+    before(i) and after(i) run around each call, untimed. items is the
+    number of items, such as tasks, processed by each call.
+    """
+    if before:
+        before(-1)
+    op(-1)
+    if after:
+        after(-1)
+    timings = []
+    queries = 0
+    for i in range(repeat):
+        if before:
+            before(i)
+        with QueryCounter() as counter:
+            start = time.time()
+            op(i)
+            timings.append(time.time() - start)
+        queries += counter.count
+        if after:
+            after(i)
+    total = sum(timings)
+    result = dict(name=name, ops=repeat,
+                  ops_per_sec=round(repeat / total, 2) if total else None,
+                  items_per_sec=(round(repeat * items / total, 2)
+                                 if total else None),
+                  mean_ms=round(total * 1000 / repeat, 3),
+                  p50_ms=round(percentile(timings, 50) * 1000, 3),
+                  p99_ms=round(percentile(timings, 99) * 1000, 3),
+                  queries_per_op=round(float(queries) / repeat, 2))
+    print >> sys.stderr, ('%(name)-40s %(ops_per_sec)10s ops/s '
+                          'p50 %(p50_ms)8s ms  p99 %(p99_ms)8s ms  '
+                          '%(queries_per_op)6s queries' % result)
+    return result
+
+
+@contextmanager
+def config(**settings):
+    original = dict((key, app.config.get(key)) for key in settings)
+    app.config.update(settings)
+    try:
+        yield
+    finally:
+        app.config.update(original)
+
+
+def rebuild_db():
+    """Drop and create the database, and flush Redis."""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    sentinel.master.flushall()
+
+
+def create_users(n_users):
+    users = [User(name=u'bench%d' % i, fullname=u'Bench %d' % i,
+                  email_addr=u'bench%d@example.com' % i,
+                  api_key='bench-api-key-%d' % i)
+             for i in range(n_users)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def create_project(short_name, owner_id, n_tasks, n_task_runs, user_ids):
+    """Create a published project with n_tasks tasks and n_task_runs task
+    runs, spread over the tasks and users."""
+    category = db.session.query(Category).first()
+    if category is None:
+        category = Category(name=u'Bench', short_name=u'bench',
+                            description=u'Benchmarks')
+        db.session.add(category)
+        db.session.commit()
+    project = Project(name=short_name, short_name=short_name,
+                      description=short_name, owner_id=owner_id,
+                      category_id=category.id, published=True,
+                      info=dict(task_presenter='<div></div>'))
+    db.session.add(project)
+    db.session.commit()
+    n_answers = max(1, (n_task_runs / max(n_tasks, 1)) + 2)
+    for start in range(0, n_tasks, 1000):
+        tasks = [Task(project_id=project.id, n_answers=n_answers,
+                      priority_0=random.random(),
+                      info=dict(url='http://example.com/%d.jpg' % i,
+                                question=u'Question %d' % i))
+                 for i in range(start, min(start + 1000, n_tasks))]
+        task_repo.insert_tasks(project.id, tasks)
+    create_task_runs(project.id, n_task_runs, user_ids)
+    return project
+
+
+def create_task_runs(project_id, n_task_runs, user_ids):
+    """Insert task runs in bulk, and the counters and aggregates that the
+    task run event listeners would keep."""
+    sql = text('''
+               INSERT INTO task_run (created, finish_time, project_id, task_id,
+                                     user_id, info)
+               SELECT to_char(now() - (n || ' minutes')::interval,
+                              'YYYY-MM-DD"T"HH24:MI:SS.US'),
+                      to_char(now() - (n || ' minutes')::interval
+                              + interval '30 seconds',
+                              'YYYY-MM-DD"T"HH24:MI:SS.US'),
+                      :project_id, task_ids[1 + n % array_length(task_ids, 1)],
+                      (:user_ids)[1 + n % :n_users], '{"answer": "yes"}'
+               FROM generate_series(0, :n_task_runs - 1) AS n,
+                    (SELECT array_agg(id ORDER BY id) AS task_ids FROM task
+                     WHERE project_id=:project_id) AS tasks
+               ''')
+    db.session.execute(sql, dict(project_id=project_id,
+                                 n_task_runs=n_task_runs,
+                                 user_ids=user_ids, n_users=len(user_ids)))
+    sql = text('''
+               UPDATE counter SET n_task_runs=runs.n
+               FROM (SELECT task_id, COUNT(id) AS n FROM task_run
+                     WHERE project_id=:project_id GROUP BY task_id) AS runs
+               WHERE counter.task_id=runs.task_id
+               ''')
+    db.session.execute(sql, dict(project_id=project_id))
+    sql = text('''
+               INSERT INTO task_aggregate (task_id, project_id, n_task_runs,
+                                           last_finish_time)
+               SELECT task_id, project_id, COUNT(id), MAX(finish_time)
+               FROM task_run WHERE project_id=:project_id
+               GROUP BY task_id, project_id
+               ''')
+    db.session.execute(sql, dict(project_id=project_id))
+    db.session.commit()
+
+
+def bench_schedulers(scale, user_ids):
+    from pybossa import sched
+    results = []
+    project = create_project(u'bench_sched', user_ids[0], scale.tasks,
+                             scale.task_runs, user_ids)
+    sched.rebuild_task_queue(project.id)
+
+    for name in SCHEDULERS:
+        def op(i):
+            sched.new_task(project.id, name, user_id=user_ids[i])
+
+        def after(i):
+            sched.release_user_locks(user_ids[i])
+        results.append(measure('sched.new_task[%s]' % name, op,
+                               min(scale.repeat, len(user_ids) - 1),
+                               after=after))
+    return results
+
+
+def bench_task_run_post(scale, user_ids):
+    project = create_project(u'bench_submit', user_ids[0], scale.tasks, 0,
+                             user_ids)
+    client = app.test_client()
+    users = dict(db.session.query(User.id, User.api_key))
+    submission = {}
+
+    def before(i):
+        api_key = users[user_ids[i % len(user_ids)]]
+        res = client.get('/api/project/%s/newtask?api_key=%s'
+                         % (project.id, api_key))
+        task = json.loads(res.data)
+        submission['url'] = '/api/taskrun?api_key=%s' % api_key
+        submission['data'] = json.dumps(dict(project_id=project.id,
+                                             task_id=task['id'],
+                                             info=dict(answer='yes')))
+
+    def op(i):
+        res = client.post(submission['url'], data=submission['data'])
+        if res.status_code != 200:
+            raise RuntimeError('Task run rejected: %s' % res.data)
+
+    return [measure('TaskRunAPI.post', op, scale.repeat, before=before)]
+
+
+def bench_import(scale, user_ids):
+    from pybossa.importers import Importer
+    project = create_project(u'bench_import', user_ids[0], 0, 0, user_ids)
+    importer = Importer()
+    csv_file = {}
+
+    def before(i):
+        fd, csv_file['name'] = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as out:
+            out.write('url,question\n')
+            for n in range(scale.import_size):
+                out.write('http://example.com/%d/%d.jpg,Question %d\n'
+                          % (i, n, n))
+
+    def op(i):
+        importer.create_tasks(task_repo, project, type='localCSV',
+                              csv_filename=csv_file['name'])
+
+    return [measure('Importer.create_tasks[localCSV]', op,
+                    max(1, scale.repeat / 10), before=before,
+                    items=scale.import_size)]
+
+
+def bench_exporters(scale, user_ids):
+    from pybossa.core import csv_exporter, json_exporter
+    project = create_project(u'bench_export', user_ids[0], scale.tasks,
+                             scale.task_runs, user_ids)
+    repeat = max(1, scale.repeat / 10)
+    results = []
+    for table, items in [('task', scale.tasks),
+                         ('task_run', scale.task_runs)]:
+        def csv_op(i):
+            for _ in csv_exporter._respond_csv(table, project.id):
+                pass
+
+        def json_op(i):
+            for _ in json_exporter.gen_json(table, project.id):
+                pass
+        results.append(measure('CsvExporter[%s]' % table, csv_op, repeat,
+                               items=items))
+        results.append(measure('JsonExporter[%s]' % table, json_op, repeat,
+                               items=items))
+    return results
+
+
+def bench_browse_tasks(scale, user_ids):
+    from pybossa.cache.projects import browse_tasks_page
+    from pybossa.cache.task_browse_helpers import parse_tasks_browse_args
+    project = create_project(u'bench_browse', user_ids[0], scale.tasks,
+                             scale.task_runs, user_ids)
+    results = []
+
+    def page_args(offset=0, **query):
+        args = parse_tasks_browse_args(query)
+        args.update(records_per_page=10, offset=offset)
+        return args
+
+    deep = page_args(order_by='priority desc')
+    deep['offset'] = max(0, scale.tasks / 2)
+    keyset = page_args(order_by='priority desc')
+    for _ in range(scale.tasks / 20):
+        page = browse_tasks_page(project.id, keyset)
+        if not page['next_cursor']:
+            break
+        keyset = page_args(order_by='priority desc',
+                           after=page['next_cursor'])
+    cases = [('first_page', page_args()),
+             ('pcomplete_filter', page_args(pcomplete_from=10,
+                                            pcomplete_to=90)),
+             ('deep_offset', deep),
+             ('deep_keyset', keyset)]
+    for name, args in cases:
+        def op(i):
+            browse_tasks_page(project.id, args)
+        results.append(measure('browse_tasks[%s]' % name, op, scale.repeat))
+    return results
+
+
+def bench_cache(scale, user_ids):
+    from pybossa.cache import memoize, get_cache_stats, reset_cache_stats
+
+    @memoize(timeout=300)
+    def cached_value(key):
+        return dict(key=key, values=range(100))
+
+    results = []
+    del os.environ['PYBOSSA_REDIS_CACHE_DISABLED']
+    try:
+        for local in (False, True):
+            with config(CACHE_LOCAL_ENABLED=local):
+                reset_cache_stats()
+                tier = 'redis+local' if local else 'redis'
+                results.append(measure('memoize[%s,hit]' % tier,
+                                       lambda i: cached_value('hit'),
+                                       scale.repeat * 10))
+                results.append(measure('memoize[%s,miss]' % tier,
+                                       lambda i: cached_value('%s%s'
+                                                              % (tier, i)),
+                                       scale.repeat * 10))
+                # Make sure the tier measured is the one named
+                stats = get_cache_stats()['local']
+                assert bool(stats['hits']) == local, stats
+    finally:
+        os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = '1'
+    return results
+
+
+BENCHMARKS = [('sched', bench_schedulers),
+              ('submit', bench_task_run_post),
+              ('import', bench_import),
+              ('export', bench_exporters),
+              ('browse', bench_browse_tasks),
+              ('cache', bench_cache)]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    """Print the change of ops/s and queries per op of each benchmark from
+    a baseline report."""
+    previous = dict((r['name'], r) for r in baseline['results'])
+    for result in results:
+        before = previous.get(result['name'])
+        if before is None or not before['ops_per_sec']:
+            continue
+        change = (result['ops_per_sec'] / before['ops_per_sec'] - 1) * 100
+        print >> sys.stderr, ('%-40s %+8.1f%% ops/s  %6s -> %s queries'
+                              % (result['name'], change,
+                                 before['queries_per_op'],
+                                 result['queries_per_op']))
+
+
+def main():
+    parser = optparse.OptionParser('%prog [options]')
+    parser.add_option('--tasks', type='int', default=1000,
+                      help='Tasks of each synthetic project')
+    parser.add_option('--task-runs', type='int', default=5000,
+                      dest='task_runs',
+                      help='Task runs of each synthetic project')
+    parser.add_option('--users', type='int', default=200,
+                      help='Synthetic users')
+    parser.add_option('--import-size', type='int', default=1000,
+                      dest='import_size', help='Tasks of each import')
+    parser.add_option('--repeat', type='int', default=100,
+                      help='Timed operations of each benchmark')
+    parser.add_option('--only', default=None,
+                      help='Comma separated benchmarks to run, out of: %s'
+                      % ', '.join(name for name, _ in BENCHMARKS))
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--output', default=None,
+                      help='Write the JSON report to this file')
+    parser.add_option('--compare', default=None,
+                      help='JSON report of a previous run to compare with')
+    scale, args = parser.parse_args()
+
+    only = scale.only.split(',') if scale.only else None
+    random.seed(scale.seed)
+    results = []
+    with app.app_context():
+        rebuild_db()
+        user_ids = create_users(scale.users)
+        for name, benchmark in BENCHMARKS:
+            if only is None or name in only:
+                results.extend(benchmark(scale, user_ids))
+        db.session.remove()
+
+    report = dict(commit=git_commit(), created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  scale=dict(tasks=scale.tasks, task_runs=scale.task_runs,
+                             users=scale.users, import_size=scale.import_size,
+                             repeat=scale.repeat, seed=scale.seed),
+                  results=results)
+    if scale.compare:
+        with open(scale.compare) as baseline:
+            compare(json.load(baseline), results)
+    if scale.output:
+        with open(scale.output, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -641,6 +641,79 @@ def update_counters():
                                    n_task_runs=result.n_task_runs))
         db.session.commit()
 
+def rebuild_leaderboards():
+    """Rebuild the incremental leaderboards from the database."""
+    from pybossa.leaderboard import scores
+    with app.app_context():
+        for info in [None] + list(app.config.get('LEADERBOARDS') or []):
+            n_users = scores.rebuild(info)
+            print "Leaderboard %s rebuilt with %s users" % (info or 'default',
+                                                            n_users)
+
+def backfill_timestamps(batch_size=10000):
+    """Fill in the timestamp columns of tasks and task runs, and index them."""
+    batch_size = int(batch_size)
+    tables = [('task', [('created', 'created_ts')]),
+              ('task_run', [('created', 'created_ts'),
+                            ('finish_time', 'finish_time_ts')])]
+    indexes = [
+        'task_run_project_id_finish_time_ts_idx ON task_run '
+        '(project_id, finish_time_ts)',
+        'task_run_finish_time_ts_brin_idx ON task_run '
+        'USING brin (finish_time_ts)',
+        'task_created_ts_brin_idx ON task USING brin (created_ts)']
+    with app.app_context():
+        for table, columns in tables:
+            assignments = ', '.join('%s = text_to_timestamp(%s)'
+                                    % (ts_column, column)
+                                    for column, ts_column in columns)
+            max_id = db.engine.execute(
+                'SELECT MAX(id) FROM %s' % table).scalar() or 0
+            for start in range(0, max_id, batch_size):
+                # One transaction per batch, so that rows are only locked
+                # for the time of their batch.
+                sql = text('''UPDATE %s SET %s
+                           WHERE id > :start AND id <= :end'''
+                           % (table, assignments))
+                db.engine.execute(sql, start=start, end=start + batch_size)
+                print "%s: %s of %s rows" % (table,
+                                            min(start + batch_size, max_id),
+                                            max_id)
+        conn = db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        try:
+            for index in indexes:
+                print "Creating index %s" % index.split()[0]
+                conn.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s'
+                             % index)
+        finally:
+            conn.close()
+
+def partition_tables():
+    """Partition the task and task_run tables by project."""
+    from pybossa import partitioning
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if not partitioning.is_supported(conn):
+                print "Partitioning requires PostgreSQL 13 or later"
+                return
+            if partitioning.is_partitioned(conn):
+                print "The task tables are already partitioned"
+                return
+            partitioning.partition_tables(conn)
+        print "The task tables are partitioned by project"
+
+def unpartition_tables():
+    """Convert the task and task_run tables back to plain tables."""
+    from pybossa import partitioning
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if not partitioning.is_partitioned(conn):
+                print "The task tables are not partitioned"
+                return
+            partitioning.unpartition_tables(conn)
+        print "The task tables are no longer partitioned"
+
 def update_project_stats():
     """Update project stats for draft projects."""
     from pybossa.core import db
@@ -693,6 +766,8 @@ def clean_project(project_id, skip_tasks=False):
     db.engine.execute(sql)
     sql = 'delete from counter where project_id=%s' % project_id
     db.engine.execute(sql)
+    sql = 'delete from task_aggregate where project_id=%s' % project_id
+    db.engine.execute(sql)
     sql = 'delete from project_stats where project_id=%s' % project_id
     db.engine.execute(sql)
     sql = """INSERT INTO project_stats 
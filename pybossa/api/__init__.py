@@ -67,7 +67,8 @@ from completed_task import CompletedTaskAPI
 from completed_task_run import CompletedTaskRunAPI
 from pybossa.cache.helpers import n_available_tasks, n_available_tasks_for_user
 from pybossa.sched import (get_project_scheduler_and_timeout, get_scheduler_and_timeout,
-                           has_lock, release_lock, Schedulers, get_locks)
+                           has_lock, release_lock, get_locks,
+                           is_locking_scheduler, get_lock_expirations)
 from pybossa.api.project_by_name import ProjectByNameAPI
 from pybossa.api.pwd_manager import get_pwd_manager
 from pybossa.data_access import data_access_levels
@@ -154,15 +155,7 @@ def new_task(project_id):
         # If there is a task for the user, return it
         if tasks is not None:
             guard = ContributionsGuard(sentinel.master, timeout=timeout)
-            for task in tasks:
-                guard.stamp(task, user_id_or_ip)
-                if not guard.check_task_presented_timestamp(task, user_id_or_ip):
-                    guard.stamp_presented_time(task, user_id_or_ip)
-                else:
-                    # user returning back for the same task
-                    # original presented time has not expired yet
-                    # to continue original presented time, extend expiry
-                    guard.extend_task_presented_timestamp_expiry(task, user_id_or_ip)
+            guard.stamp_tasks(tasks, user_id_or_ip)
 
             data = [task.dictize() for task in tasks]
             add_task_signature(data)
@@ -180,7 +173,46 @@ def new_task(project_id):
         return error.format_exception(e, target='project', action='GET')
 
 
-def _retrieve_new_task(project_id):
+@jsonpify
+@blueprint.route('/project/<project_id>/prefetch')
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def prefetch_tasks(project_id):
+    """Return up to limit new tasks for a project, locked for the user.
+
+    The response is a list of tasks, each with the number of seconds until
+    the user's lock on it expires (null for non locking schedulers).
+    """
+    try:
+        tasks, timeout, cookie_handler = _retrieve_new_task(project_id,
+                                                            prefetch=True)
+
+        if type(tasks) is Response:
+            return tasks
+
+        data = []
+        if tasks:
+            user_id_or_ip = get_user_id_or_ip()
+            guard = ContributionsGuard(sentinel.master, timeout=timeout)
+            guard.stamp_tasks(tasks, user_id_or_ip)
+            expirations = {}
+            if not current_user.is_anonymous:
+                expirations = get_lock_expirations(
+                    [task.id for task in tasks], current_user.id)
+            data = [task.dictize() for task in tasks]
+            add_task_signature(data)
+            for task in data:
+                task['lock_expires'] = expirations.get(task['id'])
+
+        response = make_response(json.dumps(data))
+        response.mimetype = "application/json"
+        if cookie_handler:
+            cookie_handler(response)
+        return response
+    except Exception as e:
+        return error.format_exception(e, target='project', action='GET')
+
+
+def _retrieve_new_task(project_id, prefetch=False):
 
     project = project_repo.get(project_id)
     if project is None or not(project.published or current_user.admin
@@ -217,6 +249,9 @@ def _retrieve_new_task(project_id):
     if limit > 100:
         limit = 100
 
+    if prefetch:
+        limit = min(limit, current_app.config.get('SCHED_PREFETCH_LIMIT', 10))
+
     if request.args.get('offset'):
         offset = int(request.args.get('offset'))
     else:
@@ -258,7 +293,8 @@ def _retrieve_new_task(project_id):
                           orderby=orderby,
                           desc=desc,
                           rand_within_priority=sched_rand_within_priority,
-                          gold_only = user.get_quiz_in_progress(project))
+                          gold_only = user.get_quiz_in_progress(project),
+                          prefetch=prefetch)
 
     handler = partial(pwd_manager.update_response, project=project,
                       user=user_id_or_ip)
@@ -375,7 +411,7 @@ def cancel_task(task_id=None):
 
     user_id = current_user.id
     scheduler, timeout = get_scheduler_and_timeout(project)
-    if scheduler in (Schedulers.locked, Schedulers.user_pref):
+    if is_locking_scheduler(scheduler):
         task_locked_by_user = has_lock(task_id, user_id, timeout)
         if task_locked_by_user:
             release_lock(task_id, user_id, timeout)
@@ -386,6 +422,22 @@ def cancel_task(task_id=None):
     return Response(json.dumps({'success': True}), 200, mimetype="application/json")
 
 
+@jsonpify
+@csrf.exempt
+@blueprint.route('/taskrun/bulk', methods=['POST'])
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def bulk_task_runs():
+    """Save a list of task runs of the current user at once.
+
+    Each task run is checked as in POST /api/taskrun, and the response lists
+    the id of each saved task run or the error that prevented saving it.
+    """
+    try:
+        return TaskRunAPI().post_bulk()
+    except Exception as e:
+        return error.format_exception(e, target='taskrun', action='POST')
+
+
 @jsonpify
 @blueprint.route('/task/<int:task_id>/lock', methods=['GET'])
 @ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
@@ -405,7 +457,7 @@ def fetch_lock(task_id):
             task.project_id)
 
     ttl = None
-    if scheduler in (Schedulers.locked, Schedulers.user_pref):
+    if is_locking_scheduler(scheduler):
         task_locked_by_user = has_lock(
                 task.id, current_user.id, timeout)
         if task_locked_by_user:
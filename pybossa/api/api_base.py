@@ -27,7 +27,7 @@ This package adds GET, POST, PUT and DELETE methods for any class:
 
 """
 import json
-from flask import request, abort, Response, current_app
+from flask import request, abort, Response, current_app, stream_with_context
 from flask_login import current_user
 from flask.views import MethodView
 from werkzeug.exceptions import NotFound, Unauthorized, Forbidden, BadRequest
@@ -49,7 +49,8 @@ from pybossa.cache.users import delete_user_summary_id
 from pybossa.cache.categories import reset
 
 repos = {'Task': {'repo': task_repo, 'filter': 'filter_tasks_by',
-                  'get': 'get_task', 'save': 'save', 'update': 'update',
+                  'get': 'get_task', 'save': 'save_deduplicated',
+                  'update': 'update',
                   'delete': 'delete'},
          'TaskRun': {'repo': task_repo, 'filter': 'filter_task_runs_by',
                      'get': 'get_task_run',  'save': 'save',
@@ -88,6 +89,17 @@ cors_headers = ['Content-Type', 'Authorization']
 error = ErrorStatus()
 
 
+def _chunks(iterable, size):
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 class APIBase(MethodView):
 
     """Class to create CRUD methods."""
@@ -100,6 +112,13 @@ class APIBase(MethodView):
 
     immutable_keys = set(['short_name'])
 
+    # Columns _select_attributes needs, besides the ones requested with
+    # fields. None means every column
+    projection_keys = set()
+
+    # Number of streamed items whose related objects are loaded at once
+    STREAM_CHUNK_SIZE = 100
+
     def refresh_cache(self, cls_name, oid):
         """Refresh the cache."""
         if caching.get(cls_name):
@@ -133,6 +152,9 @@ class APIBase(MethodView):
         """
         try:
             ensure_authorized_to('read', self.__class__)
+            stream = fuzzyboolean(request.args.get('stream') or False)
+            if oid is None and stream:
+                return self._create_stream_response()
             query = self._db_query(oid)
             json_response = self._create_json_response(query, oid)
             return Response(json_response, mimetype='application/json')
@@ -145,33 +167,12 @@ class APIBase(MethodView):
     def _create_json_response(self, query_result, oid):
         if len(query_result) == 1 and query_result[0] is None:
             raise abort(404)
+        related = self._get_related(query_result)
         items = []
         for result in query_result:
-            # This is for n_favs orderby case
-            if not isinstance(result, DomainObject):
-                if 'n_favs' in result.keys():
-                    result = result[0]
-            try:
-                if (result.__class__ != self.__class__):
-                    (item, headline, rank) = result
-                else:
-                    item = result
-                    headline = None
-                    rank = None
-                if not self._verify_auth(item):
-                    continue
-                datum = self._create_dict_from_model(item)
-                if headline:
-                    datum['headline'] = headline
-                if rank:
-                    datum['rank'] = rank
-                ensure_authorized_to('read', item)
+            datum = self._create_item(result, related=related)
+            if datum is not None:
                 items.append(datum)
-            except (Forbidden, Unauthorized):
-                # pass as it is 401 or 403
-                pass
-            except Exception:  # pragma: no cover
-                raise
         if oid is not None:
             if not items:
                 raise Forbidden('Forbidden')
@@ -180,54 +181,153 @@ class APIBase(MethodView):
             items = items[0]
         return json.dumps(items)
 
-    def _create_dict_from_model(self, model):
-        return self._select_attributes(self._add_hateoas_links(model))
+    def _unpack_result(self, result):
+        """Return the item, headline and rank of a query result."""
+        # This is for n_favs orderby case
+        if not isinstance(result, DomainObject):
+            if 'n_favs' in result.keys():
+                result = result[0]
+        if (result.__class__ != self.__class__):
+            return result
+        return result, None, None
+
+    def _create_item(self, result, fields=None, links=True, related=None):
+        """Return the dict of a query result, or None if the user is not
+        allowed to read it."""
+        try:
+            item, headline, rank = self._unpack_result(result)
+            if not self._verify_auth(item):
+                return None
+            datum = self._create_dict_from_model(item, fields, links,
+                                                 related)
+            if headline:
+                datum['headline'] = headline
+            if rank:
+                datum['rank'] = rank
+            ensure_authorized_to('read', item)
+            return datum
+        except (Forbidden, Unauthorized):
+            # pass as it is 401 or 403
+            return None
+
+    def _create_stream_response(self):
+        """Stream the items of a list query as newline delimited JSON,
+        read from a server side cursor in id order.
 
-    def _add_hateoas_links(self, item):
+        Up to API_STREAM_LIMIT items are returned per request; the next
+        ones are requested with the id of the last item as last_id. Only
+        the columns listed in fields are returned, if given, and
+        hateoas=0 leaves out the links of the items.
+        """
+        repo_info = repos[self.__class__.__name__]
+        max_limit = current_app.config.get('API_STREAM_LIMIT', 10000)
+        try:
+            limit = min(max_limit, int(request.args.get('limit')))
+        except (ValueError, TypeError):
+            limit = max_limit
+        fields = request.args.get('fields')
+        if fields:
+            fields = [field.strip() for field in fields.split(',')]
+            for field in fields:
+                # Raise an error if the field is not a column
+                getattr(self.__class__, field)
+        links = fuzzyboolean(request.args.get('hateoas') or True)
+        results = self._filter_query(repo_info, limit, 0, 'id', yielded=True)
+
+        def generate():
+            for chunk in _chunks(results, self.STREAM_CHUNK_SIZE):
+                related = self._get_related(chunk) if links else None
+                for result in chunk:
+                    datum = self._create_item(result, fields, links, related)
+                    if datum is not None:
+                        yield json.dumps(datum) + '\n'
+
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+
+    def _create_dict_from_model(self, model, fields=None, links=True,
+                                related=None):
+        if fields is None:
+            return self._select_attributes(
+                self._add_hateoas_links(model, links, related))
+        if self.projection_keys is None:
+            obj = self._select_attributes(model.dictize())
+        else:
+            keys = set(fields) | self.projection_keys
+            obj = self._select_attributes(model.dictize(keys))
+        obj = dict((key, obj[key]) for key in fields if key in obj)
+        if links:
+            self._add_links(model, obj)
+        return obj
+
+    def _get_related(self, query_result):
+        """Load the objects related to a page of items, asked for with the
+        related and stats arguments, with one query per kind of object
+        instead of a few queries per item."""
+        related = dict(tasks={}, task_runs={}, results={}, stats=None)
+        items = [self._unpack_result(result)[0] for result in query_result
+                 if result is not None]
+        cls_name = items[0].__class__.__name__ if items else None
+        if (request.args.get('related') and
+                cls_name in ('Task', 'TaskRun', 'Result')):
+            if cls_name == 'Task':
+                task_ids = list(set(item.id for item in items))
+            else:
+                task_ids = list(set(item.task_id for item in items))
+            if cls_name in ('TaskRun', 'Result'):
+                related['tasks'] = dict((task.id, task) for task in
+                                        task_repo.get_tasks(task_ids))
+            if cls_name in ('Task', 'Result'):
+                for task_run in task_repo.get_task_runs_of_tasks(task_ids):
+                    related['task_runs'].setdefault(task_run.task_id,
+                                                    []).append(task_run)
+            if cls_name in ('Task', 'TaskRun'):
+                for result in result_repo.get_last_versions(task_ids):
+                    related['results'][result.task_id] = result
+        if request.args.get('stats') and cls_name == 'Project':
+            stats = project_stats_repo.filter_by()
+            related['stats'] = stats[0].dictize() if stats else {}
+        return related
+
+    def _add_hateoas_links(self, item, links=True, related=None):
         obj = item.dictize()
-        related = request.args.get('related')
-        if related:
-            if item.__class__.__name__ == 'Task':
-                obj['task_runs'] = []
-                obj['result'] = None
-                task_runs = task_repo.filter_task_runs_by(task_id=item.id)
-                results = result_repo.filter_by(task_id=item.id, last_version=True)
-                for tr in task_runs:
-                    obj['task_runs'].append(tr.dictize())
-                for r in results:
-                    obj['result'] = r.dictize()
-
-            if item.__class__.__name__ == 'TaskRun':
-                tasks = task_repo.filter_tasks_by(id=item.task_id)
-                results = result_repo.filter_by(task_id=item.task_id, last_version=True)
-                obj['task'] = None
-                obj['result'] = None
-                for t in tasks:
-                    obj['task'] = t.dictize()
-                for r in results:
-                    obj['result'] = r.dictize()
-
-            if item.__class__.__name__ == 'Result':
-                tasks = task_repo.filter_tasks_by(id=item.task_id)
-                task_runs = task_repo.filter_task_runs_by(task_id=item.task_id)
-                obj['task_runs'] = []
-                for t in tasks:
-                    obj['task'] = t.dictize()
-                for tr in task_runs:
-                    obj['task_runs'].append(tr.dictize())
-
-        stats = request.args.get('stats')
-        if stats:
-            if item.__class__.__name__ == 'Project':
-                stats = project_stats_repo.filter_by()
-                obj['stats'] = stats[0].dictize() if stats else {}
+        if not links:
+            return obj
+        if related is None:
+            related = self._get_related([item])
+        cls_name = item.__class__.__name__
+        if request.args.get('related'):
+            if cls_name == 'Task':
+                obj['task_runs'] = [tr.dictize() for tr in
+                                    related['task_runs'].get(item.id, [])]
+                result = related['results'].get(item.id)
+                obj['result'] = result.dictize() if result else None
+
+            if cls_name == 'TaskRun':
+                task = related['tasks'].get(item.task_id)
+                result = related['results'].get(item.task_id)
+                obj['task'] = task.dictize() if task else None
+                obj['result'] = result.dictize() if result else None
+
+            if cls_name == 'Result':
+                task = related['tasks'].get(item.task_id)
+                if task:
+                    obj['task'] = task.dictize()
+                obj['task_runs'] = [tr.dictize() for tr in
+                                    related['task_runs'].get(item.task_id, [])]
+
+        if request.args.get('stats') and cls_name == 'Project':
+            obj['stats'] = related['stats']
+
+        self._add_links(item, obj)
+        return obj
 
+    def _add_links(self, item, obj):
         links, link = self.hateoas.create_links(item)
         if links:
             obj['links'] = links
         if link:
             obj['link'] = link
-        return obj
 
     def _db_query(self, oid):
         """Returns a list with the results of the query"""
@@ -248,12 +348,14 @@ class APIBase(MethodView):
             del filters['owner_id']
         return filters
 
-    def _filter_query(self, repo_info, limit, offset, orderby):
+    def _filter_query(self, repo_info, limit, offset, orderby,
+                      yielded=False):
         filters = {}
         for k in request.args.keys():
             if k not in ['limit', 'offset', 'api_key', 'last_id', 'all',
                          'fulltextsearch', 'desc', 'orderby', 'related',
-                         'participated', 'full', 'stats']:
+                         'participated', 'full', 'stats', 'stream',
+                         'fields', 'hateoas']:
                 # Raise an error if the k arg is not a column
                 if self.__class__ == Task and k == 'external_uid':
                     pass
@@ -269,18 +371,20 @@ class APIBase(MethodView):
             filters['participated'] = get_user_id_or_ip()
         fulltextsearch = request.args.get('fulltextsearch')
         desc = request.args.get('desc') if request.args.get('desc') else False
-        desc = fuzzyboolean(desc)
+        desc = fuzzyboolean(desc) and not yielded
         if last_id:
             results = getattr(repo, query_func)(limit=limit, last_id=last_id,
                                                 fulltextsearch=fulltextsearch,
                                                 desc=False,
                                                 orderby=orderby,
+                                                yielded=yielded,
                                                 **filters)
         else:
             results = getattr(repo, query_func)(limit=limit, offset=offset,
                                                 fulltextsearch=fulltextsearch,
                                                 desc=desc,
                                                 orderby=orderby,
+                                                yielded=yielded,
                                                 **filters)
         return results
 
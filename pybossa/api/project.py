@@ -51,6 +51,7 @@ class ProjectAPI(APIBase):
                          'published', 'secret_key'])
     private_keys = set(['secret_key'])
     restricted_keys = set()
+    projection_keys = None
 
     def _create_instance_from_request(self, data):
         inst = super(ProjectAPI, self)._create_instance_from_request(data)
@@ -29,6 +29,7 @@ class ProjectStatsAPI(APIBase):
     """Class for domain object ProjectStats."""
 
     __class__ = ProjectStats
+    projection_keys = set(['info'])
 
     def _select_attributes(self, stats_data):
         if not request.args.get('full'):
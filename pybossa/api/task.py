@@ -54,6 +54,8 @@ class TaskAPI(APIBase):
 
     immutable_keys = set(['project_id'])
 
+    projection_keys = set(['project_id'])
+
     def _forbidden_attributes(self, data):
         for key in data.keys():
             if key in self.reserved_keys:
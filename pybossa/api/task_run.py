@@ -23,15 +23,22 @@ This package adds GET, POST, PUT and DELETE methods for:
 
 """
 from copy import deepcopy
+from functools import partial
 import json
+import shutil
+import threading
 import time
 
 from datetime import datetime
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from tempfile import SpooledTemporaryFile
 
 from flask import request, Response, current_app
 from flask import current_app as app
 from flask_login import current_user
-from werkzeug.exceptions import Forbidden, BadRequest
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import Forbidden, BadRequest, GatewayTimeout
 
 from api_base import APIBase
 from pybossa.model.task_run import TaskRun
@@ -41,15 +48,19 @@ from pybossa.core import task_repo, sentinel, anonymizer, project_repo, user_rep
 from pybossa.core import performance_stats_repo
 from pybossa.cloud_store_api.s3 import s3_upload_from_string
 from pybossa.cloud_store_api.s3 import s3_upload_file_storage
+from pybossa.cloud_store_api.s3 import delete_file_from_s3, get_s3_url
 from pybossa.contributions_guard import ContributionsGuard
 from pybossa.auth import jwt_authorize_project
 from pybossa.sched import can_post
+from pybossa import sched
 from pybossa.model.completion_event import mark_if_complete
+from pybossa import submission_pipeline
 from pybossa.core import uploader
 from pybossa.auth import ensure_authorized_to, is_authorized
 from pybossa.cloud_store_api.s3 import upload_json_data
 from pybossa.model.performance_stats import StatType, PerformanceStats
 from pybossa.stats.gold import ConfusionMatrix, RightWrongCount
+from pybossa.error import ErrorStatus
 
 
 class TaskRunAPI(APIBase):
@@ -65,13 +76,16 @@ class TaskRunAPI(APIBase):
     immutable_keys = set(['project_id', 'task_id'])
 
     def _preprocess_post_data(self, data):
-        with_encryption = app.config.get('ENABLE_ENCRYPTION')
-        upload_root_dir = app.config.get('S3_UPLOAD_DIRECTORY')
         if current_user.is_anonymous:
             raise Forbidden('')
         task_id = data['task_id']
         project_id = data['project_id']
         self.check_can_post(project_id, task_id)
+        self._upload_answer(project_id, task_id, data)
+
+    def _upload_answer(self, project_id, task_id, data):
+        with_encryption = app.config.get('ENABLE_ENCRYPTION')
+        upload_root_dir = app.config.get('S3_UPLOAD_DIRECTORY')
         preprocess_task_run(project_id, task_id, data)
         info = data['info']
         path = "{0}/{1}/{2}".format(project_id, task_id, current_user.id)
@@ -134,17 +148,24 @@ class TaskRunAPI(APIBase):
         guard._remove_task_stamped(task, get_user_id_or_ip())
 
     def _after_save(self, original_data, instance):
+        if submission_pipeline.is_enabled():
+            submission_pipeline.push(instance, original_data.get('info'))
+            return
         mark_if_complete(instance.task_id, instance.project_id)
         update_gold_stats(instance.user_id, instance.task_id, original_data)
         update_quiz(instance.task_id, instance.project_id, original_data['info'])
 
     def _add_timestamps(self, taskrun, task, guard):
+        presented = guard.retrieve_presented_timestamp(task, get_user_id_or_ip())
+        self._set_timestamps(taskrun, presented)
+
+    def _set_timestamps(self, taskrun, presented):
         finish_time = datetime.utcnow().isoformat()
 
         # /cachePresentedTime API only caches when there is a user_id
         # otherwise it returns an arbitrary valid timestamp so that answer can be submitted
-        if guard.retrieve_presented_timestamp(task, get_user_id_or_ip()):
-            created = self._validate_datetime(guard.retrieve_presented_timestamp(task, get_user_id_or_ip()))
+        if presented:
+            created = self._validate_datetime(presented)
         else:
             created = datetime.strptime(self.DEFAULT_DATETIME, self.DATETIME_FORMAT).isoformat()
 
@@ -169,10 +190,152 @@ class TaskRunAPI(APIBase):
     def _copy_original(self, item):
         return deepcopy(item)
 
+    def post_bulk(self):
+        """Save a list of task runs of the current user in one transaction.
+
+        The checks of the regular POST are done for the whole list at once
+        where they can be: task locks and request stamps are read from Redis
+        in one round-trip, and the tasks in one query. Each task run is then
+        authorized as in the regular POST, and the valid ones are inserted
+        with a single statement.
+
+        :returns: a JSON list with, for each task run in order, either
+            its id or the error that prevented saving it
+        """
+        if current_user.is_anonymous:
+            raise Forbidden('')
+        items = self._parse_request_data()
+        if not isinstance(items, list):
+            raise BadRequest('A list of task runs is expected')
+        limit = app.config.get('TASK_RUN_BULK_LIMIT', 100)
+        if len(items) > limit:
+            raise BadRequest('At most %s task runs can be posted at once'
+                             % limit)
+
+        results = [None] * len(items)
+        pending = []
+        for index, data in enumerate(items):
+            try:
+                if not isinstance(data, dict):
+                    raise BadRequest('A task run object is expected')
+                if data.get('external_uid'):
+                    raise BadRequest('external_uid is not supported')
+                self._forbidden_attributes(data)
+                data = self.hateoas.remove_links(data)
+                try:
+                    data['task_id'] = int(data['task_id'])
+                    data['project_id'] = int(data['project_id'])
+                except (KeyError, TypeError, ValueError):
+                    raise BadRequest('Invalid task_id or project_id')
+                pending.append((index, data))
+            except Exception as e:
+                results[index] = _bulk_error(e)
+
+        task_ids = list(set(data['task_id'] for _, data in pending))
+        tasks = dict((task.id, task) for task in task_repo.get_tasks(task_ids))
+        user_id_or_ip = get_user_id_or_ip()
+        guard = ContributionsGuard(sentinel.master)
+        timestamps = guard.retrieve_timestamps(tasks.values(), user_id_or_ip)
+        unlocked = self._unlocked_task_ids(tasks.values())
+        submitted = set()  # tasks of the task runs accepted so far
+
+        task_runs = []
+        answers = []
+        for index, data in pending:
+            try:
+                original_data = self._copy_original(data)
+                task = tasks.get(data['task_id'])
+                if task is None:
+                    raise Forbidden('Invalid task_id')
+                if task.project_id != data['project_id']:
+                    raise Forbidden('Invalid project_id')
+                if task.id in unlocked or timestamps[task.id][0] is None:
+                    raise Forbidden('You must request a task first!')
+                if task.id in submitted:
+                    raise Forbidden('You have already submitted a task run '
+                                    'for this task')
+                taskrun = TaskRun(**data)
+                self._add_user_info(taskrun)
+                ensure_authorized_to('create', taskrun)
+                self._upload_answer(task.project_id, task.id, data)
+                taskrun.info = data['info']
+                self._set_timestamps(taskrun, timestamps[task.id][1])
+                self._validate_instance(taskrun)
+                submitted.add(task.id)
+                task_runs.append((index, taskrun))
+                answers.append(original_data.get('info'))
+            except Exception as e:
+                results[index] = _bulk_error(e)
+
+        if task_runs:
+            try:
+                task_repo.insert_task_runs([tr for _, tr in task_runs])
+            except Exception as e:
+                for index, _ in task_runs:
+                    results[index] = _bulk_error(e)
+            else:
+                saved = []
+                saved_answers = []
+                for (index, taskrun), answer in zip(task_runs, answers):
+                    if taskrun.id is None:
+                        results[index] = _bulk_error(Forbidden(
+                            'You have already submitted a task run for '
+                            'this task'))
+                        continue
+                    results[index] = dict(status='ok', id=taskrun.id,
+                                          task_id=taskrun.task_id)
+                    saved.append(taskrun)
+                    saved_answers.append(answer)
+                if saved:
+                    self._after_bulk_save(saved, saved_answers)
+        return Response(json.dumps(results), mimetype='application/json')
+
+    def _unlocked_task_ids(self, tasks):
+        """Return the ids of the tasks of locking scheduler projects the
+        current user does not hold a lock on."""
+        projects = set(task.project_id for task in tasks)
+        locking = set(project_id for project_id in projects
+                      if _is_locking_project(project_id))
+        task_ids = [task.id for task in tasks if task.project_id in locking]
+        expirations = sched.get_lock_expirations(task_ids, current_user.id)
+        return set(task_id for task_id in task_ids
+                   if expirations.get(task_id, 0) <= 0)
+
+    def _after_bulk_save(self, task_runs, answers):
+        for project_id in set(tr.project_id for tr in task_runs):
+            if _is_locking_project(project_id):
+                sched.release_locks([tr.task_id for tr in task_runs
+                                     if tr.project_id == project_id],
+                                    current_user.id, sched.TIMEOUT)
+        if submission_pipeline.is_enabled():
+            submission_pipeline.push_many(task_runs, answers)
+        else:
+            submission_pipeline.process_batch(
+                submission_pipeline.make_entries(task_runs, answers),
+                sentinel.master)
+
+
+def _is_locking_project(project_id):
+    scheduler = sched.get_project_scheduler(project_id, sched.session)
+    return sched.is_locking_scheduler(scheduler)
+
+
+def _bulk_error(e):
+    """Return the outcome of a task run that could not be saved, in the
+    format of the API errors."""
+    exception_cls = e.__class__.__name__
+    message = getattr(e, 'description', None) or str(e)
+    return dict(status='failed',
+                status_code=ErrorStatus.error_status.get(exception_cls, 500),
+                exception_cls=exception_cls,
+                exception_msg=message)
+
 
 def _upload_files_from_json(task_run_info, upload_path, with_encryption):
+    """Return the uploads of the files given as content in the info."""
+    uploads = []
     if not isinstance(task_run_info, dict):
-        return
+        return uploads
     for key, value in task_run_info.iteritems():
         if key.endswith('__upload_url'):
             filename = value.get('filename')
@@ -180,25 +343,105 @@ def _upload_files_from_json(task_run_info, upload_path, with_encryption):
             upload_root_dir = app.config.get('S3_UPLOAD_DIRECTORY')
             if filename is None or content is None:
                 continue
-            out_url = s3_upload_from_string(app.config.get("S3_BUCKET"),
-                                            content,
-                                            filename,
-                                            directory=upload_path, conn_name='S3_TASKRUN',
-                                            with_encryption=with_encryption,
-                                            upload_root_dir=upload_root_dir)
-            task_run_info[key] = out_url
+            upload = partial(s3_upload_from_string,
+                             app.config.get("S3_BUCKET"),
+                             content,
+                             filename,
+                             directory=upload_path, conn_name='S3_TASKRUN',
+                             with_encryption=with_encryption,
+                             upload_root_dir=upload_root_dir,
+                             return_key_only=True)
+            uploads.append((key, upload))
+    return uploads
 
 
 def _upload_files_from_request(task_run_info, files, upload_path, with_encryption):
+    """Return the uploads of the files sent with the request."""
+    uploads = []
     for key in files:
         if not key.endswith('__upload_url'):
             raise BadRequest("File upload field should end in __upload_url")
-        file_obj = request.files[key]
-        s3_url = s3_upload_file_storage(app.config.get("S3_BUCKET"),
-                                        file_obj,
-                                        directory=upload_path, conn_name='S3_TASKRUN',
-                                        with_encryption=with_encryption)
-        task_run_info[key] = s3_url
+        file_obj = _copy_file_storage(request.files[key])
+        upload = partial(s3_upload_file_storage,
+                         app.config.get("S3_BUCKET"),
+                         file_obj,
+                         directory=upload_path, conn_name='S3_TASKRUN',
+                         with_encryption=with_encryption,
+                         return_key_only=True)
+        uploads.append((key, upload))
+    return uploads
+
+
+def _copy_file_storage(file_obj):
+    """Return a copy of a file sent with the request that outlives it, as
+    an upload may still be running once the request has been answered."""
+    stream = SpooledTemporaryFile(max_size=500 * 1024)
+    shutil.copyfileobj(file_obj.stream, stream)
+    stream.seek(0)
+    return FileStorage(stream=stream, filename=file_obj.filename,
+                       content_type=file_obj.content_type)
+
+
+_upload_pool = None
+_upload_pool_lock = threading.Lock()
+
+
+def _get_upload_pool():
+    """Return the pool running the uploads of task run files. It is shared
+    by the requests of the process, so that its threads keep their S3
+    connections."""
+    global _upload_pool
+    with _upload_pool_lock:
+        if _upload_pool is None:
+            _upload_pool = ThreadPool(
+                app.config.get('TASK_RUN_UPLOAD_CONCURRENCY', 4))
+        return _upload_pool
+
+
+def _upload_files(task_run_info, uploads):
+    """
+    Run the uploads of a task run in parallel, on a pool of
+    TASK_RUN_UPLOAD_CONCURRENCY threads, and set the URLs of the files in
+    its info. The uploads are waited for TASK_RUN_UPLOAD_TIMEOUT seconds in
+    total. If one fails or times out, the info is left unchanged and the
+    files are deleted, including those whose upload finishes later.
+    """
+    if not uploads:
+        return
+    bucket = app.config.get('S3_BUCKET')
+    deadline = time.time() + app.config.get('TASK_RUN_UPLOAD_TIMEOUT', 60)
+    flask_app = app._get_current_object()
+    lock = threading.Lock()
+    state = dict(failed=False, uploaded=[])
+
+    def run(upload):
+        with flask_app.app_context():
+            key_name = upload()
+            with lock:
+                failed = state['failed']
+                if not failed:
+                    state['uploaded'].append(key_name)
+            if failed:
+                delete_file_from_s3(bucket, key_name, conn_name='S3_TASKRUN')
+            return key_name
+
+    pool = _get_upload_pool()
+    try:
+        # Uploads still running on failure finish in the background
+        results = [pool.apply_async(run, (upload,)) for _, upload in uploads]
+        key_names = [result.get(max(deadline - time.time(), 0))
+                     for result in results]
+    except Exception as e:
+        with lock:
+            state['failed'] = True
+            uploaded = state['uploaded']
+        for key_name in uploaded:
+            delete_file_from_s3(bucket, key_name, conn_name='S3_TASKRUN')
+        if isinstance(e, TimeoutError):
+            raise GatewayTimeout('Timed out uploading the task run files')
+        raise
+    for (key, _), key_name in zip(uploads, key_names):
+        task_run_info[key] = get_s3_url(bucket, key_name, 'S3_TASKRUN')
 
 
 def update_gold_stats(user_id, task_id, data):
@@ -210,9 +453,9 @@ def update_gold_stats(user_id, task_id, data):
         _update_gold_stats(task.project_id, user_id, answer_fields,
                            task.gold_answers, answer)
 
-def update_quiz(task_id, project_id, answer):
+def update_quiz(task_id, project_id, answer, user_id=None):
     project = project_repo.get(project_id)
-    user = user_repo.get(current_user.id)
+    user = user_repo.get(user_id or current_user.id)
     if not user.get_quiz_in_progress(project):
         return
 
@@ -276,7 +519,9 @@ def preprocess_task_run(project_id, task_id, data):
         if info is None:
             return
         path = "{0}/{1}/{2}".format(project_id, task_id, current_user.id)
-        _upload_files_from_json(info, path, with_encryption)
-        _upload_files_from_request(info, request.files, path, with_encryption)
+        uploads = _upload_files_from_json(info, path, with_encryption)
+        uploads += _upload_files_from_request(info, request.files, path,
+                                              with_encryption)
+        _upload_files(info, uploads)
 
 
@@ -38,6 +38,7 @@ class UserAPI(APIBase):
     """
 
     __class__ = User
+    projection_keys = None
 
     # Define private and public fields available through the API
     # (maybe should be defined in the model?) There are fields like password hash
@@ -25,11 +25,22 @@ It exports:
     * delete_cached: to remove a cached value
     * delete_memoized: to remove a cached value from the memoize decorator
 
+Values are cached in Redis. Optionally (CACHE_LOCAL_ENABLED) they are also
+kept for a few seconds in a size bounded, in-process LRU cache, which is
+invalidated through Redis pub/sub when values are deleted. The hits and
+misses of each tier are counted, see get_cache_stats.
+
 """
 import os
+import json
+import time
 import hashlib
+import threading
+from collections import OrderedDict
 from functools import wraps
+from flask import current_app, has_app_context
 from pybossa.core import sentinel
+import pybossa.default_settings as default_settings
 
 try:
     import cPickle as pickle
@@ -102,6 +113,160 @@ def delete_cache_group(cache_group_key):
     key = get_cache_group_key(cache_group_key)
     keys_to_delete = list(sentinel.slave.smembers(key)) + [key]
     sentinel.master.delete(*keys_to_delete)
+    invalidate_local(keys=keys_to_delete)
+
+
+class LocalCache(object):
+
+    """Size bounded, in-process LRU cache with expiring entries.
+
+    Values are kept pickled, so that callers get their own copy of them as
+    they do when reading from Redis.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return a (found, value) tuple for a key."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                return False, None
+            self._data[key] = entry
+            return True, entry[1]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + timeout, value)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, keys=None, prefix=None):
+        with self._lock:
+            for key in (keys or []):
+                self._data.pop(key, None)
+            if prefix is not None:
+                for key in [k for k in self._data if k.startswith(prefix)]:
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _local_setting(name):
+    """Return a CACHE_LOCAL_* setting from the app config, or outside of
+    the app from the settings, defaulting to default_settings."""
+    if has_app_context():
+        return current_app.config.get(name, getattr(default_settings, name))
+    return getattr(settings, name, getattr(default_settings, name))
+
+
+local_cache = LocalCache(_local_setting('CACHE_LOCAL_SIZE'))
+
+_stats_lock = threading.Lock()
+_stats = dict(local=dict(hits=0, misses=0), redis=dict(hits=0, misses=0))
+
+_subscriber_lock = threading.Lock()
+_subscriber = dict(pid=None, thread=None)
+
+
+def local_cache_enabled():
+    return bool(_local_setting('CACHE_LOCAL_ENABLED'))
+
+
+def get_cache_stats():
+    """Return the hits and misses of this process for each cache tier."""
+    with _stats_lock:
+        return {tier: dict(counts) for tier, counts in _stats.iteritems()}
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for counts in _stats.itervalues():
+            counts.update(hits=0, misses=0)
+
+
+def _count(tier, hit):
+    with _stats_lock:
+        _stats[tier]['hits' if hit else 'misses'] += 1
+
+
+def get_invalidation_channel():
+    return '{}:cache_invalidation'.format(settings.REDIS_KEYPREFIX)
+
+
+def _on_invalidation(message):
+    data = json.loads(message['data'])
+    local_cache.delete(keys=data.get('keys'), prefix=data.get('prefix'))
+
+
+def _ensure_subscribed():
+    """Listen to invalidation messages in a background thread of this
+    process, restarting it after a fork or if it died."""
+    def subscribed():
+        thread = _subscriber['thread']
+        return (_subscriber['pid'] == os.getpid() and
+                thread is not None and thread.is_alive())
+
+    if subscribed():
+        return
+    with _subscriber_lock:
+        if subscribed():
+            return
+        # Messages may have been missed while not listening
+        local_cache.clear()
+        pubsub = sentinel.master.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{get_invalidation_channel(): _on_invalidation})
+        thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        _subscriber.update(pid=os.getpid(), thread=thread)
+
+
+def _local_set(key, value, timeout):
+    _ensure_subscribed()
+    local_timeout = _local_setting('CACHE_LOCAL_TIMEOUT')
+    local_cache.set(key, value, min(timeout, local_timeout))
+
+
+def invalidate_local(keys=None, prefix=None):
+    """Remove keys, or the keys starting with prefix, from the local cache
+    of every process."""
+    if not local_cache_enabled():
+        return
+    local_cache.delete(keys=keys, prefix=prefix)
+    sentinel.master.publish(get_invalidation_channel(),
+                            json.dumps(dict(keys=keys, prefix=prefix)))
+
+
+def _cached_call(key, timeout, cache_group_keys, f, *args, **kwargs):
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
+        use_local = local_cache_enabled()
+        if use_local:
+            found, output = local_cache.get(key)
+            _count('local', found)
+            if found:
+                return pickle.loads(output)
+        output = sentinel.slave.get(key)
+        _count('redis', bool(output))
+        if output:
+            if use_local:
+                _local_set(key, output, timeout)
+            return pickle.loads(output)
+        output = f(*args, **kwargs)
+        pickled = pickle.dumps(output)
+        sentinel.master.setex(key, timeout, pickled)
+        add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
+        if use_local:
+            _local_set(key, pickled, timeout)
+        return output
+    output = f(*args, **kwargs)
+    sentinel.master.setex(key, timeout, pickle.dumps(output))
+    add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
+    return output
 
 
 def cache(key_prefix, timeout=300, cache_group_keys=None):
@@ -117,18 +282,8 @@ def cache(key_prefix, timeout=300, cache_group_keys=None):
         @wraps(f)
         def wrapper(*args, **kwargs):
             key = "%s::%s" % (settings.REDIS_KEYPREFIX, key_prefix)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-            return output
+            return _cached_call(key, timeout, cache_group_keys, f,
+                                *args, **kwargs)
         return wrapper
     return decorator
 
@@ -148,18 +303,8 @@ def memoize(timeout=300, cache_group_keys=None):
             key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, f.__name__)
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-            return output
+            return _cached_call(key, timeout, cache_group_keys, f,
+                                *args, **kwargs)
         return wrapper
     return decorator
 
@@ -185,18 +330,8 @@ def memoize_essentials(timeout=300, essentials=None, cache_group_keys=None):
             key += get_key_to_hash(*essential_args) + ":"
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-            return output
+            return _cached_call(key, timeout, cache_group_keys, f,
+                                *args, **kwargs)
         return wrapper
     return decorator
 
@@ -210,7 +345,9 @@ def delete_cached(key):
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
         key = "%s::%s" % (settings.REDIS_KEYPREFIX, key)
-        return bool(sentinel.master.delete(key))
+        deleted = bool(sentinel.master.delete(key))
+        invalidate_local(keys=[key])
+        return deleted
     return True
 
 
@@ -226,11 +363,10 @@ def delete_memoized(function, *args, **kwargs):
         if args or kwargs:
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            return bool(sentinel.master.delete(key))
-        keys_to_delete = list(sentinel.slave.scan_iter(match=key + '*', count=10000))
-        if not keys_to_delete:
-            return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+            deleted = bool(sentinel.master.delete(key))
+            invalidate_local(keys=[key])
+            return deleted
+        return _delete_prefix(key)
     return True
 
 
@@ -245,8 +381,12 @@ def delete_memoized_essential(function, *args, **kwargs):
         key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
         if args or kwargs:
             key += get_key_to_hash(*args, **kwargs)
-        keys_to_delete = list(sentinel.slave.scan_iter(match=key + '*', count=10000))
-        if not keys_to_delete:
-            return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+        return _delete_prefix(key)
     return True
+
+
+def _delete_prefix(prefix):
+    keys_to_delete = list(sentinel.slave.scan_iter(match=prefix + '*', count=10000))
+    deleted = bool(keys_to_delete) and bool(sentinel.master.delete(*keys_to_delete))
+    invalidate_local(prefix=prefix)
+    return deleted
@@ -18,12 +18,13 @@
 """Cache module for project stats."""
 from flask import current_app
 from sqlalchemy.sql import text
-from pybossa.core import db
+from pybossa.core import db, sentinel
 from pybossa.cache import memoize, ONE_DAY, FIVE_MINUTES, ONE_HOUR
 import pybossa.cache.projects as cached_projects
 from pybossa.model.project_stats import ProjectStats
 from flask_babel import gettext
 
+import json
 import operator
 import time
 import datetime
@@ -33,6 +34,11 @@ import app_settings
 
 session = db.slave_session
 
+# The periods start at midnight, as they did when finish_time was compared
+# by day: a day counts if it starts within the period.
+PERIOD_START = ("DATE_TRUNC('day', NOW() - :period ::INTERVAL "
+                "- INTERVAL '1 microsecond') + INTERVAL '1 day'")
+
 
 @memoize(timeout=ONE_HOUR)
 def n_tasks(project_id):
@@ -67,8 +73,8 @@ def stats_users(project_id, period=None):
                    WHERE task_run.user_id IS NOT NULL AND
                    task_run.user_ip IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
+                   task_run.finish_time_ts
+                   >= ''' + PERIOD_START + '''
                    GROUP BY task_run.user_id
                    ORDER BY n_tasks DESC;''')\
             .execution_options(stream=True)
@@ -88,8 +94,8 @@ def stats_users(project_id, period=None):
                    FROM task_run WHERE task_run.user_id IS NOT NULL AND
                    task_run.user_ip IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
+                   task_run.finish_time_ts
+                   >= ''' + PERIOD_START + '''
                    ;''')
 
     results = session.execute(sql, params)
@@ -115,8 +121,8 @@ def stats_users(project_id, period=None):
                    WHERE task_run.user_ip IS NOT NULL AND
                    task_run.user_id IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
+                   task_run.finish_time_ts
+                   >= ''' + PERIOD_START + '''
                    GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''')\
             .execution_options(stream=True)
 
@@ -134,8 +140,8 @@ def stats_users(project_id, period=None):
                    FROM task_run WHERE task_run.user_ip IS NOT NULL AND
                    task_run.user_id IS NULL AND
                    task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
+                   task_run.finish_time_ts
+                   >= ''' + PERIOD_START + '''
                    ;''')
 
     results = session.execute(sql, params)
@@ -164,6 +170,17 @@ def convert_period_to_days(period):
     return int_period
 
 
+def _fill_empty_days(days, obj, period):
+    """Add the days of the period without stats."""
+    if len(days) < convert_period_to_days(period):
+        base = datetime.datetime.today()
+        for x in range(0, convert_period_to_days(period)):
+            tmp_date = base - datetime.timedelta(days=x)
+            if tmp_date.strftime('%Y-%m-%d') not in days:
+                obj[tmp_date.strftime('%Y-%m-%d')] = 0
+    return obj
+
+
 @memoize(timeout=ONE_HOUR)
 def stats_dates(project_id, period='15 day'):
     """Return statistics with dates for a project."""
@@ -182,16 +199,16 @@ def stats_dates(project_id, period='15 day'):
                FROM task LEFT OUTER JOIN
                (SELECT task_id, COUNT(id) AS ct FROM task_run
                WHERE project_id=:project_id AND
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
+               task_run.finish_time_ts
+               >= ''' + PERIOD_START + '''
                GROUP BY task_id) AS log_counts
                ON task.id=log_counts.task_id
                WHERE task.project_id=:project_id ORDER BY id ASC)
                select myquery.id, max(task_run.finish_time) as day
                from task_run, myquery where task_run.task_id=myquery.id
                and
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
+               task_run.finish_time_ts
+               >= ''' + PERIOD_START + '''
                group by myquery.id order by day;
                ''').execution_options(stream=True)
 
@@ -203,17 +220,7 @@ def stats_dates(project_id, period='15 day'):
         else:
             dates[day] = 1
 
-    # No completed tasks in the last period
-    def _fill_empty_days(days, obj):
-        if len(days) < convert_period_to_days(period):
-            base = datetime.datetime.today()
-            for x in range(0, convert_period_to_days(period)):
-                tmp_date = base - datetime.timedelta(days=x)
-                if tmp_date.strftime('%Y-%m-%d') not in days:
-                    obj[tmp_date.strftime('%Y-%m-%d')] = 0
-        return obj
-
-    dates = _fill_empty_days(dates.keys(), dates)
+    dates = _fill_empty_days(dates.keys(), dates, period)
     if app_settings.config.get('DISABLE_ANONYMOUS_ACCESS'):
         dates_auth = dates # all users are auth users
         return dates, dates_anon, dates_auth
@@ -221,12 +228,12 @@ def stats_dates(project_id, period='15 day'):
     # Get all answers per date for auth
     sql = text('''
                 WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
+                    SELECT finish_time_ts::DATE
                     as d, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY d)
                 SELECT to_char(d, 'YYYY-MM-DD') as d, count from myquery;
                ''').execution_options(stream=True)
@@ -235,17 +242,17 @@ def stats_dates(project_id, period='15 day'):
     for row in results:
         dates_auth[row.d] = row.count
 
-    dates_auth = _fill_empty_days(dates_auth.keys(), dates_auth)
+    dates_auth = _fill_empty_days(dates_auth.keys(), dates_auth, period)
 
     # Get all answers per date for anon
     sql = text('''
                 WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
+                    SELECT finish_time_ts::DATE
                     as d, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY d)
                SELECT to_char(d, 'YYYY-MM-DD') as d, count  from myquery;
                ''').execution_options(stream=True)
@@ -254,7 +261,7 @@ def stats_dates(project_id, period='15 day'):
     for row in results:
         dates_anon[row.d] = row.count
 
-    dates_anon = _fill_empty_days(dates_anon.keys(), dates_anon)
+    dates_anon = _fill_empty_days(dates_anon.keys(), dates_anon, period)
 
     return dates, dates_anon, dates_auth
 
@@ -281,12 +288,12 @@ def stats_hours(project_id, period='2 week'):
                WITH myquery AS
                 (SELECT to_char(
                     DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                        finish_time_ts
                     ),
                     'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY h)
                SELECT h, count from myquery;
                ''').execution_options(stream=True)
@@ -301,12 +308,12 @@ def stats_hours(project_id, period='2 week'):
                WITH myquery AS
                 (SELECT to_char(
                     DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                        finish_time_ts
                     ),
                     'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id  AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY h)
                SELECT max(count) from myquery;
                ''').execution_options(stream=True)
@@ -324,13 +331,13 @@ def stats_hours(project_id, period='2 week'):
                WITH myquery AS
                 (SELECT to_char(
                     DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                        finish_time_ts
                     ),
                     'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY h)
                SELECT h, count from myquery;
                ''').execution_options(stream=True)
@@ -345,13 +352,13 @@ def stats_hours(project_id, period='2 week'):
                WITH myquery AS
                 (SELECT to_char(
                     DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                        finish_time_ts
                     ),
                     'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY h)
                SELECT max(count) from myquery;
                ''').execution_options(stream=True)
@@ -365,13 +372,13 @@ def stats_hours(project_id, period='2 week'):
                WITH myquery AS
                 (SELECT to_char(
                     DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                        finish_time_ts
                     ),
                     'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY h)
                SELECT h, count from myquery;
                ''').execution_options(stream=True)
@@ -386,13 +393,13 @@ def stats_hours(project_id, period='2 week'):
                WITH myquery AS
                 (SELECT to_char(
                     DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                        finish_time_ts
                     ),
                     'HH24') AS h, COUNT(id)
                     FROM task_run WHERE project_id=:project_id
                     AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
+                    task_run.finish_time_ts
+                    >= ''' + PERIOD_START + '''
                     GROUP BY h)
                SELECT max(count) from myquery;
                ''').execution_options(stream=True)
@@ -507,22 +514,19 @@ def stats_format_users(project_id, users, anon_users, auth_users):
     for u in anon_users:
         top5_anon.append(dict(ip=u[0], tasks=u[1]))
 
+    profiles = {}
+    if auth_users:
+        sql = text('''SELECT id, name, fullname, restrict from "user"
+                   where id = ANY(:ids) and restrict=false;''')
+        results = session.execute(sql, dict(ids=[u[0] for u in auth_users]))
+        profiles = {row.id: row for row in results}
     for u in auth_users:
-        sql = text('''SELECT name, fullname, restrict from "user"
-                   where id=:id and restrict=false;''')
-        results = session.execute(sql, dict(id=u[0]))
-        fullname = None
-        name = None
-        restrict = None
-        for row in results:
-            fullname = row.fullname
-            name = row.name
-            restrict = row.restrict
-        if (fullname and name and restrict is False):
-            all_users_auth.append(dict(name=name,
-                                   fullname=fullname,
+        row = profiles.get(u[0])
+        if row and row.fullname and row.name and row.restrict is False:
+            all_users_auth.append(dict(name=row.name,
+                                   fullname=row.fullname,
                                    tasks=u[1],
-                                   restrict=restrict))
+                                   restrict=row.restrict))
 
     userAnonStats['top5'] = top5_anon[0:5]
     userAuthStats['all_users'] = all_users_auth
@@ -531,17 +535,241 @@ def stats_format_users(project_id, users, anon_users, auth_users):
                 n_anon=users['n_anon'], n_auth=users['n_auth'])
 
 
-def update_stats(project_id, period='2 week'):
-    """Update the stats of a given project."""
-    hours, hours_anon, hours_auth, max_hours, \
-        max_hours_anon, max_hours_auth = stats_hours(project_id, period)
-    users, anon_users, auth_users = stats_users(project_id)
-    dates, dates_anon, dates_auth = stats_dates(project_id, period)
+STATS_STATE_KEY = 'pybossa:project_stats:state:{0}'
+
+
+def _parse_timestamp(value):
+    """Parse a task run timestamp, as written by make_timestamp, or a date."""
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+
 
+def _new_stats_state(period):
+    return dict(watermark=0, period=period, n_task_runs=0,
+                last_activity=None, time_sum=0.0, time_count=0,
+                auth_users={}, anon_users={}, hours={}, task_last={})
 
-    sum(dates.values())
 
-    sorted(dates.iteritems(), key=operator.itemgetter(0))
+def _stats_period_start(period):
+    """Return the last day before the period, as a string."""
+    start = (datetime.datetime.now() -
+             datetime.timedelta(days=convert_period_to_days(period)))
+    return start.strftime('%Y-%m-%d')
+
+
+def _aggregate_task_runs(project_id, state):
+    """Add the task runs of a project after the watermark to the state.
+
+    Task runs are read in a single streaming pass. Per day and hour counts
+    and the last finish time of each task are only kept for the period of
+    the state.
+
+    Return the number of task runs of the project, as seen by the pass.
+    """
+    since = _stats_period_start(state['period'])
+    sql = text('''
+               SELECT counts.n_task_runs AS expected, task_run.id,
+               task_run.task_id, task_run.user_id, task_run.user_ip,
+               task_run.created, task_run.finish_time
+               FROM (SELECT COALESCE(SUM(n_task_runs), 0) AS n_task_runs
+                     FROM task_aggregate
+                     WHERE project_id=:project_id) AS counts
+               LEFT JOIN task_run ON task_run.project_id=:project_id
+               AND task_run.id > :watermark;
+               ''').execution_options(stream=True)
+    results = session.execute(sql, dict(project_id=project_id,
+                                        watermark=state['watermark']))
+    hours = state['hours']
+    task_last = state['task_last']
+    expected = 0
+    for row in results:
+        expected = row.expected
+        if row.id is None:
+            continue
+        state['n_task_runs'] += 1
+        state['watermark'] = max(state['watermark'], row.id)
+        if row.finish_time > state['last_activity']:
+            state['last_activity'] = row.finish_time
+
+        created = _parse_timestamp(row.created)
+        finish_time = _parse_timestamp(row.finish_time)
+        if created and finish_time:
+            state['time_sum'] += (finish_time - created).total_seconds()
+            state['time_count'] += 1
+
+        if row.user_id is not None and row.user_ip is None:
+            user_id = str(row.user_id)
+            state['auth_users'][user_id] = \
+                state['auth_users'].get(user_id, 0) + 1
+        if row.user_ip is not None and row.user_id is None:
+            state['anon_users'][row.user_ip] = \
+                state['anon_users'].get(row.user_ip, 0) + 1
+
+        if finish_time is None:
+            continue
+        day = finish_time.strftime('%Y-%m-%d')
+        if day <= since:
+            continue
+        counts = hours.setdefault(day, {}).setdefault(
+            finish_time.strftime('%H'), [0, 0, 0])
+        counts[0] += 1
+        if row.user_id is None:
+            counts[1] += 1
+        if row.user_ip is None:
+            counts[2] += 1
+        task_id = str(row.task_id)
+        if row.finish_time > task_last.get(task_id):
+            task_last[task_id] = row.finish_time
+
+    # A new task run moves the last finish time of its task into the
+    # period, so that tasks finished before the period can be dropped
+    state['hours'] = {day: day_hours for day, day_hours in hours.iteritems()
+                      if day > since}
+    state['task_last'] = {task_id: last for task_id, last
+                          in task_last.iteritems() if last[:10] > since}
+    return expected
+
+
+def _get_stats_state(project_id, period):
+    """Return the state of the task run stats of a project, brought up to
+    date from the stored watermark if PROJECT_STATS_INCREMENTAL is enabled.
+
+    The state is computed again from scratch if it does not count as many
+    task runs as the project has, as when task runs were deleted since it
+    was stored.
+    """
+    incremental = current_app.config.get('PROJECT_STATS_INCREMENTAL')
+    key = STATS_STATE_KEY.format(project_id)
+    state = None
+    if incremental:
+        stored = sentinel.master.get(key)
+        if stored:
+            state = json.loads(stored)
+            if state['period'] != period:
+                state = None
+    if state is not None:
+        expected = _aggregate_task_runs(project_id, state)
+        if state['n_task_runs'] != expected:
+            state = None
+    if state is None:
+        state = _new_stats_state(period)
+        _aggregate_task_runs(project_id, state)
+    if incremental:
+        sentinel.master.set(key, json.dumps(state))
+    return state
+
+
+def reset_stats_state(project_id):
+    sentinel.master.delete(STATS_STATE_KEY.format(project_id))
+
+
+def _stats_from_state(state):
+    """Return the users, dates and hours stats of a task runs stats state,
+    as stats_users, stats_dates and stats_hours do."""
+    period = state['period']
+    anonymous_disabled = app_settings.config.get('DISABLE_ANONYMOUS_ACCESS')
+
+    def by_count(counts):
+        return sorted([[user, n_tasks] for user, n_tasks in counts.iteritems()],
+                      key=operator.itemgetter(1), reverse=True)
+
+    auth_users = [[int(user_id), n_tasks] for user_id, n_tasks
+                  in by_count(state['auth_users'])]
+    anon_users = by_count(state['anon_users'])
+    users = dict(n_auth=len(auth_users), n_anon=len(anon_users))
+    if anonymous_disabled:
+        users['n_anon'] = 0
+        anon_users = []
+
+    hours, hours_anon, hours_auth = {}, {}, {}
+    for i in range(0, 24):
+        hours[str(i).zfill(2)] = 0
+        hours_anon[str(i).zfill(2)] = 0
+        hours_auth[str(i).zfill(2)] = 0
+    dates, dates_anon, dates_auth = {}, {}, {}
+    for day, day_hours in state['hours'].iteritems():
+        for hour, (n_all, n_anon, n_auth) in day_hours.iteritems():
+            hours[hour] += n_all
+            hours_anon[hour] += n_anon
+            hours_auth[hour] += n_auth
+            if n_anon:
+                dates_anon[day] = dates_anon.get(day, 0) + n_anon
+            if n_auth:
+                dates_auth[day] = dates_auth.get(day, 0) + n_auth
+    for last in state['task_last'].itervalues():
+        dates[last[:10]] = dates.get(last[:10], 0) + 1
+
+    def max_count(counts):
+        return max(counts.values()) or None
+
+    dates = _fill_empty_days(dates.keys(), dates, period)
+    max_hours = max_count(hours)
+    if anonymous_disabled:
+        hours_stats = (hours, dict.fromkeys(hours_anon, 0),
+                       dict.fromkeys(hours_auth, 0), max_hours, 0, 0)
+        dates_stats = (dates, {}, dates)
+    else:
+        hours_stats = (hours, hours_anon, hours_auth, max_hours,
+                       max_count(hours_anon), max_count(hours_auth))
+        dates_stats = (dates,
+                       _fill_empty_days(dates_anon.keys(), dates_anon, period),
+                       _fill_empty_days(dates_auth.keys(), dates_auth, period))
+    return (users, anon_users, auth_users), dates_stats, hours_stats
+
+
+def _project_counts(project_id):
+    sql = text('''
+               SELECT
+               (SELECT COUNT(id) FROM task
+                WHERE project_id=:project_id) AS n_tasks,
+               (SELECT COUNT(id) FROM task WHERE project_id=:project_id
+                AND state='completed') AS n_completed_tasks,
+               (SELECT COUNT(id) FROM blogpost
+                WHERE project_id=:project_id) AS n_blogposts;
+               ''')
+    return session.execute(sql, dict(project_id=project_id)).first()
+
+
+def compute_stats(project_id, period='2 week'):
+    """Compute every stat of a project in one pass over its task runs.
+
+    Return a dict with the stats stored in ProjectStats, and the users,
+    dates and hours stats as stats_users, stats_dates and stats_hours
+    return them.
+    """
+    counts = _project_counts(project_id)
+    state = _get_stats_state(project_id, period)
+    users_stats, dates_stats, hours_stats = _stats_from_state(state)
+
+    n_volunteers = users_stats[0]['n_auth'] + users_stats[0]['n_anon']
+    overall_progress = 0
+    if counts.n_tasks:
+        overall_progress = (counts.n_completed_tasks * 100) / counts.n_tasks
+    average_time = 0
+    if state['time_count']:
+        average_time = state['time_sum'] / state['time_count']
+    return dict(n_tasks=counts.n_tasks,
+                n_task_runs=state['n_task_runs'],
+                n_results=cached_projects.n_results(project_id),
+                overall_progress=overall_progress,
+                last_activity=state['last_activity'],
+                n_volunteers=n_volunteers,
+                n_completed_tasks=counts.n_completed_tasks,
+                average_time=average_time,
+                n_blogposts=counts.n_blogposts,
+                users=users_stats, dates=dates_stats, hours=hours_stats)
+
+
+def update_stats(project_id, period='2 week'):
+    """Update the stats of a given project."""
+    stats = compute_stats(project_id, period)
+    hours, hours_anon, hours_auth, max_hours, \
+        max_hours_anon, max_hours_auth = stats['hours']
+    users, anon_users, auth_users = stats['users']
+    dates, dates_anon, dates_auth = stats['dates']
 
     dates_stats = stats_format_dates(project_id, dates,
                                      dates_anon, dates_auth)
@@ -556,39 +784,29 @@ def update_stats(project_id, period='2 week'):
                 users_stats=users_stats)
     ps = session.query(ProjectStats).filter_by(project_id=project_id).first()
 
-    n_tasks = cached_projects.n_tasks(project_id)
-    n_task_runs = cached_projects.n_task_runs(project_id)
-    n_results = cached_projects.n_results(project_id)
-    overall_progress = cached_projects.overall_progress(project_id)
-    last_activity = cached_projects.last_activity(project_id)
-    n_volunteers = cached_projects.n_volunteers(project_id)
-    n_completed_tasks = cached_projects.n_completed_tasks(project_id)
-    average_time = cached_projects.average_contribution_time(project_id)
-    n_blogposts = cached_projects.n_blogposts(project_id)
-
     if ps is None:
         ps = ProjectStats(project_id=project_id, info=data,
-                          n_tasks=n_tasks,
-                          n_task_runs=n_task_runs,
-                          n_results=n_results,
-                          n_volunteers=n_volunteers,
-                          n_completed_tasks=n_completed_tasks,
-                          average_time=average_time,
-                          overall_progress=overall_progress,
-                          n_blogposts=n_blogposts,
-                          last_activity=last_activity)
+                          n_tasks=stats['n_tasks'],
+                          n_task_runs=stats['n_task_runs'],
+                          n_results=stats['n_results'],
+                          n_volunteers=stats['n_volunteers'],
+                          n_completed_tasks=stats['n_completed_tasks'],
+                          average_time=stats['average_time'],
+                          overall_progress=stats['overall_progress'],
+                          n_blogposts=stats['n_blogposts'],
+                          last_activity=stats['last_activity'])
         db.session.add(ps)
     else:
         ps.info = data
-        ps.n_tasks = n_tasks
-        ps.n_task_runs = n_task_runs
-        ps.overall_progress = overall_progress
-        ps.last_activity = last_activity
-        ps.n_results = n_results
-        ps.n_completed_tasks = n_completed_tasks
-        ps.n_volunteers = n_volunteers
-        ps.average_time = average_time
-        ps.n_blogposts = n_blogposts
+        ps.n_tasks = stats['n_tasks']
+        ps.n_task_runs = stats['n_task_runs']
+        ps.overall_progress = stats['overall_progress']
+        ps.last_activity = stats['last_activity']
+        ps.n_results = stats['n_results']
+        ps.n_completed_tasks = stats['n_completed_tasks']
+        ps.n_volunteers = stats['n_volunteers']
+        ps.average_time = stats['average_time']
+        ps.n_blogposts = stats['n_blogposts']
     db.session.commit()
     return dates_stats, hours_stats, users_stats
 
@@ -16,13 +16,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Cache module for projects."""
+import json
+from flask import current_app
 from sqlalchemy.sql import text
 from pybossa.core import db, timeouts
 from pybossa.model.project import Project
 from pybossa.util import pretty_date, static_vars, convert_utc_to_est
 from pybossa.cache import memoize, cache, delete_memoized, delete_cached, \
     memoize_essentials, delete_memoized_essential, delete_cache_group
-from pybossa.cache.task_browse_helpers import get_task_filters, allowed_fields
+from pybossa.cache.task_browse_helpers import (get_task_filters,
+    allowed_fields, task_run_aggregates, get_info_columns_projection,
+    get_keyset_order, get_keyset_filter, encode_cursor)
 import app_settings
 
 
@@ -58,36 +62,60 @@ def get_top(n=4):
 @memoize_essentials(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'), essentials=[0],
                     cache_group_keys=[[0]])
 @static_vars(allowed_fields=allowed_fields)
-def browse_tasks(project_id, args):
-    """Cache browse tasks view for a project."""
+def browse_tasks_page(project_id, args):
+    """Cache a page of the browse tasks view for a project.
+
+    Pages are selected with the cursor in args['after'] if given, that is
+    the sort keys of the last task of the previous page, or else with
+    args['offset']. Return a dict with the tasks of the page, the cursor
+    of the next page if any, and the count of tasks matching the filters,
+    which is estimated if counting them is too costly.
+
+    The fields of task.info listed in args['display_info_columns'] are
+    returned in the info of each task.
+    """
     tasks = []
-    total_count = task_count(project_id, args)
+    total_count, approximate = _browse_tasks_count(project_id, args)
+    page = dict(total_count=total_count, approximate=approximate,
+                tasks=tasks, next_cursor=None)
     if not total_count:
-        return total_count, tasks
+        return page
 
     filters, filter_params = get_task_filters(args)
+    info_columns = args.get('display_info_columns') or []
+    projection, projection_params = get_info_columns_projection(info_columns)
+    filter_params.update(projection_params)
+    order = get_keyset_order(args)
+    offset = args.get('offset') or 0
+    if args.get('after'):
+        keyset_filter, keyset_params = get_keyset_filter(order, args['after'])
+        filters += keyset_filter
+        filter_params.update(keyset_params)
+        offset = 0
     sql = text('''
                SELECT task.id,
                coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
-               priority_0, task.created, task.calibration
-               FROM task LEFT OUTER JOIN
-               (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-               MAX(finish_time) as ft FROM task_run
-               WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+               priority_0, task.created, task.calibration{}, {}
+               FROM task LEFT OUTER JOIN {}
                ON task.id=log_counts.task_id
-               WHERE task.project_id=:project_id''' + filters +
-               " ORDER BY %s" % (args.get('order_by') or 'id ASC') +
-               " LIMIT :limit OFFSET :offset"
-               )
+               WHERE task.project_id=:project_id {}
+               ORDER BY {}
+               LIMIT :limit OFFSET :offset
+               '''.format(projection,
+                          ', '.join('{} AS _k{}'.format(key, i)
+                                    for i, (key, _) in enumerate(order)),
+                          task_run_aggregates, filters,
+                          ', '.join('_k{} {}'.format(i, direction)
+                                    for i, (_, direction) in enumerate(order))))
 
     limit = args.get('records_per_page') or 10
-    offset = args.get('offset') or 0
 
     results = session.execute(sql, dict(project_id=project_id,
                                         limit=limit,
                                         offset=offset,
                                         **filter_params))
 
+    row = None
     for row in results:
         # TODO: use Jinja filters to format date
         def format_date(date):
@@ -100,8 +128,50 @@ def browse_tasks(project_id, args):
                     finish_time=finish_time, created=created,
                     calibration=row.calibration)
         task['pct_status'] = _pct_status(row.n_task_runs, row.n_answers)
+        if info_columns:
+            task['info'] = {}
+            for ix, column in enumerate(info_columns):
+                value = getattr(row, 'info_{}'.format(ix))
+                task['info'][column] = value if value is not None else ''
         tasks.append(task)
-    return total_count, tasks
+    if len(tasks) == limit:
+        page['next_cursor'] = encode_cursor(
+            [getattr(row, '_k{}'.format(i)) for i in range(len(order))])
+    return page
+
+
+def browse_tasks(project_id, args):
+    """Return the count of tasks matching the filters and a page of them."""
+    page = browse_tasks_page(project_id, args)
+    return page['total_count'], page['tasks']
+
+
+def _browse_tasks_count(project_id, args):
+    """Return the count of tasks matching the filters, and whether it is
+    an estimate.
+
+    Filtered counts are estimated from the query plan for projects with more
+    than BROWSE_TASKS_EXACT_COUNT_LIMIT tasks.
+    """
+    filters, filter_params = get_task_filters(args)
+    if not filters:
+        return n_tasks(project_id), False
+
+    limit = current_app.config.get('BROWSE_TASKS_EXACT_COUNT_LIMIT')
+    if limit is None or n_tasks(project_id) <= limit:
+        return task_count(project_id, args), False
+
+    sql = text('''
+               EXPLAIN (FORMAT JSON)
+               SELECT task.id FROM task LEFT OUTER JOIN {}
+               ON task.id=log_counts.task_id
+               WHERE task.project_id=:project_id {}
+               '''.format(task_run_aggregates, filters))
+    plan = session.execute(sql, dict(project_id=project_id,
+                                     **filter_params)).scalar()
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows']), True
 
 
 def task_count(project_id, args):
@@ -109,18 +179,10 @@ def task_count(project_id, args):
     filters, filter_params = get_task_filters(args)
     sql = text('''
                 SELECT COUNT(*) AS total_count
-                FROM task WHERE task.id IN
-                (
-                SELECT task.id FROM task LEFT OUTER JOIN
-                    (
-                    SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                    MAX(finish_time) as ft FROM task_run
-                    WHERE project_id=:project_id GROUP BY task_id
-                    ) AS log_counts
-                    ON task.id=log_counts.task_id
-                    WHERE task.project_id=:project_id {}
-                )
-               '''.format(filters))
+                FROM task LEFT OUTER JOIN {}
+                ON task.id=log_counts.task_id
+                WHERE task.project_id=:project_id {}
+               '''.format(task_run_aggregates, filters))
 
     results = session.execute(sql, dict(project_id=project_id,
                                         **filter_params))
@@ -290,8 +352,7 @@ def last_activity(project_id):
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def average_contribution_time(project_id):
     sql = text('''SELECT
-        AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-            to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')) AS average_time
+        AVG(finish_time_ts - created_ts) AS average_time
         FROM task_run
         WHERE project_id=:project_id;''')
 
@@ -618,7 +679,7 @@ def reset():
 
 def delete_browse_tasks(project_id):
     """Reset browse_tasks value in cache"""
-    delete_memoized_essential(browse_tasks, project_id)
+    delete_memoized_essential(browse_tasks_page, project_id)
 
 
 def delete_n_tasks(project_id):
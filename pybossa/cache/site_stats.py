@@ -104,7 +104,8 @@ def get_top5_projects_24_hours():
     sql = text('''SELECT project.id, project.name, project.short_name, project.info,
                COUNT(task_run.project_id) AS n_answers FROM project, task_run
                WHERE project.id=task_run.project_id
-               AND DATE(task_run.finish_time) > current_timestamp - interval '1 day'
+               AND task_run.finish_time_ts
+               >= DATE_TRUNC('day', current_timestamp)
                GROUP BY project.id
                ORDER BY n_answers DESC LIMIT 5;''')
 
@@ -125,7 +126,8 @@ def get_top5_users_24_hours():
                "user".restrict,
                COUNT(task_run.project_id) AS n_answers FROM "user", task_run
                WHERE "user".restrict=false AND "user".id=task_run.user_id
-               AND DATE(task_run.finish_time) > current_timestamp - interval '1 day'
+               AND task_run.finish_time_ts
+               >= DATE_TRUNC('day', current_timestamp)
                GROUP BY "user".id
                ORDER BY n_answers DESC LIMIT 5;''')
 
@@ -185,9 +187,7 @@ def number_of_created_tasks(days=30):
     """Number of created tasks"""
     sql = text('''
         SELECT count(id) FROM task
-        WHERE
-        to_timestamp(created, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            > NOW() - interval ':days days';
+        WHERE created_ts > NOW() - interval ':days days';
         ''')
     return session.execute(sql, dict(days=days)).scalar()
 
@@ -199,8 +199,7 @@ def number_of_completed_tasks(days=30):
     sql = text('''
         WITH taskruns AS (
             SELECT DISTINCT task_id FROM task_run
-            WHERE to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            >= NOW() -  interval ':days days')
+            WHERE finish_time_ts >= NOW() -  interval ':days days')
         SELECT COUNT(*) FROM task JOIN taskruns
         ON task.id = taskruns.task_id
         WHERE task.state = 'completed';
@@ -215,8 +214,7 @@ def number_of_active_users(days=30):
     sql = text('''
         WITH active_users AS (
             SELECT DISTINCT(user_id) as id FROM task_run
-            WHERE to_timestamp(task_run.finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            > NOW() - interval ':days days')
+            WHERE task_run.finish_time_ts > NOW() - interval ':days days')
         SELECT COUNT(id) FROM active_users;
     ''')
     return session.execute(sql, dict(days=days)).scalar()
@@ -245,15 +243,11 @@ def avg_time_to_complete_task(days=30):
     """Average time to complete a task"""
     sql = text('''
         WITH taskruns AS (
-            SELECT finish_time, created FROM task_run
-            WHERE to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            > NOW() -  interval ':days days'
+            SELECT finish_time_ts, created_ts FROM task_run
+            WHERE finish_time_ts > NOW() -  interval ':days days'
         )
         SELECT to_char(
-            AVG(
-                to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-                to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')
-            ),
+            AVG(finish_time_ts - created_ts),
             'MI"m" SS"s"'
         )
         AS average_time from taskruns;
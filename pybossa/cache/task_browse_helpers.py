@@ -1,3 +1,4 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import defaultdict
 import json
 import re
@@ -159,6 +160,94 @@ allowed_fields = {
 }
 
 
+# Per task run count (ct) and last finish time (ft) of the tasks of a
+# project, as maintained in task_aggregate by the task run listeners.
+task_run_aggregates = '''
+    (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+    last_finish_time AS ft FROM task_aggregate
+    WHERE project_id=:project_id) AS log_counts'''
+
+
+# Sort keys for keyset pagination. They must not be NULL for the keyset
+# conditions to hold, so NULLs are replaced by a value sorting last, as
+# NULLs do by default.
+_last_timestamp = "'9999-12-31T23:59:59.999999'"
+keyset_fields = {
+    'task_id': 'task.id',
+    'priority': "COALESCE(priority_0, 'Infinity'::float)",
+    'finish_time': 'COALESCE(ft, {})'.format(_last_timestamp),
+    'pcomplete': ("COALESCE(coalesce(ct, 0)/task.n_answers, "
+                  "'Infinity'::float)"),
+    'created': 'COALESCE(task.created, {})'.format(_last_timestamp)
+}
+
+
+def get_info_columns_projection(columns):
+    """
+    Build the SELECT part of the query projecting the given fields of
+    task.info, as info_0, info_1...
+    Return the projected columns and the dictionary of bound parameters.
+    """
+    params = {}
+    projection = ''
+    for ix, column in enumerate(columns or []):
+        params['info_column_{}'.format(ix)] = column
+        projection += ', task.info->:info_column_{0} AS info_{0}'.format(ix)
+    return projection, params
+
+
+def get_keyset_order(args):
+    """
+    Return the ordered list of (sort key, direction) pairs of the browse
+    tasks query, always ending in the task id so that the order is total.
+    """
+    order = [(keyset_fields[field], 'desc' if direction == 'desc' else 'asc')
+             for field, direction in args.get('order_by_fields') or []
+             if field in keyset_fields]
+    if not any(key == keyset_fields['task_id'] for key, _ in order):
+        order.append((keyset_fields['task_id'], 'asc'))
+    return order
+
+
+def get_keyset_filter(order, cursor):
+    """
+    Build the condition selecting the rows after the cursor, that is the
+    sort key values of the last row of the previous page.
+    Return the condition and the dictionary of bound parameters.
+    """
+    params = {'keyset_{}'.format(i): value for i, value in enumerate(cursor)}
+    directions = set(direction for _, direction in order)
+    if len(directions) == 1:
+        op = '<' if directions.pop() == 'desc' else '>'
+        condition = '({}) {} ({})'.format(
+            ', '.join(key for key, _ in order), op,
+            ', '.join(':keyset_{}'.format(i) for i in range(len(order))))
+        return ' AND {}'.format(condition), params
+
+    or_pieces = []
+    for i, (key, direction) in enumerate(order):
+        and_pieces = ['{} = :keyset_{}'.format(prev_key, j)
+                      for j, (prev_key, _) in enumerate(order[:i])]
+        op = '<' if direction == 'desc' else '>'
+        and_pieces.append('{} {} :keyset_{}'.format(key, op, i))
+        or_pieces.append('({})'.format(' AND '.join(and_pieces)))
+    return ' AND ({})'.format(' OR '.join(or_pieces)), params
+
+
+def encode_cursor(values):
+    return urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor: {}'.format(cursor))
+    if not isinstance(values, list):
+        raise ValueError('invalid cursor: {}'.format(cursor))
+    return values
+
+
 def parse_tasks_browse_args(args):
     """
     Parse querystring arguments
@@ -220,6 +309,7 @@ def parse_tasks_browse_args(args):
     parsed_args['order_by_dict'] = dict()
     if args.get('order_by'):
         parsed_args['order_by'] = args['order_by'].strip().lower()
+        parsed_args['order_by_fields'] = []
         for clause in parsed_args['order_by'].split(','):
             order_by_field = clause.split(' ')
             if len(order_by_field) != 2 or order_by_field[0] not in allowed_fields:
@@ -228,6 +318,7 @@ def parse_tasks_browse_args(args):
                 raise ValueError('order_by field is duplicated: %s'
                                  .format(args['order_by']))
             parsed_args["order_by_dict"][order_by_field[0]] = order_by_field[1]
+            parsed_args['order_by_fields'].append(tuple(order_by_field))
 
         for key, value in allowed_fields.iteritems():
             parsed_args["order_by"] = parsed_args["order_by"].replace(key, value)
@@ -235,6 +326,12 @@ def parse_tasks_browse_args(args):
     if args.get('filter_by_field'):
         parsed_args['filter_by_field'] = _get_field_filters(args['filter_by_field'])
 
+    if args.get('after'):
+        parsed_args['after'] = decode_cursor(args['after'])
+        if len(parsed_args['after']) != len(get_keyset_order(parsed_args)):
+            raise ValueError('cursor does not match order_by: {}'
+                             .format(args['after']))
+
     if args.get('filter_by_upref'):
         user_pref = json.loads(args['filter_by_upref'])
         validate_user_preferences(user_pref)
@@ -365,8 +365,7 @@ def get_users_for_report():
                 MIN(finish_time) AS first_submission_date,
                 MAX(finish_time) AS last_submission_date,
                 (SELECT COUNT(id) FROM task_run WHERE user_id = u.id)AS completed_tasks,
-                (SELECT coalesce(AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-                to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')), interval '0s')
+                (SELECT coalesce(AVG(finish_time_ts - created_ts), interval '0s')
                 FROM task_run WHERE user_id = u.id) AS avg_time_per_task, u.consent, u.restrict
                 FROM task_run t RIGHT JOIN "user" u ON t.user_id = u.id
                 WHERE u.restrict=False and u.email_addr not like 'del-%@del.com'
@@ -407,8 +406,7 @@ def get_project_report_userdata(project_id):
             ((SELECT count(id) FROM task_run WHERE user_id = u.id AND project_id =:project_id) * 100 / :total_tasks) AS percent_completed_tasks,
             (SELECT min(finish_time) FROM task_run WHERE user_id = u.id AND project_id=:project_id) AS first_submission_date,
             (SELECT max(finish_time) FROM task_run WHERE user_id = u.id AND project_id=:project_id) AS last_submission_date,
-            (SELECT coalesce(AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-            to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')), interval '0s')
+            (SELECT coalesce(AVG(finish_time_ts - created_ts), interval '0s')
             FROM task_run WHERE user_id = u.id AND project_id=:project_id) AS avg_time_per_task
             FROM "user" u WHERE id IN
             (SELECT DISTINCT user_id FROM task_run tr GROUP BY project_id, user_id HAVING project_id=:project_id);
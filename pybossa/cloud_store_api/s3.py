@@ -1,6 +1,7 @@
-import io
 import os
 import re
+import threading
+from copy import deepcopy
 from tempfile import NamedTemporaryFile
 from urlparse import urlparse
 import boto
@@ -33,33 +34,55 @@ allowed_mime_types = ['application/pdf',
 
 DEFAULT_CONN = 'S3_DEFAULT'
 
+# libmagic does not look further than the first megabyte by default
+MIME_SNIFF_SIZE = 1024 * 1024
+
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+_connections = threading.local()
+
 
 def check_type(filename):
     mime_type = magic.from_file(filename, mime=True)
+    _check_mime_type(mime_type)
+
+
+def check_buffer_type(buf):
+    mime_type = magic.from_buffer(buf[:MIME_SNIFF_SIZE], mime=True)
+    _check_mime_type(mime_type)
+
+
+def _check_mime_type(mime_type):
     if mime_type not in allowed_mime_types:
         raise BadRequest('File type not supported: {}'.format(mime_type))
 
 
+def get_connection(conn_name=DEFAULT_CONN):
+    """
+    Return the connection of the current thread for the given configuration,
+    creating it on first use. Reusing it keeps its HTTP connections alive
+    across uploads instead of paying for a new TLS handshake each time.
+    Connections are not shared between threads, as boto ones are not thread
+    safe.
+    """
+    conn_kwargs = app.config.get(conn_name, {})
+    pool = getattr(_connections, 'pool', None)
+    if pool is None:
+        pool = _connections.pool = {}
+    pooled = pool.get(conn_name)
+    if pooled is None or pooled[0] != conn_kwargs:
+        pooled = (deepcopy(conn_kwargs), create_connection(**conn_kwargs))
+        pool[conn_name] = pooled
+    return pooled[1]
+
+
 def validate_directory(directory_name):
     invalid_chars = '[^\w\/]'
     if re.search(invalid_chars, directory_name):
         raise RuntimeError('Invalid character in directory name')
 
 
-def tmp_file_from_string(string):
-    """
-    Create a temporary file with the given content
-    """
-    tmp_file = NamedTemporaryFile(delete=False)
-    try:
-        with io.open(tmp_file.name, 'w', encoding='utf8') as fp:
-            fp.write(string)
-    except Exception as e:
-        os.unlink(tmp_file.name)
-        raise e
-    return tmp_file
-
-
 def s3_upload_from_string(s3_bucket, string, filename, headers=None,
                           directory='', file_type_check=True,
                           return_key_only=False, conn_name=DEFAULT_CONN,
@@ -67,11 +90,13 @@ def s3_upload_from_string(s3_bucket, string, filename, headers=None,
     """
     Upload a string to s3
     """
-    tmp_file = tmp_file_from_string(string)
+    if isinstance(string, unicode):
+        string = string.encode('utf8')
     headers = headers or {}
-    return s3_upload_tmp_file(
-            s3_bucket, tmp_file, filename, headers, directory, file_type_check,
-            return_key_only, conn_name, with_encryption, upload_root_dir)
+    return s3_upload_stream(
+            s3_bucket, BytesIO(string), filename, headers, directory,
+            file_type_check, return_key_only, conn_name, with_encryption,
+            upload_root_dir)
 
 
 def s3_upload_file_storage(s3_bucket, source_file, headers=None, directory='',
@@ -83,36 +108,37 @@ def s3_upload_file_storage(s3_bucket, source_file, headers=None, directory='',
     filename = source_file.filename
     headers = headers or {}
     headers['Content-Type'] = source_file.content_type
-    tmp_file = NamedTemporaryFile(delete=False)
-    source_file.save(tmp_file.name)
     upload_root_dir = app.config.get('S3_UPLOAD_DIRECTORY')
-    return s3_upload_tmp_file(
-            s3_bucket, tmp_file, filename, headers, directory, file_type_check,
-            return_key_only, conn_name, with_encryption, upload_root_dir)
+    return s3_upload_stream(
+            s3_bucket, source_file.stream, filename, headers, directory,
+            file_type_check, return_key_only, conn_name, with_encryption,
+            upload_root_dir)
 
 
-def s3_upload_tmp_file(s3_bucket, tmp_file, filename,
-                       headers, directory='', file_type_check=True,
-                       return_key_only=False, conn_name=DEFAULT_CONN,
-                       with_encryption=False,
-                       upload_root_dir=None):
+def s3_upload_stream(s3_bucket, fp, filename, headers, directory='',
+                     file_type_check=True, return_key_only=False,
+                     conn_name=DEFAULT_CONN, with_encryption=False,
+                     upload_root_dir=None):
     """
-    Upload the content of a temporary file to s3 and delete the file
+    Upload the content of a seekable file-type object to s3, from its
+    current position, without writing it to disk. The type of the content
+    is checked on its first bytes. Encrypted content is read in memory, as
+    the whole of it is needed to compute the authentication tag.
     """
-    try:
-        if file_type_check:
-            check_type(tmp_file.name)
-        content =  tmp_file.read()
-        if with_encryption:
-            secret = app.config.get('FILE_ENCRYPTION_KEY')
-            cipher = AESWithGCM(secret)
-            content = cipher.encrypt(content)
-        fp = BytesIO(content)
-        url = s3_upload_file(s3_bucket, fp, filename, headers, upload_root_dir,
-                             directory, return_key_only, conn_name)
-    finally:
-        os.unlink(tmp_file.name)
-    return url
+    start = fp.tell()
+    if file_type_check:
+        check_buffer_type(fp.read(MIME_SNIFF_SIZE))
+        fp.seek(start)
+    if with_encryption:
+        secret = app.config.get('FILE_ENCRYPTION_KEY')
+        cipher = AESWithGCM(secret)
+        fp = BytesIO(cipher.encrypt(fp.read()))
+        start = 0
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell() - start
+    fp.seek(start)
+    return s3_upload_file(s3_bucket, fp, filename, headers, upload_root_dir,
+                          directory, return_key_only, conn_name, size=size)
 
 
 def form_upload_directory(directory, filename, upload_root_dir):
@@ -123,7 +149,7 @@ def form_upload_directory(directory, filename, upload_root_dir):
 
 def s3_upload_file(s3_bucket, source_file, target_file_name,
                    headers, upload_root_dir, directory="",
-                   return_key_only=False, conn_name=DEFAULT_CONN):
+                   return_key_only=False, conn_name=DEFAULT_CONN, size=None):
     """
     Upload a file-type object to S3
     :param s3_bucket: AWS S3 bucket name
@@ -132,29 +158,67 @@ def s3_upload_file(s3_bucket, source_file, target_file_name,
     :param headers: a dictionary of headers to set on the S3 object
     :param directory: path in S3 where the object needs to be stored
     :param return_key_only: return key name instead of full url
+    :param size: size of the content, if known; content larger than
+        S3_MULTIPART_THRESHOLD is sent as a multipart upload
     """
     filename = secure_filename(target_file_name)
     upload_key = form_upload_directory(directory, filename, upload_root_dir)
-    conn_kwargs = app.config.get(conn_name, {})
-    conn = create_connection(**conn_kwargs)
+    conn = get_connection(conn_name)
     bucket = conn.get_bucket(s3_bucket, validate=False)
 
     assert(len(upload_key) < 256)
     key = bucket.new_key(upload_key)
 
-    key.set_contents_from_file(
-        source_file, headers=headers,
-        policy='bucket-owner-full-control')
+    threshold = app.config.get('S3_MULTIPART_THRESHOLD', MULTIPART_THRESHOLD)
+    if size is not None and size > threshold:
+        s3_multipart_upload(bucket, upload_key, source_file, size, headers)
+    else:
+        key.set_contents_from_file(
+            source_file, headers=headers,
+            policy='bucket-owner-full-control')
 
     if return_key_only:
         return key.name
+    return _key_url(key)
+
+
+def _key_url(key):
     url = key.generate_url(0, query_auth=False)
     return url.split('?')[0]
 
 
+def get_s3_url(s3_bucket, key_name, conn_name=DEFAULT_CONN):
+    """
+    Return the URL of a key, as returned by s3_upload_file
+    """
+    bucket = get_connection(conn_name).get_bucket(s3_bucket, validate=False)
+    return _key_url(bucket.new_key(key_name))
+
+
+def s3_multipart_upload(bucket, upload_key, source_file, size, headers):
+    """
+    Upload the next size bytes of a file-type object in parts of
+    S3_MULTIPART_CHUNK_SIZE bytes, aborting the upload on failure so that
+    S3 does not keep its parts.
+    """
+    chunk_size = app.config.get('S3_MULTIPART_CHUNK_SIZE',
+                                MULTIPART_CHUNK_SIZE)
+    start = source_file.tell()
+    upload = bucket.initiate_multipart_upload(
+        upload_key, headers=headers, policy='bucket-owner-full-control')
+    try:
+        for part_num, offset in enumerate(xrange(0, size, chunk_size), 1):
+            source_file.seek(start + offset)
+            upload.upload_part_from_file(
+                source_file, part_num, size=min(chunk_size, size - offset))
+        upload.complete_upload()
+    except Exception:
+        upload.cancel_upload()
+        raise
+
+
 def get_s3_bucket_key(s3_bucket, s3_url, conn_name=DEFAULT_CONN):
-    conn_kwargs = app.config.get(conn_name, {})
-    conn = create_connection(**conn_kwargs)
+    conn = get_connection(conn_name)
     bucket = conn.get_bucket(s3_bucket, validate=False)
     obj = urlparse(s3_url)
     path = obj.path
@@ -165,12 +229,14 @@ def get_s3_bucket_key(s3_bucket, s3_url, conn_name=DEFAULT_CONN):
 def get_file_from_s3(s3_bucket, path, conn_name=DEFAULT_CONN, decrypt=False):
     temp_file = NamedTemporaryFile()
     _, key = get_s3_bucket_key(s3_bucket, path, conn_name)
-    content = key.get_contents_as_string()
     if decrypt:
+        # The whole content is needed to authenticate the cipher text
+        content = key.get_contents_as_string()
         secret = app.config.get('FILE_ENCRYPTION_KEY')
         cipher = AESWithGCM(secret)
-        content = cipher.decrypt(content)
-    temp_file.write(content)
+        temp_file.write(cipher.decrypt(content))
+    else:
+        key.get_contents_to_file(temp_file)
     temp_file.seek(0)
     return temp_file
 
@@ -38,6 +38,33 @@ class ContributionsGuard(object):
         key = self._create_key(task, user)
         self.conn.setex(key, self.STAMP_TTL, make_timestamp())
 
+    def stamp_tasks(self, tasks, user):
+        """Cache the time that tasks were requested and presented for a
+        given user, using a single round-trip. A presented time that has
+        not expired yet is kept and its expiry extended.
+        """
+        now = make_timestamp()
+        pipeline = self.conn.pipeline(transaction=False)
+        for task in tasks:
+            pipeline.setex(self._create_key(task, user), self.STAMP_TTL, now)
+            key = self._create_presented_time_key(task, user)
+            pipeline.set(key, now, ex=self.STAMP_TTL, nx=True)
+            pipeline.expire(key, self.STAMP_TTL)
+        pipeline.execute()
+
+    def retrieve_timestamps(self, tasks, user):
+        """Get the cached request and presented timestamps of tasks for a
+        given user, using a single round-trip. Returns a dict of
+        (requested, presented) tuples by task id.
+        """
+        pipeline = self.conn.pipeline(transaction=False)
+        for task in tasks:
+            pipeline.get(self._create_key(task, user))
+            pipeline.get(self._create_presented_time_key(task, user))
+        values = pipeline.execute()
+        return dict((task.id, (values[2 * i], values[2 * i + 1]))
+                    for i, task in enumerate(tasks))
+
     def check_task_stamped(self, task, user):
         """Check if a task was requested by a user."""
         key = self._create_key(task, user)
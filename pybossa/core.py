@@ -64,6 +64,7 @@ def create_app(run_as_server=True):
     setup_strong_password(app)
     mail.init_app(app)
     sentinel.init_app(app)
+    setup_instrumentation(app)
     setup_exporter(app)
     setup_http_signer(app)
     signer.init_app(app)
@@ -167,16 +168,22 @@ def setup_exporter(app):
     global task_csv_exporter
     global json_exporter
     global task_json_exporter
+    global task_parquet_exporter
+    global delta_exporter
     global project_csv_exporter
     from pybossa.exporter.csv_export import CsvExporter
     from pybossa.exporter.task_csv_export import TaskCsvExporter
     from pybossa.exporter.json_export import JsonExporter
     from pybossa.exporter.task_json_export import TaskJsonExporter
+    from pybossa.exporter.parquet_export import TaskParquetExporter
+    from pybossa.exporter.delta_export import DeltaExporter
     from pybossa.exporter.project_csv_export import ProjectCsvExporter
     csv_exporter = CsvExporter()
     task_csv_exporter = TaskCsvExporter()
     json_exporter = JsonExporter()
     task_json_exporter = TaskJsonExporter()
+    task_parquet_exporter = TaskParquetExporter()
+    delta_exporter = DeltaExporter()
     project_csv_exporter = ProjectCsvExporter()
 
 
@@ -192,7 +199,8 @@ def setup_db(app):
                 app.config.get('SQLALCHEMY_DATABASE_URI')):
             return db.session
         engine = db.get_engine(db.app, bind=bind)
-        options = dict(bind=engine, scopefunc=_app_ctx_stack.__ident_func__)
+        options = dict(bind=engine, scopefunc=_app_ctx_stack.__ident_func__,
+                       autoflush=False, info=dict(read_replica=True))
         slave_session = db.create_scoped_session(options=options)
         return slave_session
 
@@ -228,6 +236,9 @@ def setup_db(app):
             db.bulkdel_session.remove()
             return response_or_exc
 
+    from pybossa import read_routing
+    read_routing.init_app(app, db)
+
 def setup_repositories(app):
     """Setup repositories."""
     from pybossa.repositories import UserRepository
@@ -769,6 +780,11 @@ def setup_ldap(app):
         ldap.init_app(app)
 
 
+def setup_instrumentation(app):
+    from pybossa import instrumentation
+    instrumentation.init_app(app, db, sentinel)
+
+
 def setup_profiler(app):
     if app.config.get('FLASK_PROFILER'):
         flask_profiler.init_app(app)
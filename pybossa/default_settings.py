@@ -53,6 +53,10 @@ UPLOAD_METHOD = 'local'
 ## Default number of users shown in the leaderboard
 LEADERBOARD = 20
 
+## Keep the leaderboard scores in Redis as task runs are submitted, instead
+## of refreshing the users_rank materialized views
+LEADERBOARD_INCREMENTAL = False
+
 ## Default configuration for debug toolbar
 ENABLE_DEBUG_TOOLBAR = False
 
@@ -163,3 +167,77 @@ AVATAR_ABSOLUTE = True
 
 # Spam accounts to avoid
 SPAM = []
+
+# Task queue scheduler: number of queued tasks read at a time, and how many
+# of those windows to read before falling back to the locked scheduler query
+TASK_QUEUE_WINDOW = 100
+TASK_QUEUE_MAX_WINDOWS = 10
+# Seconds a task queue rebuild holds its lock for, at most
+TASK_QUEUE_BUILD_TIMEOUT = 600
+
+# Maximum number of tasks a user can lock at once through the prefetch API
+SCHED_PREFETCH_LIMIT = 10
+
+# Number of tasks inserted per statement when importing tasks
+TASK_IMPORT_BATCH_SIZE = 1000
+
+# Number of rows fetched at a time from the database when exporting data
+EXPORT_FETCH_SIZE = 1000
+
+# Number of rows per row group in Parquet exports (needs pyarrow)
+EXPORT_PARQUET_ROW_GROUP_SIZE = 10000
+
+# Scheduled exports write only the task runs, results and consensus added
+# since the previous one, as append-only chunk files, instead of
+# regenerating the full export of every project
+EXPORT_INCREMENTAL = False
+# Seconds an incremental export waits for the transactions that may still
+# add rows to it before it is postponed to the next run
+DELTA_EXPORT_WAIT = 10
+
+# Submitting a task run only writes the task run and its counter. Results,
+# task completion, feeds, webhooks, gold stats and quizzes are processed in
+# the background, in batches of TASK_RUN_SIDE_EFFECTS_BATCH_SIZE
+TASK_RUN_DEFERRED_SIDE_EFFECTS = False
+TASK_RUN_SIDE_EFFECTS_BATCH_SIZE = 100
+
+# Maximum number of task runs in a POST /api/taskrun/bulk request
+TASK_RUN_BULK_LIMIT = 100
+
+# Keep cached values for up to CACHE_LOCAL_TIMEOUT seconds in a per process
+# LRU cache of CACHE_LOCAL_SIZE entries in front of Redis. Entries are
+# invalidated in every process through Redis pub/sub
+CACHE_LOCAL_ENABLED = False
+CACHE_LOCAL_SIZE = 1000
+CACHE_LOCAL_TIMEOUT = 5
+
+# Estimate the count of tasks matching the browse tasks filters from the
+# query plan, instead of counting them, for projects with more tasks than
+# BROWSE_TASKS_EXACT_COUNT_LIMIT. None always counts them
+BROWSE_TASKS_EXACT_COUNT_LIMIT = 100000
+
+# Keep the task runs stats of each project in Redis, so that updating the
+# project stats only reads the task runs submitted since the last update
+PROJECT_STATS_INCREMENTAL = False
+
+# Count and time the SQL statements and Redis commands of each request.
+# Statement shapes repeated INSTRUMENTATION_N_PLUS_ONE times in a request
+# and requests slower than INSTRUMENTATION_SLOW_REQUEST milliseconds are
+# logged. Stats are reported at /diagnostics/instrumentation for admins,
+# and in Server-Timing headers with INSTRUMENTATION_SERVER_TIMING
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_SERVER_TIMING = False
+INSTRUMENTATION_N_PLUS_ONE = 10
+INSTRUMENTATION_SLOW_REQUEST = 1000
+
+# Route the read only queries of the repositories, within GET requests that
+# have not written yet, to one of the READ_REPLICA_BINDS lagging less than
+# READ_REPLICA_MAX_LAG seconds behind the primary. The lag is checked every
+# READ_REPLICA_LAG_CHECK_INTERVAL seconds in each process
+READ_REPLICA_ROUTING = True
+READ_REPLICA_BINDS = ['slave']
+READ_REPLICA_MAX_LAG = 10
+READ_REPLICA_LAG_CHECK_INTERVAL = 5
+
+# Maximum number of items of a streamed (stream=1) API list response
+API_STREAM_LIMIT = 10000
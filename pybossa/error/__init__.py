@@ -50,7 +50,9 @@ class ErrorStatus(object):
                     "DataError": 415,
                     "AttributeError": 415,
                     "DBIntegrityError": 415,
-                    "TooManyRequests": 429}
+                    "DuplicateTaskError": 409,
+                    "TooManyRequests": 429,
+                    "GatewayTimeout": 504}
 
     def format_exception(self, e, target, action):
         """
@@ -66,7 +68,7 @@ class ErrorStatus(object):
         else: # pragma: no cover
             status = 500
         if exception_cls in ('BadRequest', 'Forbidden', 'Unauthorized',
-                             'Conflict'):
+                             'Conflict', 'GatewayTimeout'):
             e.message = e.description
         error = dict(action=action.upper(),
                      status="failed",
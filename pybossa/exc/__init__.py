@@ -16,7 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from repository import WrongObjectError, DBIntegrityError
+from repository import WrongObjectError, DBIntegrityError, DuplicateTaskError
 
 assert WrongObjectError
 assert DBIntegrityError
+assert DuplicateTaskError
@@ -15,6 +15,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import json
 
 
 class DBIntegrityError(Exception):
@@ -30,3 +31,12 @@ class WrongObjectError(Exception):
     def __init__(self, message):
         super(WrongObjectError, self).__init__(message)
         self.message = message
+
+
+class DuplicateTaskError(DBIntegrityError):
+    """Raised when saving a task with the same info as an ongoing task of
+    its project"""
+    def __init__(self, task_id):
+        message = json.dumps(dict(reason='DUPLICATE_TASK', task_id=task_id))
+        super(DuplicateTaskError, self).__init__(message)
+        self.task_id = task_id
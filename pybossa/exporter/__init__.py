@@ -21,20 +21,19 @@ Exporter module for exporting tasks and tasks results out of PYBOSSA
 """
 
 from contextlib import closing, contextmanager
-import copy
 import os
+import time
 import zipfile
+import zlib
 import tempfile
 import json
-from pybossa.core import uploader, task_repo, result_repo
-import tempfile
+from pybossa.core import uploader
 from pybossa.uploader import local
+from pybossa.exporter.export_helpers import export_rows
 from unidecode import unidecode
 from flask import url_for, safe_join, send_file, redirect, current_app
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
-from flatten_json import flatten
-from werkzeug.datastructures import FileStorage
 
 
 @contextmanager
@@ -44,76 +43,179 @@ def make_zip_context(zip_result):
         os.remove(zip_result['filepath'])
 
 
-class Exporter(object):
+class RowFlattener(object):
 
-    """Abstract generic exporter class."""
+    """Flatten nested dictionaries into single level ones, the same way
+    flatten_json does.
+
+    The flat key built for each (parent key, key) pair is cached, so rows
+    sharing the same structure, as the rows of a project usually do, do
+    not have to build their keys again.
+    """
 
-    repositories = dict(task=[task_repo, 'filter_tasks_by'],
-                        task_run=[task_repo, 'filter_task_runs_by'],
-                        result=[result_repo, 'filter_by'])
-
-    def _get_data(self, table, project_id, flat=False, info_only=False):
-        """Get the data for a given table."""
-        repo, query = self.repositories[table]
-        data = getattr(repo, query)(project_id=project_id)
-        ignore_keys = current_app.config.get('IGNORE_FLAT_KEYS') or []
-        if table == 'task':
-            csv_export_key = current_app.config.get('TASK_CSV_EXPORT_INFO_KEY')
-        if table == 'task_run':
-            csv_export_key = current_app.config.get('TASK_RUN_CSV_EXPORT_INFO_KEY')
-        if table == 'result':
-            csv_export_key = current_app.config.get('RESULT_CSV_EXPORT_INFO_KEY')
-        if info_only:
-            if flat:
-                tmp = []
-                for row in data:
-                    inf = copy.deepcopy(row.dictize()['info'])
-                    if inf and type(inf) == dict and csv_export_key and inf.get(csv_export_key):
-                        inf = inf[csv_export_key]
-                    new_key = '%s_id' % table
-                    if inf and type(inf) == dict:
-                        inf[new_key] = row.id
-                        tmp.append(flatten(inf,
-                                           root_keys_to_ignore=ignore_keys))
-                    elif inf and type(inf) == list:
-                        for datum in inf:
-                            if type(datum) == dict:
-                                datum[new_key] = row.id
-                                tmp.append(flatten(datum,
-                                                   root_keys_to_ignore=ignore_keys))
+    def __init__(self, separator='_', root_keys_to_ignore=None,
+                 flatten_lists=True):
+        self.separator = separator
+        self.root_keys_to_ignore = set(root_keys_to_ignore or [])
+        self.flatten_lists = flatten_lists
+        self._keys = {}
+
+    def flatten(self, row):
+        flat = {}
+        for key, value in row.iteritems():
+            if key not in self.root_keys_to_ignore:
+                self._flatten(value, key, flat)
+        return flat
+
+    def _flatten(self, obj, key, flat):
+        if isinstance(obj, dict):
+            for k, v in obj.iteritems():
+                self._flatten(v, self._key(key, k), flat)
+        elif self.flatten_lists and isinstance(obj, (list, set)):
+            for i, v in enumerate(obj):
+                self._flatten(v, self._key(key, i), flat)
+        else:
+            flat[key] = obj
+
+    def _key(self, parent, key):
+        try:
+            return self._keys[(parent, key)]
+        except KeyError:
+            if parent:
+                flat_key = u'{}{}{}'.format(parent, self.separator, key)
             else:
-                tmp = []
-                for row in data:
-                    if row.dictize()['info']:
-                        tmp.append(row.dictize()['info'])
-                    else:
-                        tmp.append({})
+                flat_key = key
+            self._keys[(parent, key)] = flat_key
+            return flat_key
+
+
+class ZipEntryWriter(object):
+
+    """File like object compressing what is written to it straight into a
+    new entry of a ZipFile, so that data does not need to be staged in a
+    temporary file before being zipped.
+    """
+
+    def __init__(self, zip_file, arcname):
+        zinfo = zipfile.ZipInfo(filename=arcname,
+                                date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = zip_file.compression
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = zinfo.compress_size = zinfo.CRC = 0
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(zinfo)
+        zip_file._didModify = True
+        # The final size is not known yet, so leave room for ZIP64 sizes
+        self._zip64 = zip_file._allowZip64
+        zip_file.fp.write(zinfo.FileHeader(self._zip64))
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                                zlib.DEFLATED, -15)
         else:
-            if flat:
-                tmp = []
-                for row in data:
-                    cleaned = row.dictize()
-                    fav_user_ids = None
-                    task_run_ids = None
-                    if cleaned.get('fav_user_ids'):
-                        fav_user_ids = cleaned['fav_user_ids']
-                        cleaned.pop('fav_user_ids')
-                    if cleaned.get('task_run_ids'):
-                        task_run_ids = cleaned['task_run_ids']
-                        cleaned.pop('task_run_ids')
-
-                    cleaned = flatten(cleaned,
-                                      root_keys_to_ignore=ignore_keys)
-
-                    if fav_user_ids:
-                        cleaned['fav_user_ids'] = fav_user_ids
-                    if task_run_ids:
-                        cleaned['task_run_ids'] = task_run_ids
-
-                    tmp.append(cleaned)
+            self._compressor = None
+        self._zip = zip_file
+        self._zinfo = zinfo
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        zinfo = self._zinfo
+        zinfo.file_size += len(data)
+        zinfo.CRC = zipfile.crc32(data, zinfo.CRC) & 0xffffffff
+        if self._compressor:
+            data = self._compressor.compress(data)
+        zinfo.compress_size += len(data)
+        self._zip.fp.write(data)
+
+    def tell(self):
+        return self._zinfo.file_size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        zinfo = self._zinfo
+        fp = self._zip.fp
+        if self._compressor:
+            data = self._compressor.flush()
+            zinfo.compress_size += len(data)
+            fp.write(data)
+        if not self._zip64 and max(zinfo.file_size,
+                                   zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+        # Write the header again, now with the CRC and sizes
+        position = fp.tell()
+        fp.seek(zinfo.header_offset, 0)
+        fp.write(zinfo.FileHeader(self._zip64))
+        fp.seek(position, 0)
+        self._zip.filelist.append(zinfo)
+        self._zip.NameToInfo[zinfo.filename] = zinfo
+
+
+@contextmanager
+def zip_entry(zip_file, arcname):
+    """Open a new entry of zip_file to write into."""
+    entry = ZipEntryWriter(zip_file, arcname)
+    yield entry
+    entry.close()
+
+
+class Exporter(object):
+
+    """Abstract generic exporter class."""
+
+    csv_export_keys = dict(task='TASK_CSV_EXPORT_INFO_KEY',
+                           task_run='TASK_RUN_CSV_EXPORT_INFO_KEY',
+                           result='RESULT_CSV_EXPORT_INFO_KEY')
+
+    def _get_data(self, table, project_id, flat=False, info_only=False,
+                  flattener=None):
+        """Yield the data for a given table.
+
+        Rows are streamed from the database, so the table is never held in
+        memory as a whole. A flattener can be given to share its cached
+        keys between several passes over the same table.
+        """
+        if flat and flattener is None:
+            ignore_keys = current_app.config.get('IGNORE_FLAT_KEYS') or []
+            flattener = RowFlattener(root_keys_to_ignore=ignore_keys)
+        csv_export_key = current_app.config.get(self.csv_export_keys[table])
+        new_key = '%s_id' % table
+        # Every row is a new dict decoded from the database, so it can be
+        # modified in place
+        for row in export_rows(table, project_id):
+            if info_only:
+                inf = row['info']
+                if not flat:
+                    yield inf or {}
+                    continue
+                if inf and type(inf) == dict and csv_export_key and inf.get(csv_export_key):
+                    inf = inf[csv_export_key]
+                if inf and type(inf) == dict:
+                    inf[new_key] = row['id']
+                    yield flattener.flatten(inf)
+                elif inf and type(inf) == list:
+                    for datum in inf:
+                        if type(datum) == dict:
+                            datum[new_key] = row['id']
+                            yield flattener.flatten(datum)
+            elif flat:
+                fav_user_ids = row.get('fav_user_ids')
+                task_run_ids = row.get('task_run_ids')
+                if fav_user_ids:
+                    row.pop('fav_user_ids')
+                if task_run_ids:
+                    row.pop('task_run_ids')
+
+                cleaned = flattener.flatten(row)
+
+                if fav_user_ids:
+                    cleaned['fav_user_ids'] = fav_user_ids
+                if task_run_ids:
+                    cleaned['task_run_ids'] = task_run_ids
+                yield cleaned
             else:
-                tmp = [row.dictize() for row in data]
-        return tmp
+                yield row
 
     def _project_name_latin_encoded(self, project):
         """project short name for later HTML header usage"""
@@ -210,22 +312,31 @@ class Exporter(object):
 
         :return: The path where the .zip file is saved
         """
-        name = self._project_name_latin_encoded(project)
         if obj_generator is not None:
-            with tempfile.NamedTemporaryFile() as datafile:
+            def write_data(datafile):
                 for line in obj_generator:
-                    datafile.write(str(line))
-                datafile.flush()
+                    datafile.write(line)
                 obj_generator.close()
 
-                zipped_datafile = tempfile.NamedTemporaryFile()
+            return self._make_zipfile_from(project, obj, file_format,
+                                           write_data)
+
+    def _make_zipfile_from(self, project, obj, file_format, write_data):
+        """Generate a ZIP with a single file written by write_data, a
+        function taking the file like object to write to.
+
+        :return: The path where the .zip file is saved
+        """
+        name = self._project_name_latin_encoded(project)
+        zipped_datafile = tempfile.NamedTemporaryFile()
+        arcname = secure_filename('{0}_{1}.{2}'
+                                  .format(name, obj, file_format))
 
-                with self._zip_factory(zipped_datafile.name) as _zip:
-                    _zip.write(datafile.name,
-                               secure_filename('{0}_{1}.{2}'
-                                               .format(name, obj, file_format)))
-                    _zip.content_type = 'application/zip'
+        with self._zip_factory(zipped_datafile.name) as _zip:
+            with zip_entry(_zip, arcname) as datafile:
+                write_data(datafile)
+            _zip.content_type = 'application/zip'
 
-                filename = self.download_name(project, obj)
-                fs = FileStorage(filename=filename, stream=zipped_datafile)
-                return closing(fs)
+        filename = self.download_name(project, obj)
+        fs = FileStorage(filename=filename, stream=zipped_datafile)
+        return closing(fs)
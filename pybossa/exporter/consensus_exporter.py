@@ -11,6 +11,8 @@ from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
 from pybossa.exporter import Exporter
+from pybossa.exporter.export_helpers import stream_rows
+from pybossa.exporter.parquet_export import write_parquet
 from pybossa.core import db, uploader
 from pybossa.cache.task_browse_helpers import get_task_filters
 from pybossa.cache.users import get_user_info
@@ -28,6 +30,10 @@ def export_consensus_csv(project, ty, expanded, filters):
     return export_consensus(project, ty, 'csv', expanded, filters)
 
 
+def export_consensus_parquet(project, ty, expanded, filters):
+    return export_consensus(project, ty, 'parquet', expanded, filters)
+
+
 def export_consensus(project, obj, filetype, expanded, filters):
     if expanded:
         get_data = get_consensus_data_metadata
@@ -35,6 +41,9 @@ def export_consensus(project, obj, filetype, expanded, filters):
         get_data = get_consensus_data
     if filetype == 'json':
         formatter = json_formatter
+    elif filetype == 'parquet':
+        formatter = parquet_formatter
+        get_data = _streamed(get_data)
     else:
         formatter = csv_formatter
     exporter = ConsensusExporter(get_data, formatter)
@@ -55,6 +64,20 @@ def json_formatter(data, fp):
     json.dump(data, fp)
 
 
+def parquet_formatter(data, fp):
+    # Consensus rows are already flat: answers of the contributors are
+    # kept as JSON, as in the CSV format
+    write_parquet(data, fp, flatten=False)
+
+
+def _streamed(get_data):
+    """Make get_data return a function streaming the consensus rows, as
+    the parquet formatter reads them twice."""
+    def get_streamed_data(project_id, filters):
+        return lambda: get_data(project_id, filters, streamed=True)
+    return get_streamed_data
+
+
 def flatten(obj, level=1, prefix=None, sep='__', ignore=tuple()):
     flattened = OrderedDict()
 
@@ -77,7 +100,10 @@ def flatten(obj, level=1, prefix=None, sep='__', ignore=tuple()):
 
 
 def format_consensus(rows):
-    rv = []
+    return list(iter_format_consensus(rows))
+
+
+def iter_format_consensus(rows):
     local_user_cache = {}
     for row in rows:
         data = OrderedDict(row)
@@ -105,12 +131,28 @@ def format_consensus(rows):
                     user_pct['answer_percentage'] = user_pct.pop('percentage', None)
 
         consensus.update(data)
-        rv.append(consensus)
-    return rv
+        yield consensus
+
 
+def get_consensus_data(project_id, filters, streamed=False, since=None,
+                       upto=None):
+    """Return the consensus of the completed tasks of a project.
 
-def get_consensus_data(project_id, filters):
+    since and upto are export watermarks, dictionaries with task_run_id and
+    result_id keys. When given, only the tasks with a task run or a result
+    between both of them are returned.
+    """
     conditions, filter_params = get_task_filters(filters)
+    params = dict(project_id=project_id, **filter_params)
+    if since is not None:
+        conditions += '''
+        AND ((taskruns.last_task_run_id > :since_task_run_id
+              AND taskruns.last_task_run_id <= :upto_task_run_id)
+             OR (r.id > :since_result_id AND r.id <= :upto_result_id))'''
+        params.update(since_task_run_id=since['task_run_id'],
+                      since_result_id=since['result_id'],
+                      upto_task_run_id=upto['task_run_id'],
+                      upto_result_id=upto['result_id'])
     query = text('''
         SELECT
             task.id as task_id,
@@ -130,7 +172,8 @@ def get_consensus_data(project_id, filters):
                 array_agg(tr.created) as task_run__created,
                 array_agg(tr.finish_time) as task_run__finish_time,
                 array_agg(tr.user_id) as task_run__user_id,
-                json_object_agg(u.name, tr.info) as task_run__info
+                json_object_agg(u.name, tr.info) as task_run__info,
+                MAX(tr.id) as last_task_run_id
             FROM task_run tr
             JOIN "user" u
             ON tr.user_id = u.id
@@ -145,12 +188,13 @@ def get_consensus_data(project_id, filters):
         AND task.project_id=:project_id
         {};
     '''.format(conditions))
-    params = dict(project_id=project_id, **filter_params)
+    if streamed:
+        return iter_format_consensus(stream_rows(query, params))
     rows = db.slave_session.execute(query, params).fetchall()
     return format_consensus(rows)
 
 
-def get_consensus_data_metadata(project_id, filters):
+def get_consensus_data_metadata(project_id, filters, streamed=False):
     conditions, filter_params = get_task_filters(filters)
     query = text('''
         SELECT
@@ -193,6 +237,8 @@ def get_consensus_data_metadata(project_id, filters):
         {};
     '''.format(conditions))
     params = dict(project_id=project_id, **filter_params)
+    if streamed:
+        return iter_format_consensus(stream_rows(query, params))
     rows = db.slave_session.execute(query, params).fetchall()
     return format_consensus(rows)
 
@@ -21,54 +21,58 @@ CSV Exporter module for exporting tasks and tasks results out of PYBOSSA
 """
 
 import tempfile
-from pybossa.exporter import Exporter
-from pybossa.core import uploader, task_repo
-from pybossa.model.task import Task
-from pybossa.model.task_run import TaskRun
+from flask import current_app
+from pybossa.exporter import Exporter, RowFlattener, zip_entry
+from pybossa.core import uploader
 from pybossa.util import UnicodeWriter
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
-import pandas as pd
 
 
 class CsvExporter(Exporter):
 
     def _respond_csv(self, table, project_id, info_only=False):
-        flat_data = self._get_data(table, project_id,
-                                   flat=True, info_only=info_only)
-        return pd.DataFrame(flat_data)
+        """Yield the CSV rows of a table, headers first.
+
+        The columns are the union of the flat keys of all the rows, so
+        the rows are streamed twice: once to collect the columns and once
+        to write them. The flattener caches the flat keys between both.
+        """
+        ignore_keys = current_app.config.get('IGNORE_FLAT_KEYS') or []
+        flattener = RowFlattener(root_keys_to_ignore=ignore_keys)
+        headers = set()
+        for row in self._get_data(table, project_id, flat=True,
+                                  info_only=info_only, flattener=flattener):
+            headers.update(row.iterkeys())
+        headers = sorted(headers)
+        yield headers
+        for row in self._get_data(table, project_id, flat=True,
+                                  info_only=info_only, flattener=flattener):
+            yield [_csv_value(row.get(header)) for header in headers]
+
+    def _write_csv(self, _zip, arcname, table, project_id, info_only=False):
+        with zip_entry(_zip, arcname) as datafile:
+            writer = UnicodeWriter(datafile, lineterminator='\n')
+            for row in self._respond_csv(table, project_id, info_only):
+                writer.writerow(row)
 
     def _make_zip(self, project, ty):
         name = self._project_name_latin_encoded(project)
-        dataframe = self._respond_csv(ty, project.id)
-        if dataframe is not None:
-            info_dataframe = self._respond_csv(ty, project.id, info_only=True)
-            datafile = tempfile.NamedTemporaryFile()
-            info_datafile = tempfile.NamedTemporaryFile()
-            try:
-                dataframe.to_csv(datafile, index=False,
-                                 encoding='utf-8')
-                info_dataframe.to_csv(
-                    info_datafile, index=False, encoding='utf-8')
-                datafile.flush()
-                info_datafile.flush()
-                zipped_datafile = tempfile.NamedTemporaryFile()
-                try:
-                    _zip = self._zip_factory(zipped_datafile.name)
-                    _zip.write(
-                        datafile.name, secure_filename('%s_%s.csv' % (name, ty)))
-                    _zip.write(
-                        info_datafile.name, secure_filename('%s_%s_info_only.csv' % (name, ty)))
-                    _zip.close()
-                    container = "user_%d" % project.owner_id
-                    _file = FileStorage(
-                        filename=self.download_name(project, ty), stream=zipped_datafile)
-                    uploader.upload_file(_file, container=container)
-                finally:
-                    zipped_datafile.close()
-            finally:
-                datafile.close()
-                info_datafile.close()
+        zipped_datafile = tempfile.NamedTemporaryFile()
+        try:
+            _zip = self._zip_factory(zipped_datafile.name)
+            self._write_csv(_zip, secure_filename('%s_%s.csv' % (name, ty)),
+                            ty, project.id)
+            self._write_csv(_zip,
+                            secure_filename('%s_%s_info_only.csv' % (name, ty)),
+                            ty, project.id, info_only=True)
+            _zip.close()
+            container = "user_%d" % project.owner_id
+            _file = FileStorage(
+                filename=self.download_name(project, ty), stream=zipped_datafile)
+            uploader.upload_file(_file, container=container)
+        finally:
+            zipped_datafile.close()
 
     def download_name(self, project, ty):
         return super(CsvExporter, self).download_name(project, ty, 'csv')
@@ -78,3 +82,7 @@ class CsvExporter(Exporter):
         self._make_zip(project, "task")
         self._make_zip(project, "task_run")
         self._make_zip(project, "result")
+
+
+def _csv_value(value):
+    return u'' if value is None else value
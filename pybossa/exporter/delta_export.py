@@ -0,0 +1,190 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Delta Exporter module for incremental exports of the contributions to a
+project.
+
+Every delta export writes the task runs, results and consensus rows that
+are new since the previous one to an append-only chunk file, and moves a
+per project watermark forward. Periodic syncs then cost time proportional
+to the new work, not to the size of the project.
+"""
+
+import json
+import tempfile
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.sql import text
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from pybossa.core import db, sentinel, uploader
+from pybossa.exporter import Exporter, zip_entry
+from pybossa.exporter.export_helpers import export_rows
+from pybossa.exporter.consensus_exporter import get_consensus_data
+
+
+WATERMARK_KEY = 'pybossa:project:export_watermark:{0}'
+
+WATERMARK_IDS = ('task_run_id', 'result_id')
+
+
+def get_watermark(project_id, conn):
+    """Return the watermark of the last delta export of a project."""
+    stored = conn.hgetall(WATERMARK_KEY.format(project_id))
+    watermark = dict(task_run_id=0, result_id=0, finish_time=None,
+                     chunk=None)
+    for key, value in stored.iteritems():
+        key = key.decode('utf-8') if isinstance(key, str) else key
+        if key in WATERMARK_IDS:
+            value = int(value)
+        elif isinstance(value, str):
+            value = value.decode('utf-8')
+        watermark[key] = value
+    return watermark
+
+
+def set_watermark(project_id, watermark, conn):
+    mapping = {key: value for key, value in watermark.iteritems()
+               if value is not None}
+    conn.hmset(WATERMARK_KEY.format(project_id), mapping)
+
+
+def reset_watermark(project_id, conn):
+    """Start the delta exports of a project from the beginning again."""
+    conn.delete(WATERMARK_KEY.format(project_id))
+
+
+def _current_watermark(project_id):
+    """Return the watermark of the rows of a project committed so far, or
+    None if it is not safe to move the watermark yet.
+
+    Ids are taken from the sequences before the rows are committed, so a
+    transaction still running may commit a row below the highest id read.
+    The ids are only used once the transactions running when they were
+    read have ended.
+    """
+    sql = text('''
+               SELECT (SELECT MAX(id) FROM task_run
+                        WHERE project_id = :project_id) AS task_run_id
+                    , (SELECT finish_time FROM task_run
+                        WHERE project_id = :project_id
+                        ORDER BY id DESC LIMIT 1) AS finish_time
+                    , (SELECT MAX(id) FROM result
+                        WHERE project_id = :project_id) AS result_id
+                    , txid_current_snapshot()::text AS snapshot
+               ''')
+    row = db.slave_session.execute(sql, dict(project_id=project_id)).first()
+    if not _wait_for_transactions(row.snapshot):
+        return None
+    return dict(task_run_id=row.task_run_id or 0,
+                result_id=row.result_id or 0,
+                finish_time=row.finish_time)
+
+
+def _wait_for_transactions(snapshot):
+    """Wait up to DELTA_EXPORT_WAIT seconds for the transactions running in
+    a snapshot to end. Return whether they did."""
+    sql = text('''
+               SELECT NOT EXISTS (
+                   SELECT 1 FROM txid_snapshot_xip(
+                       CAST(:snapshot AS txid_snapshot)) AS running(txid)
+                   WHERE NOT txid_visible_in_snapshot(
+                       running.txid, txid_current_snapshot()))
+               ''')
+    deadline = time.time() + current_app.config.get('DELTA_EXPORT_WAIT', 10)
+    while not db.slave_session.execute(sql, dict(snapshot=snapshot)).scalar():
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+class DeltaExporter(Exporter):
+    """Exporter writing the contributions to a project since the previous
+    delta export as a ZIP of newline delimited JSON files.
+    """
+
+    def download_name(self, project, ty):
+        return super(DeltaExporter, self).download_name(project, ty, 'delta')
+
+    def chunk_name(self, project, created):
+        name = self._project_name_latin_encoded(project)
+        filename = '%s_%s_delta_%s.zip' % (project.id, name,
+                                           created.strftime('%Y%m%d%H%M%S%f'))
+        return secure_filename(filename)
+
+    def export(self, project):
+        """Upload a chunk with the task runs, results and consensus rows
+        added since the watermark of the project, and move the watermark
+        forward.
+
+        Chunks cover the ids between both watermarks, so rows land in
+        exactly one of them, and the watermark only moves once its chunk
+        has been uploaded. The ids of the watermark are only used once no
+        transaction can still commit a row below them.
+
+        :return: The name of the uploaded chunk, or None if there was
+            nothing new to export, or if transactions that may add rows
+            kept running; the next export picks the rows up.
+        """
+        conn = sentinel.master
+        since = get_watermark(project.id, conn)
+        upto = _current_watermark(project.id)
+        if upto is None:
+            current_app.logger.warning(
+                'Delta export of project %s postponed: transactions still '
+                'running', project.id)
+            return None
+        if all(upto[key] <= since[key] for key in WATERMARK_IDS):
+            return None
+        for key in WATERMARK_IDS:
+            # A lagging replica must not move the watermark backwards
+            upto[key] = max(upto[key], since[key])
+
+        filename = self.chunk_name(project, datetime.utcnow())
+        name = self._project_name_latin_encoded(project)
+        zipped_datafile = tempfile.NamedTemporaryFile()
+        try:
+            with self._zip_factory(zipped_datafile.name) as _zip:
+                for table in ('task_run', 'result'):
+                    key = '{0}_id'.format(table)
+                    rows = export_rows(table, project.id, since[key],
+                                       upto[key])
+                    self._write_ndjson(_zip, name, table, rows)
+                rows = get_consensus_data(project.id, None, streamed=True,
+                                          since=since, upto=upto)
+                self._write_ndjson(_zip, name, 'consensus', rows)
+            _file = FileStorage(filename=filename, stream=zipped_datafile)
+            if not uploader.upload_file(_file,
+                                        container=self._container(project)):
+                raise IOError('Delta export %s could not be uploaded'
+                              % filename)
+        finally:
+            zipped_datafile.close()
+
+        upto['chunk'] = filename
+        set_watermark(project.id, upto, conn)
+        return filename
+
+    def _write_ndjson(self, _zip, name, table, rows):
+        arcname = secure_filename('%s_%s.ndjson' % (name, table))
+        with zip_entry(_zip, arcname) as datafile:
+            for row in rows:
+                datafile.write(json.dumps(row))
+                datafile.write('\n')
@@ -16,9 +16,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 """Exporter module helper functions."""
-from sqlalchemy.sql import text
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.sql import select, text
 from pybossa.core import db
 from pybossa.cache.task_browse_helpers import get_task_filters
+from pybossa.model.task import Task
+from pybossa.model.task_run import TaskRun
+from pybossa.model.result import Result
 
 
 USER_FIELDS = [
@@ -62,6 +67,10 @@ TASK_GOLD_FIELD = [
    'task.gold_answers AS {}gold_answers'
 ]
 
+EXPORT_TABLES = dict(task=Task.__table__,
+                     task_run=TaskRun.__table__,
+                     result=Result.__table__)
+
 session = db.slave_session
 
 
@@ -69,6 +78,45 @@ def _field_mapreducer(fields, prefix=''):
     return ',\n'.join(field.format(prefix) for field in fields)
 
 
+def stream_rows(sql, params=None):
+    """Yield the rows of a query, reading them through a server side
+    cursor EXPORT_FETCH_SIZE rows at a time instead of loading the whole
+    result set in memory.
+    """
+    fetch_size = current_app.config.get('EXPORT_FETCH_SIZE', 1000)
+    sql = sql.execution_options(stream_results=True)
+    results = session.execute(sql, params or {})
+    try:
+        while True:
+            rows = results.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        results.close()
+
+
+def export_rows(table, project_id, min_id=None, max_id=None):
+    """Yield the rows of a table for a project, ordered by id, as the
+    dictionaries that dictize would return for them.
+
+    If given, only rows with min_id < id <= max_id are returned.
+    """
+    _table = EXPORT_TABLES[table]
+    columns = [col for col in _table.columns if col.info.get('dictize', True)]
+    sql = select(columns)\
+                .where(_table.c.project_id == project_id)\
+                .order_by(_table.c.id)
+    if min_id is not None:
+        sql = sql.where(_table.c.id > min_id)
+    if max_id is not None:
+        sql = sql.where(_table.c.id <= max_id)
+    for row in stream_rows(sql):
+        yield {key: value.isoformat() if isinstance(value, datetime) else value
+               for key, value in row.items()}
+
+
 def browse_tasks_export(obj, project_id, expanded, filters):
     """Export tasks from the browse tasks view for a project
     using the same filters that are selected by the user
@@ -148,7 +196,7 @@ def browse_tasks_export(obj, project_id, expanded, filters):
                      )
     else:
         return
-    return session.execute(sql, dict(project_id=project_id, **filter_params))
+    return stream_rows(sql, dict(project_id=project_id, **filter_params))
 
 
 def browse_tasks_export_count(obj, project_id, expanded, filters):
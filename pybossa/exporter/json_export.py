@@ -23,7 +23,7 @@ JSON Exporter module for exporting tasks and tasks results out of PYBOSSA
 import uuid
 import json
 import tempfile
-from pybossa.exporter import Exporter
+from pybossa.exporter import Exporter, zip_entry
 from pybossa.core import uploader, task_repo, sentinel
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
@@ -38,7 +38,13 @@ scheduler = Scheduler(queue_name='scheduled_jobs', connection=redis_conn)
 class JsonExporter(Exporter):
 
     def gen_json(self, table, project_id):
-        return self._get_data(table, project_id)
+        """Yield a JSON array of the rows of a table, one row at a time."""
+        sep = ""
+        yield "["
+        for row in self._get_data(table, project_id):
+            yield sep + json.dumps(row)
+            sep = ", "
+        yield "]"
 
     def _respond_json(self, ty, id):  # TODO: Refactor _respond_json out?
         # TODO: check ty here
@@ -47,7 +53,7 @@ class JsonExporter(Exporter):
     def _make_zip(self, project, ty, name=None, data=None, user_id=None,
                   zipname=None):
         if data:
-            return self.handle_zip(name, data, ty,
+            return self.handle_zip(name, [json.dumps(data)], ty,
                                    user_id, project,
                                    'json', zipname)
         else:
@@ -67,17 +73,14 @@ class JsonExporter(Exporter):
         self._make_zip(project, "result")
 
     def handle_zip(self, name, data, ty, user_id, project, ext, zipname=None):
+        """Zip and upload data, an iterable of JSON chunks."""
         zipped_datafile = tempfile.NamedTemporaryFile()
         _zip = self._zip_factory(zipped_datafile.name)
         try:
-            datafile = tempfile.NamedTemporaryFile()
-            try:
-                datafile.write(json.dumps(data))
-                datafile.flush()
-                _zip.write(datafile.name,
-                           secure_filename('%s_%s.%s' % (name, ty, ext)))
-            finally:
-                datafile.close()
+            arcname = secure_filename('%s_%s.%s' % (name, ty, ext))
+            with zip_entry(_zip, arcname) as datafile:
+                for chunk in data:
+                    datafile.write(chunk)
         finally:
             _zip.close()
             if user_id:
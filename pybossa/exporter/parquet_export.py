@@ -0,0 +1,193 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Parquet Exporter module for exporting tasks, task runs and consensus
+results out of PYBOSSA in a typed, columnar format.
+
+Parquet support needs pyarrow, which is an optional dependency. Without it
+the parquet format is not offered.
+"""
+
+import json
+from datetime import datetime
+from flask import current_app
+from pybossa.exporter import Exporter, RowFlattener
+from pybossa.exporter.export_helpers import browse_tasks_export
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+
+# Columns holding ISO formatted dates, as stored by PYBOSSA
+TIMESTAMP_COLUMNS = ('created', 'finish_time')
+
+
+def parquet_available():
+    """Return True if the Parquet format can be exported."""
+    return pq is not None
+
+
+def _parse_timestamp(value):
+    # isoformat leaves the microseconds out when they are 0
+    if '.' in value:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+
+def _is_timestamp_column(key):
+    return key.rsplit('__', 1)[-1] in TIMESTAMP_COLUMNS
+
+
+def _value_kind(key, value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, long)):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, basestring):
+        if _is_timestamp_column(key):
+            try:
+                _parse_timestamp(value)
+                return 'timestamp'
+            except ValueError:
+                pass
+        return 'string'
+    return 'json'
+
+
+class ColumnTypes(object):
+
+    """Infer the type of the columns of flat rows.
+
+    Columns keep their type when all their values share it, so ids stay
+    integers and dates stay timestamps. Integer columns with floats become
+    floats, and any other mix is stored as strings. Values which are
+    lists or dictionaries are stored as JSON strings.
+    """
+
+    def __init__(self):
+        self._kinds = {}
+
+    def update(self, row):
+        for key, value in row.iteritems():
+            kinds = self._kinds.setdefault(key, set())
+            if value is not None:
+                kinds.add(_value_kind(key, value))
+
+    def schema(self):
+        return pa.schema([pa.field(key, self._arrow_type(kinds))
+                          for key, kinds in sorted(self._kinds.items())])
+
+    @staticmethod
+    def _arrow_type(kinds):
+        if kinds == set(['bool']):
+            return pa.bool_()
+        if kinds == set(['int']):
+            return pa.int64()
+        if kinds and kinds <= set(['int', 'float']):
+            return pa.float64()
+        if kinds == set(['timestamp']):
+            return pa.timestamp('us')
+        return pa.string()
+
+
+def _to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return unicode(value)
+
+
+def _converter(arrow_type):
+    if arrow_type == pa.timestamp('us'):
+        return _parse_timestamp
+    if arrow_type == pa.float64():
+        return float
+    if arrow_type == pa.string():
+        return _to_unicode
+
+
+def _to_table(rows, schema):
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        convert = _converter(field.type)
+        if convert is not None:
+            values = [None if value is None else convert(value)
+                      for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(rows, fp, flatten=True):
+    """Write rows as a Parquet file to fp.
+
+    :param rows: a function returning an iterator of row dictionaries. It
+        is called twice: once to infer the columns and their types, then
+        to write the rows in row groups of EXPORT_PARQUET_ROW_GROUP_SIZE.
+    :param fp: file like object to write to
+    :param flatten: if nested dictionaries should be flattened into
+        columns, otherwise they are stored as JSON strings
+    """
+    if flatten:
+        flat = RowFlattener(separator='__', flatten_lists=False).flatten
+    else:
+        flat = dict
+    column_types = ColumnTypes()
+    for row in rows():
+        column_types.update(flat(row))
+    schema = column_types.schema()
+
+    row_group_size = current_app.config.get('EXPORT_PARQUET_ROW_GROUP_SIZE',
+                                            10000)
+    writer = pq.ParquetWriter(fp, schema)
+    try:
+        batch = []
+        for row in rows():
+            batch.append(flat(row))
+            if len(batch) >= row_group_size:
+                writer.write_table(_to_table(batch, schema))
+                batch = []
+        if batch:
+            writer.write_table(_to_table(batch, schema))
+    finally:
+        writer.close()
+
+
+class TaskParquetExporter(Exporter):
+    """Parquet Exporter for exporting ``Task``s and ``TaskRun``s
+    for a project.
+    """
+
+    def download_name(self, project, ty):
+        return super(TaskParquetExporter, self).download_name(project, ty,
+                                                              'parquet')
+
+    def make_zip(self, project, obj, expanded=False, filters=None):
+        def rows():
+            return (dict(row) for row in
+                    browse_tasks_export(obj, project.id, expanded, filters))
+
+        return self._make_zipfile_from(project, obj, 'parquet',
+                                       lambda fp: write_parquet(rows, fp))
@@ -17,7 +17,7 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 # Cache global variables for timeouts
 
-import tempfile
+from cStringIO import StringIO
 from flask import url_for, safe_join, send_file, redirect
 from pybossa.uploader import local
 from pybossa.exporter.csv_export import CsvExporter
@@ -25,6 +25,10 @@ from pybossa.core import uploader, task_repo
 from pybossa.util import UnicodeWriter
 from export_helpers import browse_tasks_export
 
+
+CSV_CHUNK_SIZE = 64 * 1024
+
+
 class TaskCsvExporter(CsvExporter):
     """CSV Exporter for exporting ``Task``s and ``TaskRun``s
     for a project.
@@ -164,25 +168,27 @@ class TaskCsvExporter(CsvExporter):
 
     def _get_csv_with_filters(self, out, writer, table, project_id,
                               expanded, filters):
-        objs = browse_tasks_export(table, project_id, expanded, filters)
-        rows = [obj for obj in objs]
-        # for row in rows:
-        #     if row['info']:
-        #         info = dict(TaskCsvExporter.flatten(row['info'].iteritems()))
-        #         row['info'].update(info)
+        """Yield the CSV file in chunks of about CSV_CHUNK_SIZE bytes.
 
-        headers = self._get_all_headers(objs=rows,
+        The rows are streamed twice from the database: first to collect
+        the headers of all of them, then to write them.
+        """
+        objs = browse_tasks_export(table, project_id, expanded, filters)
+        headers = self._get_all_headers(objs=objs,
                                         expanded=expanded,
                                         table=table,
                                         from_obj=False)
         writer.writerow(headers)
 
-        for row in rows:
+        for row in browse_tasks_export(table, project_id, expanded, filters):
             row = self.process_filtered_row(dict(row))
             writer.writerow(self._format_csv_row(row, headers))
+            if out.tell() >= CSV_CHUNK_SIZE:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
 
-        out.seek(0)
-        yield out.read()
+        yield out.getvalue()
 
     def _get_all_headers(self, objs, expanded, table=None, from_obj=True):
         """Construct headers to **guarantee** that all headers
@@ -221,7 +227,7 @@ class TaskCsvExporter(CsvExporter):
         return headers
 
     def _respond_csv(self, ty, project_id, expanded=False, filters=None):
-        out = tempfile.TemporaryFile()
+        out = StringIO()
         writer = UnicodeWriter(out)
 
         return self._get_csv_with_filters(
@@ -22,7 +22,7 @@ from flask import url_for, safe_join, send_file, redirect
 from pybossa.core import uploader, task_repo
 from pybossa.uploader import local
 from pybossa.exporter.json_export import JsonExporter
-from export_helpers import browse_tasks_export, browse_tasks_export_count
+from export_helpers import browse_tasks_export, export_rows
 
 
 class TaskJsonExporter(JsonExporter):
@@ -86,38 +86,27 @@ class TaskJsonExporter(JsonExporter):
         else:
             return
 
-        n = getattr(task_repo, 'count_%ss_with' % obj)(project_id=project_id)
-        sep = ", "
-        yield "["
-
-        for i, tr in enumerate(query_filter(project_id=project_id, yielded=True), 1):
-            if expanded:
-                item = self.merge_objects(tr)
-            else:
-                item = tr.dictize()
-
-            item = json.dumps(item)
+        if expanded:
+            items = (self.merge_objects(tr) for tr in
+                     query_filter(project_id=project_id, yielded=True))
+        else:
+            items = export_rows(obj, project_id)
 
-            if (i == n):
-                sep = ""
-            yield item + sep
+        sep = ""
+        yield "["
+        for item in items:
+            yield sep + json.dumps(item)
+            sep = ", "
         yield "]"
 
     def gen_json_with_filters(self, obj, project_id, expanded, filters):
         objs = browse_tasks_export(obj, project_id, expanded, filters)
-        n = browse_tasks_export_count(obj, project_id, expanded, filters)
 
-        sep = ", "
+        sep = ""
         yield "["
-
-        count = 0
         for obj in objs:
-            item = json.dumps(self.process_filtered_row(dict(obj)))
-            count += 1
-
-            if count == n:
-                sep = ""
-            yield item + sep
+            yield sep + json.dumps(self.process_filtered_row(dict(obj)))
+            sep = ", "
         yield "]"
 
     def _respond_json(self, ty, project_id, expanded=False, filters=None):
@@ -17,7 +17,6 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 import requests
-from StringIO import StringIO
 from flask_babel import gettext
 from pybossa.util import unicode_csv_reader, validate_required_fields
 from pybossa.util import unicode_csv_reader
@@ -31,6 +30,10 @@ from pybossa.util import get_import_csv_file
 import re
 from pybossa.data_access import data_access_levels
 
+
+CSV_CHUNK_SIZE = 64 * 1024
+
+
 class BulkTaskCSVImport(BulkTaskImport):
 
     """Class to import CSV tasks in bulk."""
@@ -43,9 +46,23 @@ class BulkTaskCSVImport(BulkTaskImport):
 
     def tasks(self):
         """Get tasks from a given URL."""
+        return self._import_csv_tasks(self._get_csv_reader())
+
+    def count_tasks(self):
+        """Count the rows of the CSV file without building the tasks."""
+        csvreader = self._get_csv_reader()
+        self._read_headers(csvreader)
+        row_number = 0
+        for row in csvreader:
+            row_number += 1
+            self._check_valid_row(row, row_number)
+        return row_number
+
+    def _get_csv_reader(self):
+        """Get a CSV reader streaming the rows of the file at the URL."""
         dataurl = self._get_data_url()
-        r = requests.get(dataurl)
-        return self._get_csv_data_from_request(r)
+        r = requests.get(dataurl, stream=True)
+        return self._get_csv_reader_from_request(r)
 
     def _get_data_url(self):
         """Get data from URL."""
@@ -101,35 +118,52 @@ class BulkTaskCSVImport(BulkTaskImport):
         return task_data
 
     def _import_csv_tasks(self, csvreader):
-        """Import CSV tasks."""
+        """Import CSV tasks.
+
+        The header row is read and checked right away, so that headers()
+        is available before the tasks are consumed. The rows are converted
+        lazily as the returned generator is iterated.
+        """
+        self._read_headers(csvreader)
+        return self._convert_csv_rows(csvreader)
+
+    def _read_headers(self, csvreader):
+        """Read and check the header row, skipping leading empty rows."""
         fields = set(['state', 'quorum', 'calibration', 'priority_0',
                       'n_answers', 'user_pref', 'expiration'])
         self._headers = []
         self.field_header_index = []
-        row_number = 0
         for row in csvreader:
-            if not self._headers:
+            if row:
                 self._headers = row
-                self._check_no_duplicated_headers()
-                self._check_no_empty_headers()
-                self._check_required_headers()
-                field_headers = set(self._headers) & fields
-                for field in field_headers:
-                    self.field_header_index.append(self._headers.index(field))
-            else:
-                row_number += 1
-                self._check_valid_row_length(row, row_number)
-
-                # check required fields
-                fvals = {self._headers[idx]: cell for idx, cell in enumerate(row)}
-                invalid_fields = validate_required_fields(fvals)
-                if invalid_fields:
-                    msg = gettext('The file you uploaded has incorrect/missing '
-                                  'values for required header(s): {0}'
-                                  .format(','.join(invalid_fields)))
-                    raise BulkImportException(msg)
-                task_data = self._convert_row_to_task_data(row, row_number)
-                yield task_data
+                break
+        if not self._headers:
+            return
+        self._check_no_duplicated_headers()
+        self._check_no_empty_headers()
+        self._check_required_headers()
+        field_headers = set(self._headers) & fields
+        for field in field_headers:
+            self.field_header_index.append(self._headers.index(field))
+
+    def _convert_csv_rows(self, csvreader):
+        row_number = 0
+        for row in csvreader:
+            row_number += 1
+            self._check_valid_row(row, row_number)
+            yield self._convert_row_to_task_data(row, row_number)
+
+    def _check_valid_row(self, row, row_number):
+        self._check_valid_row_length(row, row_number)
+
+        # check required fields
+        fvals = {self._headers[idx]: cell for idx, cell in enumerate(row)}
+        invalid_fields = validate_required_fields(fvals)
+        if invalid_fields:
+            msg = gettext('The file you uploaded has incorrect/missing '
+                          'values for required header(s): {0}'
+                          .format(','.join(invalid_fields)))
+            raise BulkImportException(msg)
 
     def _check_no_duplicated_headers(self):
         if len(self._headers) != len(set(self._headers)):
@@ -159,8 +193,8 @@ class BulkTaskCSVImport(BulkTaskImport):
                           'required header(s): {0}'.format(','.join(missing_headers)))
             raise BulkImportException(msg)
 
-    def _get_csv_data_from_request(self, r):
-        """Get CSV data from a request."""
+    def _get_csv_reader_from_request(self, r):
+        """Get a CSV reader for a streamed request."""
         if r.status_code == 403:
             msg = ("Oops! It looks like you don't have permission to access"
                    " that file")
@@ -171,9 +205,8 @@ class BulkTaskCSVImport(BulkTaskImport):
             raise BulkImportException(msg, 'error')
 
         r.encoding = 'utf-8'
-        csvcontent = StringIO(r.text)
-        csvreader = unicode_csv_reader(csvcontent)
-        return self._import_csv_tasks(csvreader)
+        chunks = r.iter_content(CSV_CHUNK_SIZE, decode_unicode=True)
+        return unicode_csv_reader(_iter_lines(chunks))
 
 class BulkTaskGDImport(BulkTaskCSVImport):
 
@@ -209,10 +242,9 @@ class BulkTaskLocalCSVImport(BulkTaskCSVImport):
         """Get data."""
         return self.form_data['csv_filename']
 
-    def count_tasks(self):
-        return len([task for task in self.tasks()])
-
-    def _get_csv_data_from_request(self, csv_filename):
+    def _get_csv_reader(self):
+        """Get a CSV reader streaming the rows of the uploaded file."""
+        csv_filename = self._get_data()
         if csv_filename is None:
             msg = ("Not a valid csv file for import")
             raise BulkImportException(gettext(msg), 'error')
@@ -225,11 +257,35 @@ class BulkTaskLocalCSVImport(BulkTaskCSVImport):
             raise BulkImportException(gettext(msg), 'error')
 
         csv_file.stream.seek(0)
-        csvcontent = io.StringIO(csv_file.stream.read())
-        csvreader = unicode_csv_reader(csvcontent)
-        return list(self._import_csv_tasks(csvreader))
-
-    def tasks(self):
-        """Get tasks from a given URL."""
-        csv_filename = self._get_data()
-        return self._get_csv_data_from_request(csv_filename)
+        return unicode_csv_reader(_read_lines(csv_file.stream, datafile))
+
+
+def _iter_lines(chunks):
+    """Split text chunks into lines, keeping the line endings.
+
+    The line endings are kept so that the csv module still sees the new
+    lines embedded in quoted values.
+    """
+    pending = u''
+    for chunk in chunks:
+        lines = (pending + chunk).split(u'\n')
+        # The last line may continue in the next chunk
+        pending = lines.pop()
+        for line in lines:
+            yield line + u'\n'
+    if pending:
+        yield pending
+
+
+def _read_lines(stream, datafile):
+    """Yield the lines of stream and close it once exhausted.
+
+    datafile is kept referenced until then, as it may be the temporary
+    file backing the stream.
+    """
+    try:
+        for line in iter(stream.readline, u''):
+            yield line
+    finally:
+        stream.close()
+        datafile.close()
@@ -17,6 +17,7 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import defaultdict
+from itertools import islice
 from flask import current_app
 from flask_babel import gettext
 from .csv import BulkTaskCSVImport, BulkTaskGDImport, BulkTaskLocalCSVImport
@@ -65,6 +66,16 @@ def validate_n_answers(task):
         return False
 
 
+def _batches(iterable, size):
+    """Split an iterable into lists of up to size items, lazily."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
 class TaskImportValidator(object):
 
     validations = {
@@ -187,17 +198,25 @@ class Importer(object):
 
         validator = TaskImportValidator()
         n_answers = project.get_default_n_answers()
-        for task_data in tasks:
-            self.upload_private_data(task_data, project.id)
-            task = Task(project_id=project.id, n_answers=n_answers)
-            [setattr(task, k, v) for k, v in task_data.iteritems()]
-            found = task_repo.find_duplicate(project_id=project.id,
-                                             info=task.info)
-            if found is None:
-                if validator.validate(task):
+        batch_size = current_app.config.get('TASK_IMPORT_BATCH_SIZE', 1000)
+        for batch in _batches(tasks, batch_size):
+            new_tasks = []
+            for task_data in batch:
+                self.upload_private_data(task_data, project.id)
+                task = Task(project_id=project.id, n_answers=n_answers)
+                [setattr(task, k, v) for k, v in task_data.iteritems()]
+                new_tasks.append(task)
+            new_tasks = [task for task in new_tasks
+                         if validator.validate(task)]
+            try:
+                # duplicates of ongoing tasks are skipped by the insert
+                n += len(task_repo.insert_tasks(project.id, new_tasks))
+            except Exception:
+                # Insert the batch one task at a time to single out
+                # the failing ones
+                for task in new_tasks:
                     try:
-                        task_repo.save(task)
-                        n += 1
+                        n += len(task_repo.insert_tasks(project.id, [task]))
                     except Exception as e:
                         current_app.logger.exception(msg)
                         validator.add_error(str(e))
@@ -0,0 +1,283 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Per request instrumentation of SQL statements and Redis commands.
+
+With INSTRUMENTATION_ENABLED, the statements run on every database bind
+and the commands sent to the Redis master and slave are counted and timed
+for each request. Statements of the same shape, that is with literals
+removed, run INSTRUMENTATION_N_PLUS_ONE times or more in a request are
+reported as N+1 patterns, and requests slower than
+INSTRUMENTATION_SLOW_REQUEST milliseconds are logged. Histograms for each
+endpoint are aggregated in each process, and returned by get_stats.
+"""
+import re
+import time
+import threading
+from collections import Counter, deque
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+# Upper bounds, in milliseconds, of the buckets of the histograms
+BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+MAX_SHAPES = 20
+MAX_SLOW_REQUESTS = 50
+
+_stats_lock = threading.Lock()
+_endpoints = {}
+_slow_requests = deque(maxlen=MAX_SLOW_REQUESTS)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_spaces = re.compile(r'\s+')
+
+
+def is_enabled():
+    return bool(current_app.config.get('INSTRUMENTATION_ENABLED'))
+
+
+def statement_shape(statement):
+    """Return a statement with its literals and IN lists collapsed, so that
+    statements that only differ by their values have the same shape."""
+    shape = _literals.sub('?', statement)
+    shape = _in_lists.sub('(?)', shape)
+    return _spaces.sub(' ', shape).strip()
+
+
+class RequestStats(object):
+
+    """Counts and timings of the SQL statements and Redis commands of a
+    request."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.sql_binds = Counter()
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.shapes = Counter()
+
+    def add_sql(self, bind, statement, duration):
+        self.sql_count += 1
+        self.sql_time += duration
+        self.sql_binds[bind] += 1
+        self.shapes[statement_shape(statement)] += 1
+
+    def add_redis(self, duration):
+        self.redis_count += 1
+        self.redis_time += duration
+
+    def repeated_shapes(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count >= threshold]
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return getattr(g, '_instrumentation', None)
+
+
+def _histogram():
+    return [0] * (len(BUCKETS) + 1)
+
+
+def _bucket(ms):
+    for index, bound in enumerate(BUCKETS):
+        if ms <= bound:
+            return index
+    return len(BUCKETS)
+
+
+def _record(endpoint, stats, duration, repeated):
+    with _stats_lock:
+        agg = _endpoints.get(endpoint)
+        if agg is None:
+            agg = _endpoints[endpoint] = dict(
+                requests=0, time=0.0, time_max=0.0, time_histogram=_histogram(),
+                sql_count=0, sql_count_max=0, sql_time=0.0,
+                sql_time_histogram=_histogram(),
+                redis_count=0, redis_count_max=0, redis_time=0.0,
+                n_plus_one=Counter())
+        agg['requests'] += 1
+        agg['time'] += duration
+        agg['time_max'] = max(agg['time_max'], duration)
+        agg['time_histogram'][_bucket(duration)] += 1
+        agg['sql_count'] += stats.sql_count
+        agg['sql_count_max'] = max(agg['sql_count_max'], stats.sql_count)
+        agg['sql_time'] += stats.sql_time * 1000
+        agg['sql_time_histogram'][_bucket(stats.sql_time * 1000)] += 1
+        agg['redis_count'] += stats.redis_count
+        agg['redis_count_max'] = max(agg['redis_count_max'],
+                                     stats.redis_count)
+        agg['redis_time'] += stats.redis_time * 1000
+        for shape, count in repeated:
+            if (shape in agg['n_plus_one'] or
+                    len(agg['n_plus_one']) < MAX_SHAPES):
+                agg['n_plus_one'][shape] += 1
+
+
+def get_stats():
+    """Return the aggregated stats of each endpoint in this process, and
+    its last slow requests. Times are in milliseconds."""
+    with _stats_lock:
+        endpoints = {}
+        for endpoint, agg in _endpoints.iteritems():
+            n = agg['requests']
+            endpoints[endpoint] = dict(
+                requests=n,
+                time_mean=round(agg['time'] / n, 3),
+                time_max=round(agg['time_max'], 3),
+                time_histogram=list(agg['time_histogram']),
+                sql_count_mean=round(float(agg['sql_count']) / n, 2),
+                sql_count_max=agg['sql_count_max'],
+                sql_time_mean=round(agg['sql_time'] / n, 3),
+                sql_time_histogram=list(agg['sql_time_histogram']),
+                redis_count_mean=round(float(agg['redis_count']) / n, 2),
+                redis_count_max=agg['redis_count_max'],
+                redis_time_mean=round(agg['redis_time'] / n, 3),
+                n_plus_one=dict(agg['n_plus_one']))
+        return dict(buckets=BUCKETS + [None], endpoints=endpoints,
+                    slow_requests=list(_slow_requests))
+
+
+def reset_stats():
+    with _stats_lock:
+        _endpoints.clear()
+        _slow_requests.clear()
+
+
+def _before_request():
+    if is_enabled():
+        g._instrumentation = RequestStats()
+
+
+def _after_request(response):
+    stats = _current()
+    if stats is None:
+        return response
+    g._instrumentation = None
+    duration = (time.time() - stats.start) * 1000
+    endpoint = request.endpoint or 'unknown'
+    threshold = current_app.config.get('INSTRUMENTATION_N_PLUS_ONE') or 10
+    repeated = stats.repeated_shapes(threshold)
+    for shape, count in repeated:
+        current_app.logger.warning('N+1 pattern in %s: %s statements %s',
+                                   endpoint, count, shape)
+    slow = current_app.config.get('INSTRUMENTATION_SLOW_REQUEST')
+    if slow is not None and duration >= slow:
+        current_app.logger.warning(
+            'Slow request %s %s: %.1f ms, %s SQL statements in %.1f ms, '
+            '%s Redis commands in %.1f ms', request.method, request.path,
+            duration, stats.sql_count, stats.sql_time * 1000,
+            stats.redis_count, stats.redis_time * 1000)
+        with _stats_lock:
+            _slow_requests.append(dict(
+                endpoint=endpoint, method=request.method, path=request.path,
+                time=round(duration, 3), sql_count=stats.sql_count,
+                sql_time=round(stats.sql_time * 1000, 3),
+                sql_binds=dict(stats.sql_binds),
+                redis_count=stats.redis_count,
+                redis_time=round(stats.redis_time * 1000, 3),
+                n_plus_one=dict(repeated)))
+    _record(endpoint, stats, duration, repeated)
+
+    if current_app.config.get('INSTRUMENTATION_SERVER_TIMING'):
+        response.headers.add('Server-Timing', ', '.join([
+            'sql;dur=%.1f;desc="%s statements"' % (stats.sql_time * 1000,
+                                                    stats.sql_count),
+            'redis;dur=%.1f;desc="%s commands"' % (stats.redis_time * 1000,
+                                                    stats.redis_count),
+            'app;dur=%.1f' % duration]))
+    return response
+
+
+def instrument_engine(bind, engine):
+    """Time the statements run on an engine within requests."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters,
+                               context, executemany):
+        if _current() is None:
+            return
+        conn.info.setdefault('instrumentation_start', []).append(time.time())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters,
+                              context, executemany):
+        starts = conn.info.get('instrumentation_start')
+        if not starts:
+            return
+        start = starts.pop()
+        stats = _current()
+        if stats is not None:
+            stats.add_sql(bind, statement, time.time() - start)
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(exception_context):
+        # after_cursor_execute is not called for statements that fail
+        conn = exception_context.connection
+        if conn is not None:
+            conn.info.pop('instrumentation_start', None)
+
+
+def instrument_redis(client):
+    """Time the commands and pipelines sent by a Redis client within
+    requests."""
+    if getattr(client, '_instrumented', False):
+        return
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def timed(fn):
+        def wrapper(*args, **kwargs):
+            stats = _current()
+            if stats is None:
+                return fn(*args, **kwargs)
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats.add_redis(time.time() - start)
+        return wrapper
+
+    def instrumented_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe.execute = timed(pipe.execute)
+        return pipe
+
+    client.execute_command = timed(execute_command)
+    client.pipeline = instrumented_pipeline
+    client._instrumented = True
+
+
+def init_app(app, db, sentinel):
+    """Hook into the engines of every bind and the Redis clients.
+
+    Nothing is recorded unless INSTRUMENTATION_ENABLED is set when the
+    request starts.
+    """
+    instrument_engine('master', db.get_engine(app))
+    for bind in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        instrument_engine(bind, db.get_engine(app, bind=bind))
+    instrument_redis(sentinel.master)
+    instrument_redis(sentinel.slave)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
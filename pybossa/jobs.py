@@ -181,9 +181,13 @@ def get_export_task_jobs(queue):
                         if p.owner.pro is False)
     else:
         projects = (p.dictize() for p in project_repo.filter_by(published=True))
+    if current_app.config.get('EXPORT_INCREMENTAL'):
+        export_fn = project_delta_export
+    else:
+        export_fn = project_export
     for project in projects:
         project_id = project.get('id')
-        job = dict(name=project_export,
+        job = dict(name=export_fn,
                    args=[project_id], kwargs={},
                    timeout=timeout,
                    queue=queue)
@@ -200,6 +204,14 @@ def project_export(_id):
         csv_exporter.pregenerate_zip_files(app)
 
 
+def project_delta_export(_id):
+    """Export what is new in a project since its last delta export."""
+    from pybossa.core import project_repo, delta_exporter
+    project = project_repo.get(_id)
+    if project is not None:
+        return delta_exporter.export(project)
+
+
 def get_project_jobs(queue):
     """Return a list of jobs based on user type."""
     from pybossa.core import project_repo
@@ -299,6 +311,9 @@ def get_dashboard_jobs(queue='low'):  # pragma: no cover
 
 def get_leaderboard_jobs(queue='super'):  # pragma: no cover
     """Return leaderboard jobs."""
+    if current_app.config.get('LEADERBOARD_INCREMENTAL'):
+        # Kept up to date as task runs are submitted
+        return
     timeout = current_app.config.get('TIMEOUT')
     leaderboards = current_app.config.get('LEADERBOARDS')
     if leaderboards:
@@ -576,8 +591,10 @@ def delete_bulk_tasks(data):
     """Delete tasks in bulk from project."""
     from sqlalchemy.sql import text
     from pybossa.core import db
+    from pybossa import partitioning
     import pybossa.cache.projects as cached_projects
-    from pybossa.cache.task_browse_helpers import get_task_filters
+    from pybossa.cache.task_browse_helpers import (get_task_filters,
+                                                   task_run_aggregates)
 
     project_id = data['project_id']
     project_name = data['project_name']
@@ -594,6 +611,18 @@ def delete_bulk_tasks(data):
     if not 'bulkdel' in current_app.config.get('SQLALCHEMY_BINDS'):
         sql_session_repl = 'SET session_replication_role TO replica;'
 
+    # with the tables partitioned by project, lock the partitions of the
+    # project rather than each of their rows, and truncate its task runs
+    # when all its tasks go
+    lock_tasks = '''SELECT task_id FROM task_run WHERE project_id=:project_id FOR UPDATE;
+                SELECT id FROM task WHERE project_id=:project_id FOR UPDATE;'''
+    delete_task_runs = '''DELETE FROM task_run WHERE project_id=:project_id
+                       AND task_id in (SELECT id FROM to_delete);'''
+    if partitioning.is_partitioned(db.bulkdel_session):
+        lock_tasks = partitioning.lock_partitions_sql(project_id)
+        if force_reset and not data.get('filters'):
+            delete_task_runs = partitioning.truncate_task_runs_sql(project_id)
+
     # lock tasks for given project with SELECT FOR UPDATE
     # create temp table with all tasks to be deleted
     # during transaction, disable constraints check with session_replication_role
@@ -603,8 +632,7 @@ def delete_bulk_tasks(data):
         sql = text('''
                 BEGIN;
                 SELECT task_id FROM counter WHERE project_id=:project_id FOR UPDATE;
-                SELECT task_id FROM task_run WHERE project_id=:project_id FOR UPDATE;
-                SELECT id FROM task WHERE project_id=:project_id FOR UPDATE;
+                {}
 
                 {}
 
@@ -618,13 +646,14 @@ def delete_bulk_tasks(data):
 
                 DELETE FROM counter WHERE project_id=:project_id
                         AND task_id IN (SELECT id FROM to_delete);
-                DELETE FROM task_run WHERE project_id=:project_id
+                DELETE FROM task_aggregate WHERE project_id=:project_id
                         AND task_id IN (SELECT id FROM to_delete);
+                {}
                 DELETE FROM task WHERE project_id=:project_id
                         AND id IN (SELECT id FROM to_delete);
 
                 COMMIT;
-                '''.format(sql_session_repl))
+                '''.format(lock_tasks, sql_session_repl, delete_task_runs))
         msg = ("Tasks and taskruns with no associated results have been "
                "deleted from project {0} by {1}"
                .format(project_name, current_user_fullname))
@@ -635,8 +664,7 @@ def delete_bulk_tasks(data):
                 BEGIN;
                 SELECT task_id FROM counter WHERE project_id=:project_id FOR UPDATE;
                 SELECT task_id FROM result WHERE project_id=:project_id FOR UPDATE;
-                SELECT task_id FROM task_run WHERE project_id=:project_id FOR UPDATE;
-                SELECT id FROM task WHERE project_id=:project_id FOR UPDATE;
+                {}
 
                 {}
 
@@ -644,25 +672,24 @@ def delete_bulk_tasks(data):
                     SELECT task.id as id,
                     coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                     priority_0, task.created
-                    FROM task LEFT OUTER JOIN
-                    (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                    MAX(finish_time) as ft FROM task_run
-                    WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                    FROM task LEFT OUTER JOIN {}
                     ON task.id=log_counts.task_id
                     WHERE task.project_id=:project_id {}
                 );
 
                 DELETE FROM counter WHERE project_id=:project_id
                         AND task_id IN (SELECT id FROM to_delete);
+                DELETE FROM task_aggregate WHERE project_id=:project_id
+                        AND task_id IN (SELECT id FROM to_delete);
                 DELETE FROM result WHERE project_id=:project_id
                        AND task_id in (SELECT id FROM to_delete);
-                DELETE FROM task_run WHERE project_id=:project_id
-                       AND task_id in (SELECT id FROM to_delete);
+                {}
                 DELETE FROM task WHERE task.project_id=:project_id
                        AND id in (SELECT id FROM to_delete);
 
                 COMMIT;
-                '''.format(sql_session_repl, conditions))
+                '''.format(lock_tasks, sql_session_repl, task_run_aggregates,
+                           conditions, delete_task_runs))
         msg = ("Tasks, taskruns and results associated have been "
                "deleted from project {0} as requested by {1}"
                .format(project_name, current_user_fullname))
@@ -781,24 +808,35 @@ def import_tasks(project_id, current_user_fullname, from_auto=False, **form_data
     return msg
 
 
+def process_task_run_submissions():
+    """Process the deferred side effects of task run submissions."""
+    from pybossa.submission_pipeline import process_pending
+    return process_pending()
+
+
 def export_tasks(current_user_email_addr, short_name,
                  ty, expanded, filetype, filters=None):
     """Export tasks/taskruns from a project."""
     from pybossa.core import (task_csv_exporter, task_json_exporter,
-                              project_repo)
+                              task_parquet_exporter, project_repo)
+    from pybossa.exporter.parquet_export import parquet_available
     import pybossa.exporter.consensus_exporter as export_consensus
 
     project = project_repo.get_by_shortname(short_name)
 
     try:
         # Export data and upload .zip file locally
-        if ty == 'consensus':
+        if filetype == 'parquet' and not parquet_available():
+            export_fn = None
+        elif ty == 'consensus':
             export_fn = getattr(export_consensus,
                                 'export_consensus_{}'.format(filetype))
         elif filetype == 'json':
             export_fn = task_json_exporter.make_zip
         elif filetype == 'csv':
             export_fn = task_csv_exporter.make_zip
+        elif filetype == 'parquet':
+            export_fn = task_parquet_exporter.make_zip
         else:
             export_fn = None
 
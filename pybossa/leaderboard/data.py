@@ -16,15 +16,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Leaderboard queries in leaderboard view."""
+from collections import namedtuple
 from sqlalchemy import text
 from pybossa.core import db
 from pybossa.model.user import User
+from pybossa.leaderboard import scores
 
 u = User()
 
 
 def get_leaderboard(top_users=20, user_id=None, window=0, info=None):
     """Return a list of top_users and if user_id return its position."""
+    if scores.is_enabled():
+        return get_incremental_leaderboard(top_users, user_id, window, info)
     materialized_view = "users_rank_%s" % info
     sql = text('''SELECT * from users_rank WHERE rank <= :top_users 
                ORDER BY rank;''')
@@ -66,6 +70,30 @@ def get_leaderboard(top_users=20, user_id=None, window=0, info=None):
     return top_users
 
 
+RankedUser = namedtuple('RankedUser', ['rank', 'id', 'name', 'fullname',
+                                       'email_addr', 'info', 'created',
+                                       'restrict', 'score'])
+
+
+def get_incremental_leaderboard(top_users=20, user_id=None, window=0,
+                                info=None):
+    """Return the same as get_leaderboard, from the incremental scores."""
+    ranks = scores.get_ranks(top_users, user_id, window, info)
+    if not ranks:
+        return []
+    sql = text('''SELECT id, name, fullname, email_addr, info, created,
+               restrict FROM "user" WHERE id = ANY(:ids);''')
+    results = db.slave_session.execute(
+        sql, dict(ids=list(set(_id for _id, _, _ in ranks))))
+    users = {row.id: row for row in results}
+    return [format_user(RankedUser(rank, _id, users[_id].name,
+                                   users[_id].fullname,
+                                   users[_id].email_addr, users[_id].info,
+                                   users[_id].created, users[_id].restrict,
+                                   score))
+            for _id, rank, score in ranks if _id in users]
+
+
 def format_user(user):
     """Return an User object."""
     user = dict(
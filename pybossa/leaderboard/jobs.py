@@ -19,10 +19,17 @@
 from sqlalchemy import text
 from pybossa.core import db
 from pybossa.util import exists_materialized_view, refresh_materialized_view
+from pybossa.leaderboard import scores
 
 
 def leaderboard(info=None):
-    """Create or update leaderboard materialized view."""
+    """Create or update leaderboard materialized view.
+
+    Incremental leaderboards are rebuilt from the database instead.
+    """
+    if scores.is_enabled():
+        n_users = scores.rebuild(info)
+        return "Leaderboard rebuilt with %s users" % n_users
     materialized_view = 'users_rank'
     materialized_view_idx = 'users_rank_idx'
     if info:
@@ -0,0 +1,188 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Incremental leaderboards.
+
+With LEADERBOARD_INCREMENTAL enabled, the scores of unrestricted users are
+kept in one Redis sorted set per leaderboard, instead of the users_rank
+materialized views. The task run and user listeners update the scores as
+they change, so that ranks are read in O(log n) and nothing needs to be
+refreshed. rebuild recomputes a leaderboard from the database, to create
+or repair it.
+"""
+from flask import current_app
+from sqlalchemy import inspect, text
+from pybossa.core import db, sentinel
+
+
+SCORES_KEY = 'pybossa:leaderboard:scores'
+SCORES_INFO_KEY = 'pybossa:leaderboard:scores:{0}'
+REBUILD_CHUNK_SIZE = 1000
+# Seconds a leaderboard found empty by rebuild is not rebuilt again for
+EMPTY_TTL = 300
+
+# Restricted users are not on the leaderboards, and must stay out of them
+# when they contribute
+INCREMENT_SCRIPT = '''
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return redis.call('ZINCRBY', KEYS[1], ARGV[2], ARGV[1])
+end
+'''
+
+
+def is_enabled():
+    return bool(current_app.config.get('LEADERBOARD_INCREMENTAL'))
+
+
+def get_key(info=None):
+    return SCORES_INFO_KEY.format(info) if info else SCORES_KEY
+
+
+def get_empty_key(info=None):
+    return '{0}:empty'.format(get_key(info))
+
+
+def _get_infos():
+    return current_app.config.get('LEADERBOARDS') or []
+
+
+def _info_score(user_info, info):
+    try:
+        return int((user_info or {}).get(info) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def increment(user_id, amount=1, conn=None):
+    """Add amount to the task run score of a user."""
+    conn = conn or sentinel.master
+    conn.eval(INCREMENT_SCRIPT, 1, get_key(), user_id, amount)
+
+
+def update_user(db_conn, user, created=False, conn=None):
+    """Add, update or remove a user from the leaderboards, after the user
+    has been created or updated."""
+    conn = conn or sentinel.master
+    state = inspect(user)
+
+    def changed(attr):
+        return created or state.attrs[attr].history.has_changes()
+
+    pipe = conn.pipeline()
+    if user.restrict:
+        if changed('restrict'):
+            for info in [None] + list(_get_infos()):
+                pipe.zrem(get_key(info), user.id)
+    else:
+        if changed('restrict'):
+            score = 0
+            if not created:
+                sql = text('SELECT COUNT(id) FROM task_run '
+                           'WHERE user_id=:user_id')
+                score = db_conn.scalar(sql, dict(user_id=user.id))
+            pipe.zadd(get_key(), {user.id: score})
+        if changed('restrict') or changed('info'):
+            for info in _get_infos():
+                pipe.zadd(get_key(info), {user.id: _info_score(user.info, info)})
+    pipe.execute()
+
+
+def rebuild(info=None, conn=None):
+    """Recompute a leaderboard from the database.
+
+    The new scores replace the old ones at once, but task runs submitted
+    while they are computed may be missed. As an empty sorted set cannot
+    be stored, an empty leaderboard is marked as such for EMPTY_TTL
+    seconds instead.
+    """
+    conn = conn or sentinel.master
+    key = get_key(info)
+    tmp_key = '{0}:rebuild'.format(key)
+    if info:
+        sql = text('''
+                   SELECT id, info FROM "user" WHERE restrict=false
+                   ''')
+    else:
+        sql = text('''
+                   SELECT "user".id, COUNT(task_run.id) AS score
+                   FROM "user" LEFT JOIN task_run
+                   ON task_run.user_id="user".id
+                   WHERE "user".restrict=false GROUP BY "user".id
+                   ''')
+    results = db.session.execute(sql)
+    conn.delete(tmp_key)
+    n_users = 0
+    while True:
+        rows = results.fetchmany(REBUILD_CHUNK_SIZE)
+        if not rows:
+            break
+        if info:
+            scores = {row.id: _info_score(row.info, info) for row in rows}
+        else:
+            scores = {row.id: row.score for row in rows}
+        conn.zadd(tmp_key, scores)
+        n_users += len(rows)
+    if n_users:
+        conn.rename(tmp_key, key)
+        conn.delete(get_empty_key(info))
+    else:
+        conn.delete(key)
+        conn.set(get_empty_key(info), 1, ex=EMPTY_TTL)
+    return n_users
+
+
+def get_ranks(top_users=20, user_id=None, window=0, info=None, conn=None):
+    """Return the (user id, rank, score) of the top_users, followed by the
+    user with user_id, or by the users up to window positions around them.
+    Users with the same score have the same rank, one more than the number
+    of users with a higher score.
+    """
+    conn = conn or sentinel.slave
+    key = get_key(info)
+    if not conn.exists(key) and not conn.exists(get_empty_key(info)):
+        rebuild(info)
+
+    def rank_of(score):
+        return 1 + conn.zcount(key, '({0}'.format(score), '+inf')
+
+    def ranked(rows, start):
+        ranks = []
+        for ix, (member, score) in enumerate(rows):
+            if ranks and int(score) == ranks[-1][2]:
+                rank = ranks[-1][1]
+            elif ix == 0 and start > 0:
+                rank = rank_of(score)
+            else:
+                rank = start + ix + 1
+            ranks.append((int(member), rank, int(score)))
+        return ranks
+
+    ranks = ranked(conn.zrevrange(key, 0, top_users - 1, withscores=True),
+                   0)
+    if user_id:
+        if window != 0:
+            position = conn.zrevrank(key, user_id)
+            if position is not None:
+                start = max(position - window, 0)
+                rows = conn.zrevrange(key, start, position + window,
+                                      withscores=True)
+                ranks += ranked(rows, start)
+        else:
+            score = conn.zscore(key, user_id)
+            if score is not None:
+                ranks.append((user_id, rank_of(score), int(score)))
+    return ranks
@@ -29,9 +29,13 @@ log = logging.getLogger(__name__)
 
 class DomainObject(object):
 
-    def dictize(self):
+    def dictize(self, keys=None):
         out = {}
         for col in self.__table__.c:
+            if keys is not None and col.name not in keys:
+                continue
+            if not col.info.get('dictize', True):
+                continue
             obj = getattr(self, col.name)
             if isinstance(obj, datetime.datetime):
                 obj = obj.isoformat()
@@ -99,6 +103,42 @@ def make_uuid():
     return str(uuid.uuid4())
 
 
+TEXT_TO_TIMESTAMP_SQL = '''
+    CREATE OR REPLACE FUNCTION text_to_timestamp(value TEXT)
+    RETURNS TIMESTAMP AS $$
+    BEGIN
+        RETURN value::TIMESTAMP;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql STABLE;'''
+
+
+def sync_timestamps_ddl(table, columns):
+    """Return the SQL statements creating the trigger that keeps the
+    timestamp columns of a table in sync with the text columns they mirror.
+
+    columns is a list of (text column, timestamp column) pairs. Values that
+    are not valid timestamps are stored as NULL.
+    """
+    assignments = ''.join(
+        '        NEW.%s := text_to_timestamp(NEW.%s);\n' % (ts_column, column)
+        for column, ts_column in columns)
+    function = '''
+    CREATE OR REPLACE FUNCTION %(table)s_sync_timestamps()
+    RETURNS TRIGGER AS $$
+    BEGIN
+%(assignments)s        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;''' % dict(table=table, assignments=assignments)
+    trigger = '''
+    CREATE TRIGGER %(table)s_sync_timestamps
+    BEFORE INSERT OR UPDATE OF %(columns)s ON %(table)s
+    FOR EACH ROW EXECUTE PROCEDURE %(table)s_sync_timestamps();''' % dict(
+        table=table, columns=', '.join(column for column, _ in columns))
+    return [TEXT_TO_TIMESTAMP_SQL, function, trigger]
+
+
 def update_project_timestamp(mapper, conn, target):
     """Update method to be used by the relationship objects."""
     sql_query = ("update project set updated='%s' where id=%s" %
@@ -19,7 +19,9 @@ from datetime import datetime
 from flask import current_app
 
 from rq import Queue
-from sqlalchemy import event
+from sqlalchemy import event, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import text
 
 from flask import url_for
 
@@ -34,11 +36,14 @@ from pybossa.model.webhook import Webhook
 from pybossa.model.user import User
 from pybossa.model.result import Result
 from pybossa.model.counter import Counter
+from pybossa.model.task_aggregate import TaskAggregate
 from pybossa.core import result_repo, db, task_repo
 from pybossa.jobs import webhook, notify_blog_users
 from pybossa.jobs import push_notification
 from pybossa.cache import projects as cached_projects
+from pybossa.leaderboard import scores as leaderboard_scores
 from pybossa import sched
+from pybossa import partitioning
 
 from pybossa.core import sentinel
 from pybossa.sched import Schedulers
@@ -108,29 +113,46 @@ def add_project_event(mapper, conn, target):
                    n_blogposts, last_activity, info)
                    VALUES (%s, 0, 0, 0, 0, 0, 0, 0, 0, 0, '{}');""" % (target.id)
     conn.execute(sql_query)
+    if partitioning.is_partitioned(conn):
+        partitioning.create_partitions(conn, target.id)
+
+
+@event.listens_for(Project, 'after_delete')
+def delete_project_event(mapper, conn, target):
+    """Drop the task partitions of the project, empty by now."""
+    if partitioning.is_partitioned(conn):
+        partitioning.drop_partitions(conn, target.id)
 
 
 @event.listens_for(Task, 'before_insert')
 def before_add_task_event(mapper, conn, target):
+    flag_updated_project(target.project_id)
+
+
+def flag_updated_project(project_id):
     redis_conn = sentinel.master
-    if cached_projects.get_project_scheduler(target.project_id) == Schedulers.user_pref:
-        if not redis_conn.hget('updated_project_ids', target.project_id):
-            redis_conn.hset('updated_project_ids', target.project_id, make_timestamp())
+    if cached_projects.get_project_scheduler(project_id) == Schedulers.user_pref:
+        if not redis_conn.hget('updated_project_ids', project_id):
+            redis_conn.hset('updated_project_ids', project_id, make_timestamp())
     else:
-        if cached_projects.overall_progress(target.project_id) == 100:
-            redis_conn.hset('updated_project_ids', target.project_id, make_timestamp())
+        if cached_projects.overall_progress(project_id) == 100:
+            redis_conn.hset('updated_project_ids', project_id, make_timestamp())
 
 
 @event.listens_for(Task, 'after_insert')
 def add_task_event(mapper, conn, target):
     """Update PYBOSSA feed with new task."""
+    add_task_feed(conn, target.project_id)
+
+
+def add_task_feed(conn, project_id):
     sql_query = ('select name, short_name, info from project \
-                 where id=%s') % target.project_id
+                 where id=%s') % project_id
     results = conn.execute(sql_query)
     obj = dict(action_updated='Task')
     tmp = dict()
     for r in results:
-        tmp['id'] = target.project_id
+        tmp['id'] = project_id
         tmp['name'] = r.name
         tmp['short_name'] = r.short_name
         tmp['info'] = r.info
@@ -139,6 +161,47 @@ def add_task_event(mapper, conn, target):
     update_feed(obj)
 
 
+def before_bulk_task_insert(project_id):
+    """Counterpart of the Task before_insert listeners for a batch of tasks
+    of a project inserted without the ORM."""
+    flag_updated_project(project_id)
+
+
+def after_bulk_task_insert(conn, project_id, tasks):
+    """Counterpart of the Task after_insert listeners for a batch of tasks
+    of a project inserted without the ORM. Counters are inserted with the
+    tasks."""
+    add_task_feed(conn, project_id)
+    update_project_timestamp(None, conn, tasks[0])
+    if cached_projects.get_project_scheduler(project_id) == Schedulers.queued:
+        sched.push_tasks_to_task_queue(
+            project_id,
+            [(task.id, task.priority_0, task.calibration) for task in tasks])
+
+
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+def update_task_queue(mapper, conn, target):
+    """Keep the task queue of the project up to date."""
+    if cached_projects.get_project_scheduler(target.project_id) == Schedulers.queued:
+        sched.push_to_task_queue(target)
+
+
+@event.listens_for(Task, 'after_delete')
+def remove_from_task_queue(mapper, conn, target):
+    """Remove a deleted task from the task queue of the project."""
+    if cached_projects.get_project_scheduler(target.project_id) == Schedulers.queued:
+        sched.remove_from_task_queue(target.project_id, [target.id])
+
+
+@event.listens_for(Project, 'after_update')
+def reset_task_queue(mapper, conn, target):
+    """Drop the task queue of projects not using the task queue scheduler,
+    as it is not kept up to date for them."""
+    if (target.info or {}).get('sched') != Schedulers.queued:
+        sched.reset_task_queue(target.id)
+
+
 @event.listens_for(User, 'after_insert')
 def add_user_event(mapper, conn, target):
     """Update PYBOSSA feed with new user."""
@@ -239,14 +302,14 @@ def create_result(conn, project_id, task_id):
         return r.id
 
 
-@event.listens_for(TaskRun, 'after_insert')
-def on_taskrun_submit(mapper, conn, target):
-    """Update the task.state when n_answers condition is met."""
-    # Get project details
+def get_project_event_info(conn, project_id):
+    """Return the public info of a project used in the feed events, if it
+    is published and its webhook."""
     sql_query = ('select name, short_name, published, webhook, info, category_id \
-                 from project where id=%s') % target.project_id
+                 from project where id=%s') % project_id
     results = conn.execute(sql_query)
     tmp = dict()
+    _published = _webhook = None
     for r in results:
         tmp['name'] = r.name
         tmp['short_name'] = r.short_name
@@ -254,13 +317,80 @@ def on_taskrun_submit(mapper, conn, target):
         tmp['info'] = r.info
         _webhook = r.webhook
         tmp['category_id'] = r.category_id
-        tmp['id'] = target.project_id
+        tmp['id'] = project_id
 
     project_public = dict()
     project_public.update(Project().to_public_json(tmp))
     project_public['action_updated'] = 'TaskCompleted'
+    return project_public, _published, _webhook
+
 
+def complete_task(conn, project_public, published, webhook, project_id,
+                  task_id):
+    """Mark a task as completed and, if its project is published, create
+    its result and notify it."""
+    update_task_state(conn, task_id)
+    if cached_projects.get_project_scheduler(project_id) == Schedulers.queued:
+        sched.remove_from_task_queue(project_id, [task_id])
+    if not published:
+        return
+    update_feed(project_public)
+    result_id = create_result(conn, project_id, task_id)
+    project_private = dict()
+    project_private.update(project_public)
+    project_private['webhook'] = webhook
+    push_webhook(project_private, task_id, result_id)
+
+
+def after_bulk_task_run_insert(conn, task_runs):
+    """Counterpart of the TaskRun after_insert listeners for a batch of task
+    runs of a user inserted without the ORM. Locks are released and the
+    submission side effects processed by the caller, once committed."""
+    created = make_timestamp()
+    counters = [dict(created=created, project_id=task_run.project_id,
+                     task_id=task_run.task_id, n_task_runs=1)
+                for task_run in task_runs]
+    conn.execute(Counter.__table__.insert().values(counters))
+
+    aggregates = {}
+    for task_run in task_runs:
+        aggregate = aggregates.setdefault(
+            task_run.task_id, dict(task_id=task_run.task_id,
+                                   project_id=task_run.project_id,
+                                   n_task_runs=0, last_finish_time=None))
+        aggregate['n_task_runs'] += 1
+        aggregate['last_finish_time'] = max(aggregate['last_finish_time'],
+                                            task_run.finish_time)
+    table = TaskAggregate.__table__
+    stmt = insert(table).values(aggregates.values())
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.task_id],
+        set_=dict(n_task_runs=table.c.n_task_runs + stmt.excluded.n_task_runs,
+                  last_finish_time=func.greatest(
+                      table.c.last_finish_time,
+                      stmt.excluded.last_finish_time))))
+
+    projects = dict((task_run.project_id, task_run) for task_run in task_runs)
+    for task_run in projects.values():
+        update_project_timestamp(None, conn, task_run)
+
+    user_id = task_runs[0].user_id
+    if user_id and leaderboard_scores.is_enabled():
+        leaderboard_scores.increment(user_id, len(task_runs))
+
+
+@event.listens_for(TaskRun, 'after_insert')
+def on_taskrun_submit(mapper, conn, target):
+    """Update the task.state when n_answers condition is met."""
     sched.after_save(target, conn)
+    if current_app.config.get('TASK_RUN_DEFERRED_SIDE_EFFECTS'):
+        # Done in the background by pybossa.submission_pipeline
+        return
+
+    # Get project details
+    project_public, _published, _webhook = get_project_event_info(
+        conn, target.project_id)
+
     add_user_contributed_to_feed(conn, target.user_id, project_public)
 
     # golden tasks never complete; bypass update to task.state
@@ -273,14 +403,9 @@ def on_taskrun_submit(mapper, conn, target):
             conn.execute(sql_query)
         return
 
-    if is_task_completed(conn, target.task_id, target.project_id) and _published:
-        update_task_state(conn, target.task_id)
-        update_feed(project_public)
-        result_id = create_result(conn, target.project_id, target.task_id)
-        project_private = dict()
-        project_private.update(project_public)
-        project_private['webhook'] = _webhook
-        push_webhook(project_private, target.task_id, result_id)
+    if is_task_completed(conn, target.task_id, target.project_id):
+        complete_task(conn, project_public, _published, _webhook,
+                      target.project_id, target.task_id)
 
 
 @event.listens_for(Blogpost, 'after_insert')
@@ -342,6 +467,58 @@ def decrease_task_counter(mapper, conn, target):
                  % (make_timestamp(), target.project_id, target.task_id))
     conn.execute(sql_query)
 
+@event.listens_for(TaskRun, 'after_insert')
+def increase_task_aggregate(mapper, conn, target):
+    sql_query = text('''
+        INSERT INTO task_aggregate
+            (task_id, project_id, n_task_runs, last_finish_time)
+        VALUES (:task_id, :project_id, 1, :finish_time)
+        ON CONFLICT (task_id) DO UPDATE
+        SET n_task_runs = task_aggregate.n_task_runs + 1,
+            last_finish_time = GREATEST(task_aggregate.last_finish_time,
+                                        EXCLUDED.last_finish_time)
+        ''')
+    conn.execute(sql_query, dict(task_id=target.task_id,
+                                 project_id=target.project_id,
+                                 finish_time=target.finish_time))
+
+
+@event.listens_for(TaskRun, 'after_delete')
+def decrease_task_aggregate(mapper, conn, target):
+    sql_query = text('''
+        UPDATE task_aggregate
+        SET n_task_runs = GREATEST(n_task_runs - 1, 0),
+            last_finish_time = (SELECT MAX(finish_time) FROM task_run
+                                WHERE task_id = :task_id)
+        WHERE task_id = :task_id
+        ''')
+    conn.execute(sql_query, dict(task_id=target.task_id))
+
+
+@event.listens_for(TaskRun, 'after_insert')
+def increase_leaderboard_score(mapper, conn, target):
+    if target.user_id and leaderboard_scores.is_enabled():
+        leaderboard_scores.increment(target.user_id)
+
+
+@event.listens_for(TaskRun, 'after_delete')
+def decrease_leaderboard_score(mapper, conn, target):
+    if target.user_id and leaderboard_scores.is_enabled():
+        leaderboard_scores.increment(target.user_id, -1)
+
+
+@event.listens_for(User, 'after_insert')
+def add_leaderboard_user(mapper, conn, target):
+    if leaderboard_scores.is_enabled():
+        leaderboard_scores.update_user(conn, target, created=True)
+
+
+@event.listens_for(User, 'after_update')
+def update_leaderboard_user(mapper, conn, target):
+    if leaderboard_scores.is_enabled():
+        leaderboard_scores.update_user(conn, target)
+
+
 def set_task_export(task_id):
     sql_query = ("UPDATE task SET exported = False \
                  where id = :task_id")
@@ -17,13 +17,13 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text, DateTime
-import sqlalchemy
-from sqlalchemy.schema import Column, ForeignKey, Index
+from sqlalchemy import DDL, event, text
+from sqlalchemy.schema import Column, ForeignKey, Index, FetchedValue
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.ext.mutable import MutableList
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import DomainObject, make_timestamp, sync_timestamps_ddl
 from pybossa.model.task_run import TaskRun
 
 
@@ -38,6 +38,10 @@ class Task(db.Model, DomainObject):
     id = Column(Integer, primary_key=True)
     #: UTC timestamp when the task was created.
     created = Column(Text, default=make_timestamp)
+    #: created as a timestamp, filled in by a trigger.
+    created_ts = Column(DateTime, server_default=FetchedValue(),
+                        server_onupdate=FetchedValue(),
+                        info=dict(dictize=False))
     #: Project.ID that this task is associated with.
     project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
     #: Task.state: ongoing or completed.
@@ -49,6 +53,10 @@ class Task(db.Model, DomainObject):
     priority_0 = Column(Float, default=0)
     #: Task.info field in JSONB with the data for the task.
     info = Column(JSONB)
+    #: md5 of Task.info, filled in by a trigger, to find duplicate tasks.
+    info_hash = Column(Text, server_default=FetchedValue(),
+                       server_onupdate=FetchedValue(),
+                       info=dict(dictize=False))
     #: Number of answers to collect for this task.
     n_answers = Column(Integer, default=1)
     #: Array of User IDs that favorited this task
@@ -71,8 +79,60 @@ class Task(db.Model, DomainObject):
         else:  # pragma: no cover
             return float(0)
 
-    __table_args__ = (
-        Index('task_info_idx', sqlalchemy.text('md5(info::text)')),
-    )
-
 Index('task_project_id_idx', Task.project_id)
+Index('task_created_ts_brin_idx', Task.created_ts, postgresql_using='brin')
+Index('task_project_id_info_hash_idx', Task.project_id, Task.info_hash,
+      unique=True, postgresql_where=Task.state == u'ongoing')
+Index('task_project_id_info_md5_idx', Task.project_id,
+      text('md5(info::text)'),
+      postgresql_where=(Task.state == u'ongoing') & Task.info_hash.is_(None))
+
+# Every task gets the md5 of its info in info_hash, and the ongoing ones are
+# unique per project. Inserts that set info_hash are deduplicated: the
+# duplicate of an ongoing task violates the unique index. Other inserts, and
+# updates, are not: a task that would be a duplicate is saved without a
+# hash instead. When the ongoing task holding a hash is completed, edited or
+# deleted, the hash goes to its oldest remaining duplicate, so that ongoing
+# tasks are always deduplicated against.
+TASK_INFO_HASH_DDL = ['''
+    CREATE OR REPLACE FUNCTION task_info_hash()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        deduplicate BOOLEAN := TG_OP = 'INSERT' AND NEW.info_hash IS NOT NULL;
+    BEGIN
+        NEW.info_hash := md5(NEW.info::text);
+        IF NOT deduplicate AND NEW.state = 'ongoing' AND EXISTS (
+                SELECT 1 FROM task WHERE project_id = NEW.project_id
+                AND state = 'ongoing' AND info_hash = NEW.info_hash
+                AND id <> NEW.id) THEN
+            NEW.info_hash := NULL;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;''', '''
+    CREATE TRIGGER task_info_hash
+    BEFORE INSERT OR UPDATE OF info, state ON task
+    FOR EACH ROW EXECUTE PROCEDURE task_info_hash();''', '''
+    CREATE OR REPLACE FUNCTION task_info_hash_release()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF OLD.state = 'ongoing' AND OLD.info_hash IS NOT NULL AND (
+                TG_OP = 'DELETE' OR NEW.state <> 'ongoing'
+                OR NEW.info_hash IS DISTINCT FROM OLD.info_hash) THEN
+            UPDATE task SET info_hash = OLD.info_hash
+            WHERE id = (SELECT id FROM task
+                        WHERE project_id = OLD.project_id
+                        AND state = 'ongoing' AND info_hash IS NULL
+                        AND md5(info::text) = OLD.info_hash
+                        ORDER BY id LIMIT 1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;''', '''
+    CREATE TRIGGER task_info_hash_release
+    AFTER UPDATE OF info, state OR DELETE ON task
+    FOR EACH ROW EXECUTE PROCEDURE task_info_hash_release();''']
+
+for statement in (sync_timestamps_ddl('task', [('created', 'created_ts')]) +
+                  TASK_INFO_HASH_DDL):
+    event.listen(Task.__table__, 'after_create', DDL(statement))
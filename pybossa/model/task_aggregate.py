@@ -0,0 +1,45 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Integer, Text
+from sqlalchemy.schema import Column, ForeignKey, Index
+from pybossa.core import db
+from pybossa.model import DomainObject
+
+
+class TaskAggregate(db.Model, DomainObject):
+    '''A TaskAggregate keeps the number of task runs of a Task and the
+    finish time of its last one, updated on every task run insert and
+    delete.'''
+
+    __tablename__ = 'task_aggregate'
+
+    #: Task.ID that this aggregate is associated with.
+    task_id = Column(Integer, ForeignKey('task.id', ondelete='CASCADE'),
+                     primary_key=True)
+    #: Project.ID that this aggregate is associated with.
+    project_id = Column(Integer, ForeignKey('project.id',
+                                            ondelete='CASCADE'),
+                        nullable=False)
+    #: Number of task_runs for this task.
+    n_task_runs = Column(Integer, default=0, nullable=False)
+    #: UTC timestamp of the last finished task_run for this task.
+    last_finish_time = Column(Text)
+
+
+Index('task_aggregate_project_id_idx', TaskAggregate.project_id)
@@ -16,12 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer, Text, Index
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy import Integer, Text, DateTime, Index, DDL, event
+from sqlalchemy.schema import Column, ForeignKey, FetchedValue
 from sqlalchemy.dialects.postgresql import JSONB
 
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import DomainObject, make_timestamp, sync_timestamps_ddl
 
 
 
@@ -51,6 +51,13 @@ class TaskRun(db.Model, DomainObject):
     external_uid = Column(Text)
     #: Media URL to an Image, Audio, PDF, or Video
     media_url = Column(Text)
+    #: created and finish_time as timestamps, filled in by a trigger.
+    created_ts = Column(DateTime, server_default=FetchedValue(),
+                        server_onupdate=FetchedValue(),
+                        info=dict(dictize=False))
+    finish_time_ts = Column(DateTime, server_default=FetchedValue(),
+                            server_onupdate=FetchedValue(),
+                            info=dict(dictize=False))
     #: Value of the answer.
     info = Column(JSONB)
     '''General writable field that should be used by clients to record results\
@@ -65,3 +72,12 @@ Index('task_run_task_id_idx', TaskRun.task_id)
 Index('task_run_user_id_idx', TaskRun.user_id)
 Index('task_run_project_id_idx', TaskRun.project_id)
 Index('unique_user_id_task_id_idx', TaskRun.task_id, TaskRun.user_id, TaskRun.user_ip, TaskRun.external_uid, unique=True)
+Index('task_run_project_id_finish_time_ts_idx', TaskRun.project_id,
+      TaskRun.finish_time_ts)
+Index('task_run_finish_time_ts_brin_idx', TaskRun.finish_time_ts,
+      postgresql_using='brin')
+
+for statement in sync_timestamps_ddl('task_run',
+                                     [('created', 'created_ts'),
+                                      ('finish_time', 'finish_time_ts')]):
+    event.listen(TaskRun.__table__, 'after_create', DDL(statement))
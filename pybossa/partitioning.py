@@ -0,0 +1,204 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2019 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Optional partitioning of the task and task_run tables by project.
+
+In the partitioned layout, task and task_run are LIST partitioned on
+project_id and every project has its own partition of each, named
+task_p<project id> and task_run_p<project id>. Queries filtered by
+project_id only scan the partitions of that project, and all the task
+runs of a project can be removed by truncating its partition.
+
+The layout is opt-in: partition_tables converts the tables, from the
+alembic migration run with -x partition-by-project=true or from the
+partition_tables command of cli.py, and unpartition_tables converts them
+back. Both rewrite the tables and their indexes, so they are meant for a
+maintenance window, and they drop the views depending on the tables. The
+layout needs PostgreSQL 13 or later, for the foreign keys referencing
+task and the timestamp triggers.
+
+Once converted, the partitions of a project are created with it and
+dropped when it is deleted, see pybossa.model.event_listeners.
+"""
+from sqlalchemy.sql import text
+
+from pybossa.model import sync_timestamps_ddl
+from pybossa.model.task import TASK_INFO_HASH_DDL
+
+
+TABLES = [
+    dict(name='task',
+         foreign_keys=['(project_id) REFERENCES project (id) '
+                       'ON DELETE CASCADE'],
+         unique_indexes=[('task_project_id_info_hash_idx',
+                          "(project_id, info_hash) WHERE state = 'ongoing'")],
+         indexes=[('task_project_id_idx', '(project_id)'),
+                  ('task_created_ts_brin_idx', 'USING brin (created_ts)'),
+                  ('task_project_id_info_md5_idx',
+                   "(project_id, md5(info::text)) "
+                   "WHERE state = 'ongoing' AND info_hash IS NULL")],
+         triggers=(sync_timestamps_ddl('task', [('created', 'created_ts')]) +
+                   TASK_INFO_HASH_DDL)),
+    dict(name='task_run',
+         foreign_keys=['(project_id) REFERENCES project (id)',
+                       '(user_id) REFERENCES "user" (id)'],
+         unique_indexes=[('unique_user_id_task_id_idx',
+                          '(task_id, user_id, user_ip, external_uid)')],
+         indexes=[('task_run_task_id_idx', '(task_id)'),
+                  ('task_run_user_id_idx', '(user_id)'),
+                  ('task_run_project_id_idx', '(project_id)'),
+                  ('task_run_project_id_finish_time_ts_idx',
+                   '(project_id, finish_time_ts)'),
+                  ('task_run_finish_time_ts_brin_idx',
+                   'USING brin (finish_time_ts)')],
+         triggers=sync_timestamps_ddl('task_run',
+                                      [('created', 'created_ts'),
+                                       ('finish_time', 'finish_time_ts')]))]
+
+#: Tables with a task_id and project_id referencing task.
+TASK_REFERENCES = ['task_run', 'result', 'counter', 'task_aggregate']
+
+
+def partition_name(table, project_id):
+    return '%s_p%d' % (table, int(project_id))
+
+
+def is_supported(conn):
+    """Return whether the server supports the partitioned layout."""
+    version = conn.execute('SHOW server_version_num').scalar()
+    return int(version) >= 130000
+
+
+def is_partitioned(conn):
+    """Return whether the task tables use the partitioned layout."""
+    sql = text("SELECT relkind FROM pg_class WHERE oid = to_regclass('task')")
+    return conn.execute(sql).scalar() == 'p'
+
+
+def create_partitions(conn, project_id):
+    for table in TABLES:
+        conn.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s '
+                     'FOR VALUES IN (%d)'
+                     % (partition_name(table['name'], project_id),
+                        table['name'], int(project_id)))
+
+
+def drop_partitions(conn, project_id):
+    """Drop the partitions of a project, which must be empty."""
+    for table in reversed(TABLES):
+        name = partition_name(table['name'], project_id)
+        if conn.execute(text('SELECT to_regclass(:name)'),
+                        dict(name=name)).scalar() is None:
+            continue
+        conn.execute('ALTER TABLE %s DETACH PARTITION %s'
+                     % (table['name'], name))
+        conn.execute('DROP TABLE %s' % name)
+
+
+def lock_partitions_sql(project_id):
+    """Return the SQL locking the partitions of a project against writes,
+    in place of locking all its rows."""
+    return 'LOCK TABLE %s, %s IN EXCLUSIVE MODE;' % (
+        partition_name('task_run', project_id),
+        partition_name('task', project_id))
+
+
+def truncate_task_runs_sql(project_id):
+    return 'TRUNCATE %s;' % partition_name('task_run', project_id)
+
+
+def partition_tables(conn, tables=None):
+    """Convert task and task_run to the partitioned layout, with one
+    partition per existing project. Migrations pass the definition of the
+    tables at their revision."""
+    project_ids = [row.id for row in conn.execute('SELECT id FROM project')]
+    _drop_task_references(conn)
+    for table in tables or TABLES:
+        _rebuild(conn, table, project_ids)
+    _add_task_references(conn, partitioned=True)
+
+
+def unpartition_tables(conn, tables=None):
+    """Convert task and task_run back to plain tables."""
+    _drop_task_references(conn)
+    for table in tables or TABLES:
+        _rebuild(conn, table, None)
+    _add_task_references(conn, partitioned=False)
+
+
+def _rebuild(conn, table, project_ids):
+    """Recreate a table, partitioned if project_ids is not None, copying its
+    rows, sequence, constraints, indexes and trigger."""
+    name = table['name']
+    partitioned = project_ids is not None
+    old = '%s_old' % name
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"),
+                            dict(t=name)).scalar()
+    conn.execute('ALTER TABLE %s RENAME TO %s' % (name, old))
+    conn.execute('''CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS
+                 INCLUDING STORAGE)%s'''
+                 % (name, old,
+                    ' PARTITION BY LIST (project_id)' if partitioned else ''))
+    for project_id in project_ids or []:
+        conn.execute('CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%d)'
+                     % (partition_name(name, project_id), name, project_id))
+    conn.execute('INSERT INTO %s SELECT * FROM %s' % (name, old))
+    conn.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, name))
+    conn.execute('DROP TABLE %s CASCADE' % old)
+
+    # The constraints and indexes are created once the old table is
+    # dropped, as they reuse its names.
+    conn.execute('ALTER TABLE %s ADD PRIMARY KEY %s'
+                 % (name, '(id, project_id)' if partitioned else '(id)'))
+    for foreign_key in table['foreign_keys']:
+        conn.execute('ALTER TABLE %s ADD FOREIGN KEY %s'
+                     % (name, foreign_key))
+    for index, columns in table['unique_indexes']:
+        if partitioned and not columns.startswith('(project_id'):
+            columns = '(project_id, %s' % columns[1:]
+        conn.execute('CREATE UNIQUE INDEX %s ON %s %s'
+                     % (index, name, columns))
+    for index, columns in table['indexes']:
+        conn.execute('CREATE INDEX %s ON %s %s' % (index, name, columns))
+    for statement in table['triggers']:
+        conn.execute(statement)
+
+
+def _drop_task_references(conn):
+    sql = text('''SELECT conrelid::regclass AS table_name, conname
+               FROM pg_constraint WHERE contype = 'f'
+               AND confrelid = 'task'::regclass
+               AND conparentid = 0''')
+    for row in conn.execute(sql).fetchall():
+        conn.execute('ALTER TABLE %s DROP CONSTRAINT %s'
+                     % (row.table_name, row.conname))
+
+
+def _add_task_references(conn, partitioned):
+    """Add the foreign keys to task of the tables referencing it, on
+    (task_id, project_id) in the partitioned layout. They are not validated
+    for the rows of the tables that were not rebuilt."""
+    for name in TASK_REFERENCES:
+        if partitioned:
+            foreign_key = ('(task_id, project_id) '
+                           'REFERENCES task (id, project_id)')
+        else:
+            foreign_key = '(task_id) REFERENCES task (id)'
+        not_valid = ' NOT VALID' if name != 'task_run' else ''
+        conn.execute('ALTER TABLE %s ADD FOREIGN KEY %s ON DELETE CASCADE%s'
+                     % (name, foreign_key, not_valid))
@@ -0,0 +1,159 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Routing of the read only queries of the repositories to read replicas.
+
+The replicas are the binds listed in READ_REPLICA_BINDS. Within a request,
+read_session returns the session of one of them, picked at random among
+the replicas lagging less than READ_REPLICA_MAX_LAG seconds behind the
+primary. The lag of each replica is checked at most once every
+READ_REPLICA_LAG_CHECK_INTERVAL seconds in each process; a replica that
+cannot be reached is skipped until the next check.
+
+A request sticks to the primary once it writes, and requests other than
+GET, HEAD and OPTIONS use the primary from the start, so that they read
+their own writes and only change objects loaded by the primary session.
+Outside requests, e.g. in jobs, the primary is always used.
+"""
+import random
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+LAG_SQL = '''SELECT CASE WHEN pg_is_in_recovery()
+             THEN COALESCE(EXTRACT(EPOCH FROM
+                 now() - pg_last_xact_replay_timestamp()), 0)
+             ELSE 0 END AS lag;'''
+
+_replicas = []
+_lag_lock = threading.Lock()
+_lags = {}
+
+
+def is_enabled():
+    return bool(_replicas) and bool(
+        current_app.config.get('READ_REPLICA_ROUTING'))
+
+
+def use_primary():
+    """Route the reads of the current request to the primary from now on."""
+    if has_request_context():
+        g._read_primary = True
+
+
+def _lag(bind, session):
+    """Return the replication lag of a replica in seconds, or None if it
+    cannot be reached."""
+    now = time.time()
+    interval = current_app.config.get('READ_REPLICA_LAG_CHECK_INTERVAL', 5)
+    with _lag_lock:
+        checked = _lags.get(bind)
+        if checked is not None and now - checked[0] < interval:
+            return checked[1]
+    try:
+        lag = float(session.execute(LAG_SQL).scalar())
+        session.commit()
+    except Exception as e:
+        current_app.logger.warning('Read replica %s is unavailable: %s',
+                                   bind, e)
+        session.rollback()
+        lag = None
+    with _lag_lock:
+        _lags[bind] = (now, lag)
+    return lag
+
+
+def _healthy_replicas():
+    max_lag = current_app.config.get('READ_REPLICA_MAX_LAG')
+    healthy = []
+    for bind, session in _replicas:
+        lag = _lag(bind, session)
+        if lag is not None and (max_lag is None or lag <= max_lag):
+            healthy.append((bind, session))
+    return healthy
+
+
+def read_session(db):
+    """Return the session read only queries of the current request should
+    use: a replica if routing allows it, else the primary db.session."""
+    if not has_request_context() or not is_enabled():
+        return db.session
+    if getattr(g, '_read_primary', False):
+        return db.session
+    replica = getattr(g, '_read_replica', None)
+    if replica is None:
+        healthy = _healthy_replicas()
+        replica = random.choice(healthy) if healthy else (None, db.session)
+        g._read_replica = replica
+    return replica[1]
+
+
+def _before_request():
+    if request.method not in SAFE_METHODS:
+        use_primary()
+
+
+def _after_write(session, *args):
+    if not session.info.get('read_replica'):
+        use_primary()
+
+
+def _create_session(db, app, bind):
+    if bind == 'slave':
+        return db.slave_session
+    engine = db.get_engine(app, bind=bind)
+    options = dict(bind=engine, autoflush=False, info=dict(read_replica=True))
+    return db.create_scoped_session(options=options)
+
+
+def init_app(app, db):
+    """Create the sessions of the replicas and track the writes done
+    through db.session. The listeners are set on the session class, which
+    the replica sessions share, hence the read_replica flag in their info.
+
+    Replicas whose URI is the primary one are ignored, so nothing is routed
+    unless a distinct replica bind is configured.
+    """
+    del _replicas[:]
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    primary = app.config.get('SQLALCHEMY_DATABASE_URI')
+    for bind in app.config.get('READ_REPLICA_BINDS') or []:
+        if binds.get(bind) in (None, primary):
+            continue
+        session = _create_session(db, app, bind)
+        _replicas.append((bind, session))
+        if session is not db.slave_session:
+            app.teardown_appcontext(_remove_session(session))
+
+    for name, listener in (('after_flush', _after_write),
+                           ('after_commit', _after_write)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
+    app.before_request(_before_request)
+
+
+def _remove_session(session):
+    def _shutdown_session(response_or_exc):  # pragma: no cover
+        session.remove()
+        return response_or_exc
+    return _shutdown_session
@@ -17,11 +17,67 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from time import time
-from datetime import timedelta
 
 
 ACTIVE_USER_KEY = 'pybossa:active_users_in_project:{}'
 
+# KEYS: candidate resources followed by an optional owner key.
+# ARGV: now, duration, ttl, client id, number of candidates, maximum number
+# of locks to acquire, one limit per candidate (negative means unlimited)
+# and, if the owner key is given, the member to record in it for each
+# candidate. Returns the (1-based) indexes of the candidates locked.
+ACQUIRE_LOCK_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expiration = now + tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local client_id = ARGV[4]
+local n = tonumber(ARGV[5])
+local max_locks = tonumber(ARGV[6])
+
+local function release_expired(key)
+    local locks = redis.call('HGETALL', key)
+    local expired = {}
+    for i = 1, #locks, 2 do
+        if now > tonumber(locks[i + 1]) then
+            table.insert(expired, locks[i])
+        end
+    end
+    if #expired > 0 then
+        redis.call('HDEL', key, unpack(expired))
+    end
+end
+
+local function grant(key, member)
+    if redis.call('HEXISTS', key, member) == 0 then
+        redis.call('HSET', key, member, string.format('%.6f', expiration))
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+
+if #KEYS > n then
+    release_expired(KEYS[n + 1])
+end
+
+local acquired = {}
+for i = 1, n do
+    local key = KEYS[i]
+    local limit = tonumber(ARGV[6 + i])
+    release_expired(key)
+    if redis.call('HEXISTS', key, client_id) == 1 or limit < 0
+            or redis.call('HLEN', key) < limit then
+        grant(key, client_id)
+        if #KEYS > n then
+            grant(KEYS[n + 1], ARGV[6 + n + i])
+        end
+        table.insert(acquired, i)
+        if #acquired >= max_locks then
+            break
+        end
+    end
+end
+return acquired
+"""
+
 
 def get_active_user_key(project_id):
     return ACTIVE_USER_KEY.format(project_id)
@@ -55,7 +111,7 @@ class LockManager(object):
         self._redis = cache
         self._duration = duration
 
-    def acquire_lock(self, resource_id, client_id, limit, pipeline=None):
+    def acquire_lock(self, resource_id, client_id, limit):
         """
         Acquire a lock on a resource.
         :param resource_id: resource on which lock is needed
@@ -63,18 +119,46 @@ class LockManager(object):
         :param limit: how many clients can access the resource concurrently
         :return: True if lock was successfully acquired, else False
         """
-        timestamp = time()
-        expiration = timestamp + self._duration
-        self._release_expired_locks(resource_id, timestamp)
-        if self._redis.hexists(resource_id, client_id):
-            return True
-        num_acquired = self._redis.hlen(resource_id)
-        if num_acquired < limit:
-            cache = pipeline or self._redis
-            cache.hset(resource_id, client_id, expiration)
-            cache.expire(resource_id, timedelta(seconds=self._duration))
-            return True
-        return False
+        return self.acquire_any_lock([resource_id], client_id, [limit]) is not None
+
+    def acquire_any_lock(self, resource_ids, client_id, limits,
+                         owner_key=None, owner_members=None):
+        """
+        Acquire a lock on the first available resource out of a list of
+        candidates. Expired locks are released, capacity is checked and the
+        lock is granted in a single atomic server side call.
+        :param resource_ids: candidate resources, in order of preference
+        :param client_id: id of client needing the lock
+        :param limits: how many clients can access each resource concurrently
+        :param owner_key: optional key where the acquired resource is also
+            recorded for the client
+        :param owner_members: value recorded in owner_key for each resource
+        :return: index of the resource locked, or None if none was available
+        """
+        acquired = self.acquire_locks(resource_ids, client_id, limits, 1,
+                                      owner_key, owner_members)
+        if acquired:
+            return acquired[0]
+        return None
+
+    def acquire_locks(self, resource_ids, client_id, limits, max_locks,
+                      owner_key=None, owner_members=None):
+        """
+        Acquire locks on up to max_locks available resources out of a list
+        of candidates, atomically. See acquire_any_lock.
+        :return: indexes of the resources locked
+        """
+        if not resource_ids or max_locks < 1:
+            return []
+        keys = list(resource_ids)
+        args = [time(), self._duration, int(self._duration), client_id,
+                len(resource_ids), max_locks]
+        args.extend(-1 if limit == float('inf') else limit for limit in limits)
+        if owner_key is not None:
+            keys.append(owner_key)
+            args.extend(owner_members)
+        script = self._redis.register_script(ACQUIRE_LOCK_SCRIPT)
+        return [index - 1 for index in script(keys=keys, args=args)]
 
     def has_lock(self, resource_id, client_id):
         """
@@ -111,16 +195,6 @@ class LockManager(object):
         """
         return self._redis.hgetall(resource_id)
 
-    def _release_expired_locks(self, resource_id, now):
-        locks = self.get_locks(resource_id)
-        to_delete = []
-        for key, expiration in locks.iteritems():
-            expiration = float(expiration)
-            if now > expiration:
-                to_delete.append(key)
-        if to_delete:
-            self._redis.hdel(resource_id, *to_delete)
-
     @staticmethod
     def seconds_remaining(expiration):
         return float(expiration) - time()
@@ -46,6 +46,7 @@ from sqlalchemy.sql import and_, or_
 from sqlalchemy import cast, Text, func, desc
 from sqlalchemy.types import TIMESTAMP
 from sqlalchemy.orm.base import _entity_descriptor
+from pybossa import read_routing
 
 class Repository(object):
 
@@ -54,6 +55,12 @@ class Repository(object):
         self.language = language
         self.rdancy_upd_exp = rdancy_upd_exp
 
+    @property
+    def read_session(self):
+        """Session for read only queries, a read replica when the current
+        request can use one. See pybossa.read_routing."""
+        return read_routing.read_session(self.db)
+
     def generate_query_from_keywords(self, model, fulltextsearch=None,
                                      **kwargs):
         clauses = [_entity_descriptor(model, key) == value
@@ -145,34 +152,34 @@ class Repository(object):
                                                                **filters)
 
         if model not in [Announcement, ProjectStats] and owner_id:
-            subquery = self.db.session.query(Project)\
+            subquery = self.read_session.query(Project)\
                            .with_entities(Project.id)\
                            .filter_by(owner_id=owner_id).subquery()
             if (model != Project):
-                query = self.db.session.query(model)\
+                query = self.read_session.query(model)\
                             .filter(model.project_id.in_(subquery),
                                     *query_args)
             else:
-                query = self.db.session.query(model)\
+                query = self.read_session.query(model)\
                             .filter(model.id.in_(subquery),
                                     *query_args)
         else:
-            query = self.db.session.query(model).filter(*query_args)
+            query = self.read_session.query(model).filter(*query_args)
 
         if participated and model == Task:
             if participated['user_id']:
-                subquery = self.db.session.query(TaskRun)\
+                subquery = self.read_session.query(TaskRun)\
                                .with_entities(TaskRun.task_id)\
                                .filter_by(user_id=participated['user_id']).subquery()
             if participated['external_uid']:
-                subquery = self.db.session.query(TaskRun)\
+                subquery = self.read_session.query(TaskRun)\
                                .with_entities(TaskRun.task_id)\
                                .filter_by(external_uid=participated['external_uid']).subquery()
             if participated['user_ip']:
-                subquery = self.db.session.query(TaskRun)\
+                subquery = self.read_session.query(TaskRun)\
                                .with_entities(TaskRun.task_id)\
                                .filter_by(user_ip=participated['user_ip']).subquery()
-            query = self.db.session.query(model)\
+            query = self.read_session.query(model)\
                         .filter(~model.id.in_(subquery),
                                 *query_args)
         if len(headlines) > 0:
@@ -29,13 +29,13 @@ class AnnouncementRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(Announcement).get(id)
+        return self.read_session.query(Announcement).get(id)
 
     def get_all_announcements(self):
-        return self.db.session.query(Announcement).all()
+        return self.read_session.query(Announcement).all()
 
     def get_by(self, **attributes):
-        return self.db.session.query(Announcement).filter_by(**attributes).first()
+        return self.read_session.query(Announcement).filter_by(**attributes).first()
 
     def filter_by(self, limit=None, offset=0, yielded=False, last_id=None,
                   **filters):
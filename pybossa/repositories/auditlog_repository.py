@@ -29,10 +29,10 @@ class AuditlogRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(Auditlog).get(id)
+        return self.read_session.query(Auditlog).get(id)
 
     def get_by(self, **attributes):
-        return self.db.session.query(Auditlog).filter_by(**attributes).first()
+        return self.read_session.query(Auditlog).filter_by(**attributes).first()
 
     def filter_by(self, limit=None, offset=0, **filters):
         return self._filter_by(Auditlog, limit, offset, **filters)
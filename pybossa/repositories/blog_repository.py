@@ -30,10 +30,10 @@ class BlogRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(Blogpost).get(id)
+        return self.read_session.query(Blogpost).get(id)
 
     def get_by(self, **attributes):
-        return self.db.session.query(Blogpost).filter_by(**attributes).first()
+        return self.read_session.query(Blogpost).filter_by(**attributes).first()
 
     def filter_by(self, limit=None, offset=0, yielded=False, last_id=None,
                   **filters):
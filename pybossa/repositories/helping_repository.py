@@ -26,10 +26,10 @@ from pybossa.exc import WrongObjectError, DBIntegrityError
 class HelpingMaterialRepository(Repository):
 
     def get(self, id):
-        return self.db.session.query(HelpingMaterial).get(id)
+        return self.read_session.query(HelpingMaterial).get(id)
 
     def get_by(self, **attributes):
-        return self.db.session.query(HelpingMaterial).filter_by(**attributes).first()
+        return self.read_session.query(HelpingMaterial).filter_by(**attributes).first()
 
     def filter_by(self, limit=None, offset=0, yielded=False,
                   last_id=None, fulltextsearch=None, desc=False, **filters):
@@ -29,7 +29,7 @@ class PerformanceStatsRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(PerformanceStats).get(id)
+        return self.read_session.query(PerformanceStats).get(id)
 
     def filter_by(self, limit=None, offset=0, yielded=False, last_id=None,
                   fulltextsearch=None, desc=False, orderby='id',
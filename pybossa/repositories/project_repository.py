@@ -35,16 +35,16 @@ class ProjectRepository(Repository):
 
     # Methods for Project objects
     def get(self, id):
-        return self.db.session.query(Project).get(id)
+        return self.read_session.query(Project).get(id)
 
     def get_by_shortname(self, short_name):
-        return self.db.session.query(Project).filter_by(short_name=short_name).first()
+        return self.read_session.query(Project).filter_by(short_name=short_name).first()
 
     def get_by(self, **attributes):
-        return self.db.session.query(Project).filter_by(**attributes).first()
+        return self.read_session.query(Project).filter_by(**attributes).first()
 
     def get_all(self):
-        return self.db.session.query(Project).all()
+        return self.read_session.query(Project).all()
 
     def filter_by(self, limit=None, offset=0, yielded=False, last_id=None,
                   fulltextsearch=None, desc=False, **filters):
@@ -89,14 +89,14 @@ class ProjectRepository(Repository):
     # Methods for Category objects
     def get_category(self, id=None):
         if id is None:
-            return self.db.session.query(Category).first()
-        return self.db.session.query(Category).get(id)
+            return self.read_session.query(Category).first()
+        return self.read_session.query(Category).get(id)
 
     def get_category_by(self, **attributes):
-        return self.db.session.query(Category).filter_by(**attributes).first()
+        return self.read_session.query(Category).filter_by(**attributes).first()
 
     def get_all_categories(self):
-        return self.db.session.query(Category).all()
+        return self.read_session.query(Category).all()
 
     def filter_categories_by(self, limit=None, offset=0, yielded=False,
                              last_id=None, fulltextsearch=None,
@@ -30,7 +30,7 @@ class ProjectStatsRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(ProjectStats).get(id)
+        return self.read_session.query(ProjectStats).get(id)
 
     def filter_by(self, limit=None, offset=0, yielded=False, last_id=None,
                   fulltextsearch=None, desc=False, orderby='id',
@@ -26,12 +26,12 @@ from sqlalchemy import text
 class ResultRepository(Repository):
 
     def get(self, id):
-        return self.db.session.query(Result).get(id)
+        return self.read_session.query(Result).get(id)
 
     def get_by(self, **attributes):
         if 'last_version' not in attributes.keys():
             attributes['last_version'] = True
-        return self.db.session.query(Result).filter_by(**attributes).first()
+        return self.read_session.query(Result).filter_by(**attributes).first()
 
     def filter_by(self, limit=None, offset=0, yielded=False,
                   last_id=None, fulltextsearch=None, desc=False, **filters):
@@ -45,6 +45,17 @@ class ResultRepository(Repository):
                               fulltextsearch,
                               desc, **filters)
 
+    def get_last_versions(self, task_ids):
+        """Return the last version results of several tasks, in id
+        order."""
+        if not task_ids:
+            return []
+        return (self.read_session.query(Result)
+                .filter(Result.task_id.in_(task_ids))
+                .filter(Result.last_version == True)
+                .order_by(Result.id)
+                .all())
+
     def save(self, result):
         self._validate_can_be('saved', result)
         try:
@@ -17,18 +17,23 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import cast, Date
+from sqlalchemy import cast, Date, null, func, Text
+from sqlalchemy.dialects.postgresql import insert, JSONB
 
 from pybossa.repositories import Repository
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
+from pybossa.model.counter import Counter
 from pybossa.model import make_timestamp
 from pybossa.model.user import User
-from pybossa.exc import WrongObjectError, DBIntegrityError
+from pybossa.exc import WrongObjectError, DBIntegrityError, DuplicateTaskError
 from pybossa.cache import projects as cached_projects
-from pybossa.core import uploader
+from pybossa.core import uploader, sentinel
+from pybossa import task_queue
+from pybossa import partitioning
 from sqlalchemy import text
-from pybossa.cache.task_browse_helpers import get_task_filters
+from pybossa.cache.task_browse_helpers import (get_task_filters,
+    task_run_aggregates)
 import json
 from datetime import datetime, timedelta
 from flask import current_app
@@ -44,11 +49,11 @@ class TaskRepository(Repository):
 
     # Methods for queries on Task objects
     def get_task(self, id):
-        return self.db.session.query(Task).get(id)
+        return self.read_session.query(Task).get(id)
 
     def get_task_by(self, **attributes):
         filters, _, _, _ = self.generate_query_from_keywords(Task, **attributes)
-        return self.db.session.query(Task).filter(*filters).first()
+        return self.read_session.query(Task).filter(*filters).first()
 
     def filter_tasks_by(self, limit=None, offset=0, yielded=False,
                         last_id=None, fulltextsearch=None, desc=False,
@@ -63,12 +68,12 @@ class TaskRepository(Repository):
         exp = filters.pop('exported', None)
         filters.pop('state', None) # exclude state param
         if exp is not None:
-            query = self.db.session.query(Task).\
+            query = self.read_session.query(Task).\
                 filter(or_(Task.state == u'completed', Task.calibration == 1)).\
                 filter(Task.exported == exp).\
                 filter_by(**filters)
         else:
-            query = self.db.session.query(Task).\
+            query = self.read_session.query(Task).\
                 filter(or_(Task.state == u'completed', Task.calibration == 1)).\
                 filter_by(**filters)
 
@@ -88,7 +93,7 @@ class TaskRepository(Repository):
         if finish_time:
             conditions.append(TaskRun.finish_time >= finish_time)
 
-        query = self.db.session.query(TaskRun).join(Task).\
+        query = self.read_session.query(TaskRun).join(Task).\
             filter(TaskRun.task_id == Task.id).\
             filter(or_(Task.state == u'completed', Task.calibration == 1)).\
             filter(*conditions).\
@@ -100,11 +105,11 @@ class TaskRepository(Repository):
 
     def count_tasks_with(self, **filters):
         query_args, _, _, _  = self.generate_query_from_keywords(Task, **filters)
-        return self.db.session.query(Task).filter(*query_args).count()
+        return self.read_session.query(Task).filter(*query_args).count()
 
     def filter_tasks_by_user_favorites(self, uid, **filters):
         """Return tasks marked as favorited by user.id."""
-        query = self.db.session.query(Task).filter(Task.fav_user_ids.any(uid))
+        query = self.read_session.query(Task).filter(Task.fav_user_ids.any(uid))
         limit = filters.get('limit', 20)
         offset = filters.get('offset', 0)
         last_id = filters.get('last_id', None)
@@ -117,9 +122,14 @@ class TaskRepository(Repository):
                                        desc, orderby)
         return query.all()
 
+    def get_tasks(self, ids):
+        if not ids:
+            return []
+        return self.read_session.query(Task).filter(Task.id.in_(ids)).all()
+
     def get_task_favorited(self, uid, task_id):
         """Return task marked as favorited by user.id."""
-        tasks = self.db.session.query(Task)\
+        tasks = self.read_session.query(Task)\
                     .filter(Task.fav_user_ids.any(uid),
                             Task.id==task_id)\
                     .all()
@@ -127,13 +137,13 @@ class TaskRepository(Repository):
 
     # Methods for queries on TaskRun objects
     def get_task_run(self, id):
-        return self.db.session.query(TaskRun).get(id)
+        return self.read_session.query(TaskRun).get(id)
 
     def get_task_run_by(self, fulltextsearch=None, **attributes):
         filters, _, _, _  = self.generate_query_from_keywords(TaskRun,
                                                     fulltextsearch,
                                                     **attributes)
-        return self.db.session.query(TaskRun).filter(*filters).first()
+        return self.read_session.query(TaskRun).filter(*filters).first()
 
     def filter_task_runs_by(self, limit=None, offset=0, last_id=None,
                             yielded=False, fulltextsearch=None,
@@ -141,12 +151,21 @@ class TaskRepository(Repository):
         return self._filter_by(TaskRun, limit, offset, yielded, last_id,
                               fulltextsearch, desc, **filters)
 
+    def get_task_runs_of_tasks(self, task_ids):
+        """Return the task runs of several tasks, in id order."""
+        if not task_ids:
+            return []
+        return (self.read_session.query(TaskRun)
+                .filter(TaskRun.task_id.in_(task_ids))
+                .order_by(TaskRun.id)
+                .all())
+
     def count_task_runs_with(self, **filters):
         query_args, _, _, _ = self.generate_query_from_keywords(TaskRun, **filters)
-        return self.db.session.query(TaskRun).filter(*query_args).count()
+        return self.read_session.query(TaskRun).filter(*query_args).count()
 
     def get_user_has_task_run_for_project(self, project_id, user_id):
-        return (self.db.session.query(TaskRun)
+        return (self.read_session.query(TaskRun)
                 .filter(TaskRun.user_id == user_id)
                 .filter(TaskRun.project_id == project_id)
                 .first()) is not None
@@ -175,9 +194,132 @@ class TaskRepository(Repository):
             self.db.session.add(element)
             self.db.session.commit()
             cached_projects.clean_project(element.project_id)
+        except IntegrityError as e:
+            self.db.session.rollback()
+            if _violates(e, 'task_project_id_info_hash_idx'):
+                raise DuplicateTaskError(
+                    self.find_duplicate(element.project_id, element.info))
+            raise DBIntegrityError(e)
+
+    def save_deduplicated(self, task):
+        """Save a task, raising a DuplicateTaskError if an ongoing task of
+        its project has the same info. Setting info_hash makes the trigger
+        deduplicate the task; the hash is computed by the database."""
+        if task.info is not None:
+            info = json.dumps(task.info, allow_nan=False)
+            task.info_hash = func.md5(cast(cast(info, JSONB), Text))
+        self.save(task)
+
+    def insert_tasks(self, project_id, tasks):
+        """
+        Insert tasks of a project and their counters with multi-row INSERT
+        statements, in a single transaction. Task event listeners do not run
+        for each task; their side effects are applied once for the batch.
+        Tasks with the same info as an ongoing task of the project, or as
+        an earlier task of the batch, are skipped and keep no id.
+        Returns the ids of the new tasks.
+        """
+        from pybossa.model.event_listeners import (before_bulk_task_insert,
+                                                   after_bulk_task_insert)
+        if not tasks:
+            return []
+        for task in tasks:
+            self._validate_can_be(self.SAVE_ACTION, task)
+        before_bulk_task_insert(project_id)
+        task_table = Task.__table__
+        try:
+            # The ids are taken from the sequence beforehand, to tell which
+            # tasks were inserted from the ids the INSERT returns. Setting
+            # info_hash makes the trigger deduplicate the tasks.
+            new_ids = self._new_ids_and_hashes([task.info for task in tasks])
+            rows = []
+            for task, (task_id, info_hash) in zip(tasks, new_ids):
+                task.info_hash = info_hash
+                rows.append(dict(self._insert_values(task_table, task),
+                                 id=task_id))
+            stmt = insert(task_table).values(rows).on_conflict_do_nothing(
+                index_elements=[task_table.c.project_id,
+                                task_table.c.info_hash],
+                index_where=task_table.c.state == u'ongoing')
+            results = self.db.session.execute(
+                stmt.returning(task_table.c.id))
+            inserted_ids = set(row.id for row in results)
+            inserted = []
+            for task, (task_id, _) in zip(tasks, new_ids):
+                if task_id in inserted_ids:
+                    task.id = task_id
+                    inserted.append(task)
+            task_ids = [task.id for task in inserted]
+            if inserted:
+                created = make_timestamp()
+                counters = [dict(created=created, project_id=project_id,
+                                 task_id=task_id, n_task_runs=0)
+                            for task_id in task_ids]
+                self.db.session.execute(
+                    Counter.__table__.insert().values(counters))
+                after_bulk_task_insert(self.db.session, project_id, inserted)
+            self.db.session.commit()
+            cached_projects.clean_project(project_id)
+            return task_ids
+        except IntegrityError as e:
+            self.db.session.rollback()
+            raise DBIntegrityError(e)
+        except Exception:
+            self.db.session.rollback()
+            raise
+
+    def insert_task_runs(self, task_runs):
+        """
+        Insert task runs of a user, for distinct tasks, with a multi-row
+        INSERT statement, in a single transaction. Task runs conflicting
+        with an existing one are skipped and keep no id. Task run event
+        listeners do not run for each task run; their side effects are
+        applied once for the batch, except the submission ones. Returns the
+        task runs inserted.
+        """
+        from pybossa.model.event_listeners import after_bulk_task_run_insert
+        if not task_runs:
+            return []
+        for task_run in task_runs:
+            self._validate_can_be(self.SAVE_ACTION, task_run)
+        task_run_table = TaskRun.__table__
+        rows = [self._insert_values(task_run_table, task_run)
+                for task_run in task_runs]
+        try:
+            stmt = insert(task_run_table).values(rows).on_conflict_do_nothing()
+            results = self.db.session.execute(
+                stmt.returning(task_run_table.c.id,
+                               task_run_table.c.task_id))
+            # The task runs are for distinct tasks, so that the rows
+            # returned, in no particular order, are told apart by task.
+            inserted_ids = dict((row.task_id, row.id) for row in results)
+            for task_run in task_runs:
+                task_run.id = inserted_ids.get(task_run.task_id)
+            inserted = [tr for tr in task_runs if tr.id is not None]
+            if inserted:
+                after_bulk_task_run_insert(self.db.session, inserted)
+            self.db.session.commit()
+            for project_id in set(tr.project_id for tr in inserted):
+                cached_projects.clean_project(project_id)
+            return inserted
         except IntegrityError as e:
             self.db.session.rollback()
             raise DBIntegrityError(e)
+        except Exception:
+            self.db.session.rollback()
+            raise
+
+    def _insert_values(self, table, element):
+        values = {}
+        for column in table.columns:
+            if column.primary_key:
+                continue
+            value = getattr(element, column.name)
+            if value is None and column.default is not None:
+                default = column.default
+                value = default.arg(None) if default.is_callable else default.arg
+            values[column.name] = null() if value is None else value
+        return values
 
     def update(self, element):
         self._validate_can_be(self.UPDATE_ACTION, element)
@@ -209,6 +351,7 @@ class TaskRepository(Repository):
                                     AND id=:task_id;'''), args)
         self.db.session.commit()
         cached_projects.clean(project_id)
+        task_queue.remove_tasks(project_id, [task_id], sentinel.master)
 
     def delete_valid_from_project(self, project, force_reset=False, filters=None):
         if not force_reset:
@@ -240,13 +383,12 @@ class TaskRepository(Repository):
                     SELECT task.id as id,
                     coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                     priority_0, task.created
-                    FROM task LEFT OUTER JOIN
-                    (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                    MAX(finish_time) as ft FROM task_run
-                    WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                    FROM task LEFT OUTER JOIN {}
                     ON task.id=log_counts.task_id
                     WHERE task.project_id=:project_id {}
                 );
+                DELETE FROM task_aggregate WHERE project_id=:project_id
+                       AND task_id in (SELECT id FROM to_delete);
                 DELETE FROM result WHERE project_id=:project_id
                        AND task_id in (SELECT id FROM to_delete);
                 DELETE FROM task_run WHERE project_id=:project_id
@@ -254,16 +396,22 @@ class TaskRepository(Repository):
                 DELETE FROM task WHERE task.project_id=:project_id
                        AND id in (SELECT id FROM to_delete);
                 COMMIT;
-                '''.format(sql_session_repl, conditions))
+                '''.format(sql_session_repl, task_run_aggregates,
+                           conditions))
         self.db.bulkdel_session.execute(sql, dict(project_id=project.id, **params))
         self.db.bulkdel_session.commit()
         cached_projects.clean_project(project.id)
+        task_queue.reset(project.id, sentinel.master)
         self._delete_zip_files_from_store(project)
 
     def delete_taskruns_from_project(self, project):
+        delete_task_runs = 'DELETE FROM task_run WHERE project_id=:project_id;'
+        if partitioning.is_partitioned(self.db.session):
+            delete_task_runs = partitioning.truncate_task_runs_sql(project.id)
         sql = text('''
-                   DELETE FROM task_run WHERE project_id=:project_id;
-                   ''')
+                   {}
+                   DELETE FROM task_aggregate WHERE project_id=:project_id;
+                   '''.format(delete_task_runs))
         self.db.session.execute(sql, dict(project_id=project.id))
         self.db.session.commit()
         cached_projects.clean_project(project.id)
@@ -292,10 +440,7 @@ class TaskRepository(Repository):
                         SELECT task.id as id,
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
-                        FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        FROM task LEFT OUTER JOIN {}
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id {}
                    ),
@@ -318,7 +463,7 @@ class TaskRepository(Repository):
                    ((id IN (SELECT id from tasks_excl_file_urls)) OR
                    (id IN (SELECT id from tasks_with_file_urls) AND state='ongoing'
                    AND TO_DATE(created, 'YYYY-MM-DD\THH24:MI:SS.US') >= NOW() - :task_expiration ::INTERVAL));'''
-                   .format(conditions))
+                   .format(task_run_aggregates, conditions))
         self.db.session.execute(sql, dict(n_answers=n_answers,
                                           project_id=project.id,
                                           task_expiration=task_expiration,
@@ -326,6 +471,7 @@ class TaskRepository(Repository):
         self.update_task_state(project.id)
         self.db.session.commit()
         cached_projects.clean_project(project.id)
+        task_queue.reset(project.id, sentinel.master)
         return tasks_not_updated
 
     def update_task_state(self, project_id):
@@ -377,10 +523,7 @@ class TaskRepository(Repository):
                         SELECT task.id as id,
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
-                        FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        FROM task LEFT OUTER JOIN {}
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id {}
                    )
@@ -388,25 +531,27 @@ class TaskRepository(Repository):
                    SET priority_0=:priority
                    WHERE project_id=:project_id AND task.id in (
                         SELECT id FROM to_update);
-                   '''.format(conditions))
+                   '''.format(task_run_aggregates, conditions))
         self.db.session.execute(sql, dict(priority=priority,
                                           project_id=project_id,
                                           **params))
         self.db.session.commit()
         cached_projects.clean_project(project_id)
+        task_queue.reset(project_id, sentinel.master)
 
     def find_duplicate(self, project_id, info):
         """
-        Find a task id in the given project with the project info using md5
-        index on info column casted as text. Md5 is used to avoid key size
-        limitations in BTree indices
+        Find the id of the ongoing task of the given project with the same
+        info, that holds its hash, using the unique index on the md5 of the
+        info of the tasks.
+        Md5 is used to avoid key size limitations in BTree indices
         """
         sql = text('''
                    SELECT task.id as task_id
                    FROM task
                    WHERE task.project_id=:project_id
                    AND task.state='ongoing'
-                   AND md5(task.info::text)=md5(((:info)::jsonb)::text)
+                   AND task.info_hash=md5(((:info)::jsonb)::text)
                    ''')
         info = json.dumps(info, allow_nan=False)
         row = self.db.session.execute(
@@ -414,6 +559,21 @@ class TaskRepository(Repository):
         if row:
             return row[0]
 
+    def _new_ids_and_hashes(self, infos):
+        """Return a new task id and the md5 of the info, as stored in
+        Task.info_hash, for each of the given task infos, with a single
+        query."""
+        sql = text('''
+                   SELECT nextval(pg_get_serial_sequence('task', 'id')) AS id,
+                   md5((i.info::jsonb)::text) AS hash
+                   FROM unnest(CAST(:infos AS text[]))
+                   WITH ORDINALITY AS i(info, n)
+                   ORDER BY i.n
+                   ''')
+        infos = [json.dumps(info, allow_nan=False) for info in infos]
+        rows = self.db.session.execute(sql, dict(infos=infos))
+        return [(row.id, row.hash) for row in rows]
+
     def _validate_can_be(self, action, element):
         from flask import current_app
         from pybossa.core import project_repo
@@ -456,10 +616,7 @@ class TaskRepository(Repository):
                         SELECT task.id as id,
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
-                        FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        FROM task LEFT OUTER JOIN {}
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id
                         AND task.state='completed'
@@ -484,7 +641,7 @@ class TaskRepository(Repository):
                    ((id IN (SELECT id from tasks_excl_file_urls)) OR
                    (id IN (SELECT id from tasks_with_file_urls) AND state='ongoing'
                    AND TO_DATE(created, 'YYYY-MM-DD\THH24:MI:SS.US') >= NOW() - :task_expiration ::INTERVAL));'''
-                   .format(conditions))
+                   .format(task_run_aggregates, conditions))
         self.db.session.execute(sql, dict(n_answers=n_answers,
                                           project_id=project_id,
                                           task_expiration=task_expiration,
@@ -497,10 +654,7 @@ class TaskRepository(Repository):
                         SELECT task.id as id,
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
-                        FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        FROM task LEFT OUTER JOIN {}
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id {}
                    )
@@ -512,9 +666,15 @@ class TaskRepository(Repository):
                    WHERE key ILIKE '%\_\_upload\_url%')
                    AND (t.state = 'completed' OR TO_DATE(created, 'YYYY-MM-DD\THH24:MI:SS.US') < NOW() - :task_expiration ::INTERVAL)
                    AND n_answers != :n_answers;'''
-                   .format(conditions))
+                   .format(task_run_aggregates, conditions))
         tasks = self.db.session.execute(sql,
             dict(project_id=project.id, n_answers=n_answers,
             task_expiration=task_expiration, **params)).fetchall()
         tasks_not_updated = '\n'.join([str(task.id) for task in tasks])
         return tasks_not_updated
+
+
+def _violates(error, constraint):
+    """Return whether an IntegrityError violates the given constraint."""
+    diag = getattr(error.orig, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == constraint
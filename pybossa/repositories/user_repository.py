@@ -37,16 +37,16 @@ class UserRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(User).get(id)
+        return self.read_session.query(User).get(id)
 
     def get_by_name(self, name):
-        return self.db.session.query(User).filter_by(name=name).first()
+        return self.read_session.query(User).filter_by(name=name).first()
 
     def get_by(self, **attributes):
-        return self.db.session.query(User).filter_by(**attributes).first()
+        return self.read_session.query(User).filter_by(**attributes).first()
 
     def get_all(self):
-        return self.db.session.query(User).filter_by(restrict=False).all()
+        return self.read_session.query(User).filter_by(restrict=False).all()
 
     def filter_by(self, limit=None, offset=0, yielded=False, last_id=None,
                   fulltextsearch=None, desc=False, **filters):
@@ -61,7 +61,7 @@ class UserRepository(Repository):
         """Filter out deleted users."""
         filters['restrict'] = False
         query_args, queries, headlines, orders = self.generate_query_from_keywords(User, None, **filters)
-        query = self.db.session.query(User).filter(*query_args)
+        query = self.read_session.query(User).filter(*query_args)
         query = query.filter(sqlalchemy.not_(User.email_addr.contains(u'@del.com'))).order_by(User.id)
         return query.all()
 
@@ -69,7 +69,7 @@ class UserRepository(Repository):
         if len(keyword) == 0:
             return []
         keyword = '%' + keyword.lower() + '%'
-        query = self.db.session.query(User).filter(or_(func.lower(User.name).like(keyword),
+        query = self.read_session.query(User).filter(or_(func.lower(User.name).like(keyword),
                                   func.lower(User.fullname).like(keyword)))
         if filters:
             query = query.filter_by(**filters)
@@ -79,7 +79,7 @@ class UserRepository(Repository):
         if len(keyword) == 0:
             return []
         keyword = '%' + keyword.lower() + '%'
-        query = self.db.session.query(User).filter(or_(func.lower(User.name).like(keyword),
+        query = self.read_session.query(User).filter(or_(func.lower(User.name).like(keyword),
                                   func.lower(User.fullname).like(keyword)))
         if filters:
             or_clauses = []
@@ -89,7 +89,7 @@ class UserRepository(Repository):
         return query.all()
 
     def total_users(self):
-        return self.db.session.query(User).count()
+        return self.read_session.query(User).count()
 
     def lowercase_user_attributes(self, user):
         user.email_addr = user.email_addr.lower()
@@ -162,10 +162,10 @@ class UserRepository(Repository):
     def get_users(self, ids):
         if not ids:
             return []
-        return self.db.session.query(User).filter(User.id.in_(ids)).all()
+        return self.read_session.query(User).filter(User.id.in_(ids)).all()
 
     def search_by_email(self, email_addr):
-        return self.db.session.query(User).filter(func.lower(User.email_addr) == email_addr).first()
+        return self.read_session.query(User).filter(func.lower(User.email_addr) == email_addr).first()
 
     def get_info_columns(self):
         return [u'languages', u'locations', u'work_hours_from', u'work_hours_to', u'timezone', u'user_type', u'additional_comments']
@@ -178,7 +178,7 @@ class UserRepository(Repository):
                     AND (:is_admin OR (NOT admin AND NOT subadmin));
                     '''.format(where=where))
         query_params['is_admin'] = current_user_is_admin
-        results = self.db.session.execute(sql, query_params)
+        results = self.read_session.execute(sql, query_params)
         return [dict(row) for row in results]
 
     def get_recent_contributor_emails(self, project_id):
@@ -30,10 +30,10 @@ class WebhookRepository(Repository):
         self.db = db
 
     def get(self, id):
-        return self.db.session.query(Webhook).get(id)
+        return self.read_session.query(Webhook).get(id)
 
     def get_by(self, **attributes):
-        return self.db.session.query(Webhook).filter_by(**attributes).first()
+        return self.read_session.query(Webhook).filter_by(**attributes).first()
 
     def filter_by(self, limit=None, offset=0, **filters):
         return self._filter_by(Webhook, limit, offset, **filters)
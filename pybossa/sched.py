@@ -25,6 +25,7 @@ from pybossa.model.task_run import TaskRun
 from pybossa.model.counter import Counter
 from pybossa.core import db, sentinel, project_repo, task_repo
 from redis_lock import LockManager, get_active_user_count, register_active_user
+import task_queue
 from contributions_guard import ContributionsGuard
 from werkzeug.exceptions import BadRequest, Forbidden
 import random
@@ -43,6 +44,7 @@ class Schedulers(object):
 
     locked = 'locked_scheduler'
     user_pref = 'user_pref_scheduler'
+    queued = 'task_queue_scheduler'
 
 
 DEFAULT_SCHEDULER = Schedulers.locked
@@ -52,8 +54,12 @@ TIMEOUT = ContributionsGuard.STAMP_TTL
 def new_task(project_id, sched, user_id=None, user_ip=None,
              external_uid=None, offset=0, limit=1, orderby='priority_0',
              desc=True, rand_within_priority=False,
-             gold_only=False):
-    """Get a new task by calling the appropriate scheduler function."""
+             gold_only=False, prefetch=False):
+    """Get a new task by calling the appropriate scheduler function.
+
+    With prefetch, locking schedulers lock and return up to limit tasks
+    for the user instead of a single one.
+    """
     sched_map = {
         'default': get_locked_task,
         'breadth_first': get_breadth_first_task,
@@ -61,6 +67,7 @@ def new_task(project_id, sched, user_id=None, user_ip=None,
         Schedulers.locked: get_locked_task,
         'incremental': get_incremental_task,
         Schedulers.user_pref: get_user_pref_task,
+        Schedulers.queued: get_queued_task,
         'depth_first_all': get_depth_first_all_task
     }
     scheduler = sched_map.get(sched, sched_map['default'])
@@ -81,12 +88,14 @@ def new_task(project_id, sched, user_id=None, user_ip=None,
         desc=desc,
         rand_within_priority=rand_within_priority,
         present_gold_task=present_gold_task,
-        gold_only=gold_only
+        gold_only=gold_only,
+        prefetch=prefetch
     )
 
 
 def is_locking_scheduler(sched):
-    return sched in [Schedulers.locked, Schedulers.user_pref, 'default']
+    return sched in [Schedulers.locked, Schedulers.user_pref,
+                     Schedulers.queued, 'default']
 
 
 def can_read_task(task, user):
@@ -239,16 +248,16 @@ def locked_scheduler(query_factory):
                                  orderby='priority_0', desc=True,
                                  rand_within_priority=False,
                                  present_gold_task=False,
-                                 gold_only=False):
+                                 gold_only=False,
+                                 prefetch=False):
         if offset > 2:
             raise BadRequest('')
         if offset > 0:
             return None
-        task_id, lock_seconds = get_task_id_and_duration_for_project_user(project_id, user_id)
-        if lock_seconds > 10:
-            task = session.query(Task).get(task_id)
-            if task:
-                return [task]
+        n_tasks = limit if prefetch else 1
+        held_tasks = _get_held_tasks(project_id, user_id, n_tasks)
+        if len(held_tasks) >= n_tasks:
+            return held_tasks
         user_count = get_active_user_count(project_id, sentinel.master)
         current_app.logger.info(
             "Project {} - number of current users: {}"
@@ -269,27 +278,63 @@ def locked_scheduler(query_factory):
         )
         rows = session.execute(sql, dict(project_id=project_id,
                                          user_id=user_id,
-                                         limit=user_count + 5))
-
-        for task_id, taskcount, n_answers, calibration, timeout in rows:
-            timeout = timeout or TIMEOUT
-            remaining = float('inf') if calibration else n_answers - taskcount
-            if acquire_lock(task_id, user_id, remaining, timeout):
-                rows.close()
-                save_task_id_project_id(task_id, project_id, 2 * timeout)
-                register_active_user(project_id, user_id, sentinel.master, ttl=timeout)
-
-                task_type = 'gold task' if calibration else 'task'
-                current_app.logger.info(
-                    'Project {} - user {} obtained {} {}, timeout: {}'
-                    .format(project_id, user_id, task_type, task_id, timeout))
-                return [session.query(Task).get(task_id)]
+                                         limit=user_count + 4 + n_tasks))
 
-        return []
+        held_ids = set(task.id for task in held_tasks)
+        candidates = [row for row in rows if row.id not in held_ids]
+        return held_tasks + _lock_available(project_id, user_id, candidates,
+                                            n_tasks - len(held_tasks))
 
     return template_get_locked_task
 
 
+def _get_held_tasks(project_id, user_id, n_tasks):
+    """Return up to n_tasks tasks of the project the user already holds a
+    lock on, as long as the lock does not expire in the next seconds.
+    """
+    held = get_task_ids_and_durations_for_project_user(project_id, user_id)
+    task_ids = [task_id for task_id, seconds in held if seconds > 10]
+    return _get_tasks(task_ids[:n_tasks])
+
+
+def _lock_available(project_id, user_id, candidates, n_tasks=1):
+    """Lock up to n_tasks tasks available to the user out of candidate rows
+    with id, taskcount, n_answers, calibration and timeout columns, and
+    return them.
+    """
+    if not candidates or n_tasks < 1:
+        return []
+
+    timeout = candidates[0].timeout or TIMEOUT
+    limits = [(row.id, float('inf') if row.calibration
+               else row.n_answers - row.taskcount)
+              for row in candidates]
+    task_ids = acquire_locks(limits, user_id, timeout, n_tasks)
+    if not task_ids:
+        return []
+
+    for task_id in task_ids:
+        save_task_id_project_id(task_id, project_id, 2 * timeout)
+    register_active_user(project_id, user_id, sentinel.master, ttl=timeout)
+
+    calibrations = dict((row.id, row.calibration) for row in candidates)
+    for task_id in task_ids:
+        task_type = 'gold task' if calibrations[task_id] else 'task'
+        current_app.logger.info(
+            'Project {} - user {} obtained {} {}, timeout: {}'
+            .format(project_id, user_id, task_type, task_id, timeout))
+    return _get_tasks(task_ids)
+
+
+def _get_tasks(task_ids):
+    """Load tasks by id, keeping the order of task_ids."""
+    if not task_ids:
+        return []
+    tasks = dict((task.id, task) for task in
+                 session.query(Task).filter(Task.id.in_(task_ids)))
+    return [tasks[task_id] for task_id in task_ids if task_id in tasks]
+
+
 @locked_scheduler
 def get_locked_task(
     project_id,
@@ -396,6 +441,180 @@ def get_user_pref_task(
     return text(sql)
 
 
+def get_queued_task(
+    project_id,
+    user_id=None,
+    user_ip=None,
+    external_uid=None,
+    limit=1,
+    offset=0,
+    orderby='priority_0',
+    desc=True,
+    rand_within_priority=False,
+    present_gold_task=False,
+    gold_only=False,
+    prefetch=False
+):
+    """Select a new task from the precomputed task queue of the project.
+
+    Candidates are read in windows from the queue, in calibration,
+    priority_0 DESC, id ASC order, and filtered for the user with a single
+    query per window. Tasks that are no longer assignable are dropped from
+    the queue on the way. If the user cannot be served within
+    TASK_QUEUE_MAX_WINDOWS windows, the regular locked scheduler is used.
+    rand_within_priority is not supported by this scheduler.
+    """
+    if offset > 2:
+        raise BadRequest('')
+    if offset > 0:
+        return None
+    n_tasks = limit if prefetch else 1
+    tasks = _get_held_tasks(project_id, user_id, n_tasks)
+    if len(tasks) >= n_tasks:
+        return tasks
+
+    redis_conn = sentinel.master
+    if (not task_queue.is_ready(project_id, redis_conn) and
+            not rebuild_task_queue(project_id)):
+        # The queue is being rebuilt by another request.
+        return get_locked_task(
+            project_id, user_id, user_ip, external_uid, limit=limit,
+            present_gold_task=present_gold_task, gold_only=gold_only,
+            prefetch=prefetch)
+    user_count = get_active_user_count(project_id, redis_conn)
+    window = max(user_count + 4 + n_tasks,
+                 current_app.config.get('TASK_QUEUE_WINDOW', 100))
+    max_windows = current_app.config.get('TASK_QUEUE_MAX_WINDOWS', 10)
+
+    queues = []
+    if present_gold_task or gold_only:
+        queues.append(True)
+    if not gold_only:
+        queues.append(False)
+    for gold in queues:
+        for n_window in range(max_windows):
+            task_ids = task_queue.get_task_ids(
+                project_id, n_window * window, window, redis_conn, gold=gold)
+            if not task_ids:
+                break
+            held_ids = set(task.id for task in tasks)
+            candidates = [row for row in
+                          _filter_queued_tasks(project_id, user_id, task_ids)
+                          if row.id not in held_ids]
+            tasks += _lock_available(project_id, user_id, candidates,
+                                     n_tasks - len(tasks))
+            if len(tasks) >= n_tasks:
+                return tasks
+        else:
+            current_app.logger.info(
+                'Project {} - task queue exhausted for user {}'
+                .format(project_id, user_id))
+            return get_locked_task(
+                project_id, user_id, user_ip, external_uid, limit=limit,
+                present_gold_task=present_gold_task, gold_only=gold_only,
+                prefetch=prefetch)
+    return tasks
+
+
+def _filter_queued_tasks(project_id, user_id, task_ids):
+    """Return candidate rows for queued task ids that the user can be
+    assigned, in queue order. Tasks that are not assignable anymore are
+    removed from the queue.
+    """
+    allowed_task_levels_clause = data_access.get_data_access_db_clause_for_task_assignment(user_id)
+    sql = text('''
+           SELECT task.id, COUNT(task_run.task_id) AS taskcount, n_answers, task.calibration,
+              (SELECT info->'timeout'
+               FROM project
+               WHERE id=:project_id) as timeout,
+              (task.state = 'completed' OR
+               ((task.expiration IS NOT NULL) AND (task.expiration <= (now() at time zone 'utc')::timestamp))) AS stale,
+              (TRUE {}) AS allowed,
+              EXISTS (SELECT 1 FROM task_run WHERE project_id=:project_id AND
+              user_id=:user_id AND task_id=task.id) AS answered
+           FROM task
+           LEFT JOIN task_run ON (task.id = task_run.task_id)
+           WHERE task.project_id=:project_id
+           AND task.id = ANY(:task_ids)
+           group by task.id;
+           '''.format(allowed_task_levels_clause))
+    rows = session.execute(sql, dict(project_id=project_id, user_id=user_id,
+                                     task_ids=task_ids)).fetchall()
+    found = {row.id: row for row in rows}
+    stale = [task_id for task_id in task_ids
+             if task_id not in found or found[task_id].stale]
+    task_queue.remove_tasks(project_id, stale, sentinel.master)
+
+    candidates = []
+    for task_id in task_ids:
+        row = found.get(task_id)
+        if row is None or row.stale or not row.allowed or row.answered:
+            continue
+        if not row.calibration and row.taskcount >= row.n_answers:
+            continue
+        candidates.append(row)
+    return candidates
+
+
+def rebuild_task_queue(project_id):
+    """Rebuild the task queue of a project from the database.
+
+    The queue is built aside and swapped in once complete, so that it is
+    never read half built. Tasks written meanwhile are pushed to both.
+    Return False if another rebuild of the queue is running.
+    """
+    redis_conn = sentinel.master
+    timeout = current_app.config.get('TASK_QUEUE_BUILD_TIMEOUT', 600)
+    if not task_queue.start_build(project_id, redis_conn, timeout):
+        return False
+    sql = text('''
+           SELECT id, priority_0, calibration FROM task
+           WHERE project_id=:project_id
+           AND state !='completed'
+           AND ((expiration IS NULL) OR (expiration > (now() at time zone 'utc')::timestamp));
+           ''')
+    try:
+        rows = session.execute(sql, dict(project_id=project_id))
+        task_queue.push_tasks(project_id, rows, redis_conn, build=True)
+    except Exception:
+        task_queue.abort_build(project_id, redis_conn)
+        raise
+    task_queue.finish_build(project_id, redis_conn)
+    return True
+
+
+def push_to_task_queue(task):
+    """Push a task to the queue of its project, if the project uses it."""
+    if task.state == 'completed':
+        remove_from_task_queue(task.project_id, [task.id])
+        return
+    redis_conn = sentinel.master
+    if task_queue.is_building(task.project_id, redis_conn):
+        task_queue.push_task(task.project_id, task.id, task.priority_0,
+                             task.calibration, redis_conn, build=True)
+    if task_queue.is_ready(task.project_id, redis_conn):
+        task_queue.push_task(task.project_id, task.id, task.priority_0,
+                             task.calibration, redis_conn)
+
+
+def push_tasks_to_task_queue(project_id, tasks):
+    """Push (task_id, priority, calibration) tuples to the queue of the
+    project, if the project uses it."""
+    redis_conn = sentinel.master
+    if task_queue.is_building(project_id, redis_conn):
+        task_queue.push_tasks(project_id, tasks, redis_conn, build=True)
+    if task_queue.is_ready(project_id, redis_conn):
+        task_queue.push_tasks(project_id, tasks, redis_conn)
+
+
+def remove_from_task_queue(project_id, task_ids):
+    task_queue.remove_tasks(project_id, task_ids, sentinel.master)
+
+
+def reset_task_queue(project_id):
+    task_queue.reset(project_id, sentinel.master)
+
+
 TASK_USERS_KEY_PREFIX = 'pybossa:project:task_requested:timestamps:{0}'
 USER_TASKS_KEY_PREFIX = 'pybossa:user:task_acquired:timestamps:{0}'
 TASK_ID_PROJECT_ID_KEY_PREFIX = 'pybossa:task_id:project_id:{0}'
@@ -408,18 +627,37 @@ def has_lock(task_id, user_id, timeout):
     return lock_manager.has_lock(task_users_key, user_id)
 
 
-def acquire_lock(task_id, user_id, limit, timeout, pipeline=None, execute=True):
-    redis_conn = sentinel.master
-    pipeline = pipeline or redis_conn.pipeline(transaction=True)
-    lock_manager = LockManager(redis_conn, timeout)
-    task_users_key = get_task_users_key(task_id)
-    user_tasks_key = get_user_tasks_key(user_id)
-    if lock_manager.acquire_lock(task_users_key, user_id, limit, pipeline=pipeline):
-        lock_manager.acquire_lock(user_tasks_key, task_id, float('inf'), pipeline=pipeline)
-        if execute:
-            return all(not isinstance(r, Exception) for r in pipeline.execute())
-        return True
-    return False
+def acquire_lock(task_id, user_id, limit, timeout):
+    return acquire_any_lock([(task_id, limit)], user_id, timeout) is not None
+
+
+def acquire_any_lock(candidates, user_id, timeout):
+    """Lock the first available task out of a list of candidates.
+
+    candidates is a list of (task_id, limit) tuples in order of preference.
+    All of them are tried in a single round-trip to Redis. Returns the id
+    of the locked task, or None if no candidate could be locked.
+    """
+    task_ids = acquire_locks(candidates, user_id, timeout, 1)
+    if task_ids:
+        return task_ids[0]
+    return None
+
+
+def acquire_locks(candidates, user_id, timeout, max_locks):
+    """Lock up to max_locks available tasks out of a list of candidates,
+    in a single round-trip to Redis. Returns the ids of the locked tasks.
+    """
+    lock_manager = LockManager(sentinel.master, timeout)
+    task_ids = [task_id for task_id, _ in candidates]
+    indexes = lock_manager.acquire_locks(
+        [get_task_users_key(task_id) for task_id in task_ids],
+        user_id,
+        [limit for _, limit in candidates],
+        max_locks,
+        owner_key=get_user_tasks_key(user_id),
+        owner_members=task_ids)
+    return [task_ids[index] for index in indexes]
 
 
 def release_lock(task_id, user_id, timeout, pipeline=None, execute=True):
@@ -471,23 +709,50 @@ def get_task_id_project_id_key(task_id):
 
 
 def get_task_id_and_duration_for_project_user(project_id, user_id):
+    held = get_task_ids_and_durations_for_project_user(project_id, user_id)
+    if held:
+        return held[0]
+    return None, -1
+
+
+def get_task_ids_and_durations_for_project_user(project_id, user_id):
+    """Return (task_id, seconds_remaining) of the locks held by the user on
+    tasks of the project, longest remaining lock first.
+    """
     user_tasks = get_user_tasks(user_id, TIMEOUT)
     user_task_ids = user_tasks.keys()
     results = get_task_ids_project_id(user_task_ids)
-    max_seconds_task_id = -1
-    max_seconds_remaining = float('-inf')
+    held = []
     for task_id, task_project_id in zip(user_task_ids, results):
         if not task_project_id:
             task_project_id = task_repo.get_task(task_id).project_id
             save_task_id_project_id(task_id, task_project_id, 2 * TIMEOUT)
         if int(task_project_id) == project_id:
             seconds_remaining = LockManager.seconds_remaining(user_tasks[task_id])
-            if seconds_remaining > max_seconds_remaining:
-                max_seconds_task_id = int(task_id)
-                max_seconds_remaining = seconds_remaining
-    if max_seconds_task_id > 0:
-        return max_seconds_task_id, max_seconds_remaining
-    return None, -1
+            held.append((int(task_id), seconds_remaining))
+    held.sort(key=lambda lock: lock[1], reverse=True)
+    return held
+
+
+def get_lock_expirations(task_ids, user_id):
+    """Return the seconds until the user's locks on the tasks expire, by
+    task id, with a single round-trip to Redis.
+    """
+    pipeline = sentinel.master.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipeline.hget(get_task_users_key(task_id), user_id)
+    return dict((task_id, LockManager.seconds_remaining(expiration))
+                for task_id, expiration in zip(task_ids, pipeline.execute())
+                if expiration is not None)
+
+
+def release_locks(task_ids, user_id, timeout):
+    """Release the user's locks on several tasks in a single round-trip."""
+    pipeline = sentinel.master.pipeline(transaction=True)
+    for task_id in task_ids:
+        release_lock(task_id, user_id, timeout, pipeline=pipeline,
+                     execute=False)
+    pipeline.execute()
 
 
 def release_user_locks(user_id):
@@ -532,6 +797,7 @@ def sched_variants():
             ('depth_first', 'Depth First'),
             (Schedulers.locked, 'Locked'),
             (Schedulers.user_pref, 'User Preference Scheduler'),
+            (Schedulers.queued, 'Task Queue Scheduler'),
             ('depth_first_all', 'Depth First All')
             ]
 
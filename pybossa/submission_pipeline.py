@@ -0,0 +1,190 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Deferred processing of the side effects of task run submissions.
+
+With TASK_RUN_DEFERRED_SIDE_EFFECTS enabled, submitting a task run only
+writes the task run and its counter row. The submission is then queued in
+a Redis list, and a background job processes the queue in order and in
+batches: user contribution feed, task completion, results, webhooks, gold
+stats and quizzes.
+
+Entries are only removed from the queue once their batch has been
+processed, and processing them again is harmless: tasks are completed and
+results created only if the last result does not include the task run
+yet, and gold stats and quizzes are updated at most once per task run.
+"""
+import json
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy.sql import text
+from pybossa.core import db, sentinel
+
+
+PENDING_KEY = 'pybossa:task_run:pending'
+SCHEDULED_KEY = 'pybossa:task_run:pending:scheduled'
+DONE_KEY = 'pybossa:task_run:done:{0}'
+DONE_TTL = 24 * 60 * 60
+
+
+def is_enabled():
+    return bool(current_app.config.get('TASK_RUN_DEFERRED_SIDE_EFFECTS'))
+
+
+def push(task_run, answer, conn=None):
+    """Queue the side effects of a saved task run.
+
+    :param answer: the info of the task run as submitted, which is needed
+        for gold stats and quizzes
+    """
+    conn = conn or sentinel.master
+    entry = dict(id=task_run.id, project_id=task_run.project_id,
+                 task_id=task_run.task_id, user_id=task_run.user_id,
+                 answer=answer)
+    conn.rpush(PENDING_KEY, json.dumps(entry))
+    _schedule(conn)
+
+
+def push_many(task_runs, answers, conn=None):
+    """Queue the side effects of several saved task runs at once."""
+    conn = conn or sentinel.master
+    values = [json.dumps(entry)
+              for entry in make_entries(task_runs, answers)]
+    conn.rpush(PENDING_KEY, *values)
+    _schedule(conn)
+
+
+def make_entries(task_runs, answers):
+    """Return the queue entries of saved task runs, with the answers they
+    were submitted with."""
+    return [dict(id=task_run.id, project_id=task_run.project_id,
+                 task_id=task_run.task_id, user_id=task_run.user_id,
+                 answer=answer)
+            for task_run, answer in zip(task_runs, answers)]
+
+
+def _schedule(conn):
+    # Only one processing job at a time. The key expires if its worker
+    # dies, so that the next submission enqueues a new job.
+    from pybossa.jobs import enqueue_job, process_task_run_submissions
+    timeout = current_app.config.get('TIMEOUT')
+    if conn.set(SCHEDULED_KEY, 1, nx=True, ex=timeout):
+        enqueue_job(dict(name=process_task_run_submissions, args=[],
+                         kwargs={}, timeout=timeout, queue='high'))
+
+
+def process_pending(conn=None):
+    """Process the queued submissions in batches of
+    TASK_RUN_SIDE_EFFECTS_BATCH_SIZE, until the queue is empty.
+
+    :return: The number of processed submissions
+    """
+    conn = conn or sentinel.master
+    batch_size = current_app.config.get('TASK_RUN_SIDE_EFFECTS_BATCH_SIZE',
+                                        100)
+    timeout = current_app.config.get('TIMEOUT')
+    processed = 0
+    while True:
+        entries = conn.lrange(PENDING_KEY, 0, batch_size - 1)
+        if not entries:
+            conn.delete(SCHEDULED_KEY)
+            # A submission may have been queued after the last read, and
+            # found the job still scheduled
+            if (not conn.llen(PENDING_KEY) or
+                    not conn.set(SCHEDULED_KEY, 1, nx=True, ex=timeout)):
+                return processed
+            continue
+        process_batch([json.loads(entry) for entry in entries], conn)
+        conn.ltrim(PENDING_KEY, len(entries), -1)
+        conn.expire(SCHEDULED_KEY, timeout)
+        processed += len(entries)
+
+
+def process_batch(entries, redis_conn):
+    """Process the side effects of a batch of submissions, in order."""
+    from pybossa.model.event_listeners import (add_user_contributed_to_feed,
+                                               get_project_event_info,
+                                               complete_task)
+    from pybossa.api.task_run import update_gold_stats, update_quiz
+
+    latest = OrderedDict()
+    for entry in entries:
+        latest.pop(entry['task_id'], None)
+        latest[entry['task_id']] = entry
+
+    with db.engine.begin() as conn:
+        projects = {}
+        for project_id in set(entry['project_id'] for entry in entries):
+            projects[project_id] = get_project_event_info(conn, project_id)
+        tasks = _get_tasks(conn, latest.keys())
+
+        for entry in entries:
+            project_public = projects[entry['project_id']][0]
+            add_user_contributed_to_feed(conn, entry['user_id'],
+                                         project_public)
+
+        for task_id, entry in latest.iteritems():
+            task = tasks.get(task_id)
+            if task is None:
+                continue
+            project_public, published, webhook = projects[entry['project_id']]
+            if task.calibration:
+                if task.exported and published:
+                    sql = text('UPDATE task SET exported=False WHERE id=:id')
+                    conn.execute(sql, dict(id=task_id))
+                continue
+            if (task.n_task_runs >= task.n_answers and
+                    not _in_last_result(conn, task_id, entry['id'])):
+                complete_task(conn, project_public, published, webhook,
+                              entry['project_id'], task_id)
+
+    for entry in entries:
+        done = redis_conn.set(DONE_KEY.format(entry['id']), 1, nx=True,
+                              ex=DONE_TTL)
+        if not done or entry['user_id'] is None:
+            continue
+        task = tasks.get(entry['task_id'])
+        if task is not None and task.calibration:
+            update_gold_stats(entry['user_id'], entry['task_id'],
+                              dict(info=entry['answer']))
+        update_quiz(entry['task_id'], entry['project_id'], entry['answer'],
+                    user_id=entry['user_id'])
+
+
+def _get_tasks(conn, task_ids):
+    sql = text('''
+               SELECT task.id, task.n_answers, task.calibration, task.exported,
+                      COUNT(task_run.id) AS n_task_runs
+                 FROM task
+                 LEFT JOIN task_run ON task_run.task_id = task.id
+                WHERE task.id = ANY(:task_ids)
+                GROUP BY task.id
+               ''')
+    rows = conn.execute(sql, dict(task_ids=list(task_ids)))
+    return {row.id: row for row in rows}
+
+
+def _in_last_result(conn, task_id, task_run_id):
+    sql = text('''
+               SELECT 1 FROM result
+                WHERE task_id = :task_id
+                  AND last_version = true
+                  AND :task_run_id = ANY(task_run_ids)
+               ''')
+    params = dict(task_id=task_id, task_run_id=task_run_id)
+    return conn.execute(sql, params).first() is not None
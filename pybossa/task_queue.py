@@ -0,0 +1,157 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Per project queues of assignable tasks, kept as Redis sorted sets.
+
+Regular and gold tasks are kept in separate sets. Tasks are scored by
+-priority_0 and members are zero padded task ids, so that reading a set
+in order returns tasks by priority_0 DESC, id ASC.
+
+A queue is rebuilt into separate build sets, under a lock so that a single
+rebuild of a project runs at a time, and swapped in once complete.
+"""
+
+TASK_QUEUE_KEY = 'pybossa:project:task_queue:{0}'
+GOLD_TASK_QUEUE_KEY = 'pybossa:project:gold_task_queue:{0}'
+TASK_QUEUE_READY_KEY = 'pybossa:project:task_queue_ready:{0}'
+TASK_QUEUE_BUILD_KEY = 'pybossa:project:task_queue_build:{0}'
+
+
+def get_task_queue_key(project_id, gold=False, build=False):
+    key = GOLD_TASK_QUEUE_KEY if gold else TASK_QUEUE_KEY
+    key = key.format(project_id)
+    return key + ':build' if build else key
+
+
+def get_task_queue_ready_key(project_id):
+    return TASK_QUEUE_READY_KEY.format(project_id)
+
+
+def get_task_queue_build_key(project_id):
+    return TASK_QUEUE_BUILD_KEY.format(project_id)
+
+
+def is_ready(project_id, conn):
+    """Return True if the queue of the project has been built."""
+    return bool(conn.exists(get_task_queue_ready_key(project_id)))
+
+
+def mark_ready(project_id, conn):
+    conn.set(get_task_queue_ready_key(project_id), 1)
+
+
+def is_building(project_id, conn):
+    """Return True if the queue of the project is being rebuilt."""
+    return bool(conn.exists(get_task_queue_build_key(project_id)))
+
+
+def start_build(project_id, conn, timeout):
+    """Take the build lock of the project queue for timeout seconds and
+    clear its build sets. Return False if another build holds the lock."""
+    if not conn.set(get_task_queue_build_key(project_id), 1, nx=True,
+                    ex=timeout):
+        return False
+    conn.delete(get_task_queue_key(project_id, build=True),
+                get_task_queue_key(project_id, gold=True, build=True))
+    return True
+
+
+def finish_build(project_id, conn):
+    """Swap the build sets of the project in as its queue, mark the queue
+    as ready and release the build lock, in a single transaction."""
+    pipeline = conn.pipeline(transaction=True)
+    for gold in (False, True):
+        # Unlike RENAME, ZUNIONSTORE also handles an empty (missing) set.
+        pipeline.zunionstore(get_task_queue_key(project_id, gold),
+                             [get_task_queue_key(project_id, gold, True)])
+    pipeline.delete(get_task_queue_key(project_id, build=True),
+                    get_task_queue_key(project_id, gold=True, build=True),
+                    get_task_queue_build_key(project_id))
+    pipeline.set(get_task_queue_ready_key(project_id), 1)
+    pipeline.execute()
+
+
+def abort_build(project_id, conn):
+    """Drop the build sets of the project and release the build lock."""
+    conn.delete(get_task_queue_key(project_id, build=True),
+                get_task_queue_key(project_id, gold=True, build=True),
+                get_task_queue_build_key(project_id))
+
+
+def push_task(project_id, task_id, priority, calibration, conn, build=False):
+    """Add a task to the queue of its project, or update its position."""
+    pipeline = conn.pipeline(transaction=True)
+    gold = bool(int(calibration or 0))
+    pipeline.zrem(get_task_queue_key(project_id, not gold, build),
+                  _member(task_id))
+    pipeline.zadd(get_task_queue_key(project_id, gold, build),
+                  {_member(task_id): -float(priority or 0)})
+    pipeline.execute()
+
+
+def push_tasks(project_id, tasks, conn, chunk_size=1000, build=False):
+    """Add (task_id, priority, calibration) tuples to the project queue."""
+    pipeline = conn.pipeline(transaction=False)
+    mapping = {True: {}, False: {}}
+    for task_id, priority, calibration in tasks:
+        mapping[bool(int(calibration or 0))][_member(task_id)] = -float(priority or 0)
+        if sum(len(m) for m in mapping.values()) >= chunk_size:
+            _queue_zadd(project_id, mapping, pipeline, build)
+            pipeline.execute()
+    _queue_zadd(project_id, mapping, pipeline, build)
+    pipeline.execute()
+
+
+def remove_tasks(project_id, task_ids, conn):
+    """Remove tasks from the queues of the project, and from the queues
+    being built for it."""
+    if not task_ids:
+        return
+    members = [_member(task_id) for task_id in task_ids]
+    pipeline = conn.pipeline(transaction=True)
+    for gold in (False, True):
+        for build in (False, True):
+            pipeline.zrem(get_task_queue_key(project_id, gold, build),
+                          *members)
+    pipeline.execute()
+
+
+def get_task_ids(project_id, start, count, conn, gold=False):
+    """Return count task ids from the project queue, starting at start."""
+    key = get_task_queue_key(project_id, gold)
+    return [int(member) for member in
+            conn.zrange(key, start, start + count - 1)]
+
+
+def reset(project_id, conn):
+    """Drop the queues of the project. They are rebuilt on next use."""
+    conn.delete(get_task_queue_ready_key(project_id),
+                get_task_queue_key(project_id),
+                get_task_queue_key(project_id, gold=True))
+
+
+def _queue_zadd(project_id, mapping, pipeline, build):
+    for gold, members in mapping.items():
+        if members:
+            pipeline.zadd(get_task_queue_key(project_id, gold, build),
+                          members)
+            members.clear()
+
+
+def _member(task_id):
+    return '{0:012d}'.format(int(task_id))
@@ -15,12 +15,16 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
-"""Healthcheck for PYBOSSA."""
+"""Healthcheck and diagnostics for PYBOSSA."""
 import json
 
 from flask import Blueprint, Response, current_app
+from flask_login import login_required
 
 from pybossa.core import sentinel, db, talisman
+from pybossa.util import admin_required
+from pybossa import instrumentation
+from pybossa.cache import get_cache_stats
 
 
 blueprint = Blueprint('diagnostics', __name__)
@@ -72,3 +76,15 @@ def healthcheck():
     status = 200 if healthy else 500
     return Response(json.dumps(response), status=status,
                     mimetype='application/json')
+
+
+@blueprint.route('/instrumentation')
+@login_required
+@admin_required
+def instrumentation_stats():
+    """Return the SQL and Redis stats of each endpoint, and the cache
+    stats, of the process serving the request."""
+    response = instrumentation.get_stats()
+    response['enabled'] = instrumentation.is_enabled()
+    response['cache'] = get_cache_stats()
+    return Response(json.dumps(response), mimetype='application/json')
@@ -87,6 +87,7 @@ from pybossa.error import ErrorStatus
 from pybossa.syncer import NotEnabled, SyncUnauthorized
 from pybossa.syncer.project_syncer import ProjectSyncer
 from pybossa.exporter.csv_reports_export import ProjectReportCsvExporter
+from pybossa.exporter.parquet_export import parquet_available
 from datetime import datetime
 from pybossa.data_access import (data_access_levels, ensure_data_access_assignment_to_form,
     ensure_data_access_assignment_from_form, subadmins_are_privileged)
@@ -1266,8 +1267,13 @@ def tasks_browse(short_name, page=1, records_per_page=10):
         offset = (page - 1) * per_page
         args["records_per_page"] = per_page
         args["offset"] = offset
+        disp_info_columns = args.get('display_info_columns', [])
+        disp_info_columns = [col for col in disp_info_columns if col in columns]
+        if 'display_info_columns' in args:
+            args['display_info_columns'] = disp_info_columns
         start_time = time.time()
-        total_count, page_tasks = cached_projects.browse_tasks(project.get('id'), args)
+        browse_page = cached_projects.browse_tasks_page(project.get('id'), args)
+        total_count, page_tasks = browse_page['total_count'], browse_page['tasks']
         current_app.logger.debug("Browse Tasks data loading took %s seconds"
                                  % (time.time()-start_time))
         first_task_id = cached_projects.first_task_id(project.get('id'))
@@ -1278,9 +1284,6 @@ def tasks_browse(short_name, page=1, records_per_page=10):
                                                                     current_user,
                                                                     ps)
 
-        disp_info_columns = args.get('display_info_columns', [])
-        disp_info_columns = [col for col in disp_info_columns if col in columns]
-
         args["changed"] = False
         if args.get("pcomplete_from"):
             args["pcomplete_from"] = args["pcomplete_from"] * 100
@@ -1289,13 +1292,8 @@ def tasks_browse(short_name, page=1, records_per_page=10):
         args["order_by"] = args.pop("order_by_dict", dict())
         args.pop("records_per_page", None)
         args.pop("offset", None)
-
-        if disp_info_columns:
-            for task in page_tasks:
-                task_info = task_repo.get_task(task['id']).info
-                task['info'] = {}
-                for col in disp_info_columns:
-                    task['info'][col] = task_info.get(col, '')
+        args.pop("order_by_fields", None)
+        args.pop("after", None)
 
         valid_user_preferences = app_settings.upref_mdata.get_valid_user_preferences() \
             if app_settings.upref_mdata else {}
@@ -1308,6 +1306,8 @@ def tasks_browse(short_name, page=1, records_per_page=10):
                     tasks=page_tasks,
                     title=title,
                     pagination=pagination,
+                    next_cursor=browse_page['next_cursor'],
+                    approximate_count=browse_page['approximate'],
                     n_tasks=ps.n_tasks,
                     overall_progress=ps.overall_progress,
                     n_volunteers=ps.n_volunteers,
@@ -1334,8 +1334,11 @@ def tasks_browse(short_name, page=1, records_per_page=10):
         else:
             metadata = False
 
+        download_formats = ['csv', 'json']
+        if parquet_available():
+            download_formats.append('parquet')
         if download_obj not in ('task', 'task_run', 'consensus') or \
-           download_format not in ('csv', 'json'):
+           download_format not in download_formats:
             flash(gettext('Invalid download type. Please try again.'), 'error')
             return respond()
         try:
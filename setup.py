@@ -82,6 +82,10 @@ setup(
     version = '2.11.0',
     packages = find_packages(),
     install_requires = requirements,
+    extras_require = {
+        # Parquet exports
+        'parquet': ['pyarrow>=0.13.0, <0.17.0']
+    },
     # only needed when installing directly from setup.py (PyPi, eggs?) and pointing to e.g. a git repo.
     # Keep in mind that dependency_links are not used when installing with requirements.txt
     # and need to be added redundant to requirements.txt in this case!
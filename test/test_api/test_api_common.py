@@ -469,3 +469,31 @@ class TestApiCommon(TestAPI):
             assert not "Sign in" in res.data, err_msg
             assert "Statistics" in res.data
             assert "100% completed" in res.data
+
+    @with_context
+    def test_stream_query(self):
+        """Test API GET stream returns newline delimited JSON with keyset
+        continuation and field projection"""
+        owner = UserFactory.create()
+        project = ProjectFactory.create(owner=owner)
+        task = TaskFactory.create(project=project, n_answers=10)
+        task_runs = TaskRunFactory.create_batch(5, task=task)
+        url = ('/api/taskrun?stream=1&all=1&project_id=%s&api_key=%s'
+               % (project.id, owner.api_key))
+
+        res = self.app.get(url + '&limit=3')
+        lines = [json.loads(line) for line in res.data.splitlines()]
+        assert res.mimetype == 'application/x-ndjson', res.mimetype
+        assert [line['id'] for line in lines] == [tr.id for tr in task_runs[:3]]
+        assert 'link' in lines[0], lines[0]
+
+        res = self.app.get(url + '&last_id=%s&fields=id,task_id&hateoas=0'
+                           % lines[-1]['id'])
+        lines = [json.loads(line) for line in res.data.splitlines()]
+        assert lines == [dict(id=tr.id, task_id=task.id)
+                         for tr in task_runs[3:]], lines
+
+        res = self.app.get(url + '&fields=wrongfield')
+        err = json.loads(res.data)
+        assert err['status'] == 'failed', err
+        assert err['exception_cls'] == 'AttributeError', err
@@ -1180,3 +1180,27 @@ class TestTaskAPI(TestAPI):
         url = tasks.upload_gold_data(task, 1, {'ans1': 'test'})
         assert url == 'testURL', url
 
+
+    @with_context
+    def test_task_query_related_page(self):
+        """Test API Task query with related loads the related objects of
+        every task of the page with one query per kind"""
+        user = UserFactory.create()
+        project = ProjectFactory.create(owner=user)
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=5)
+        for n_task_runs, task in enumerate(tasks):
+            TaskRunFactory.create_batch(n_task_runs, project=project,
+                                        task=task)
+        url = '/api/task?project_id=%s&related=True&all=1&api_key=%s'
+
+        with patch.object(task_repo.__class__, 'filter_task_runs_by') as tr, \
+                patch.object(result_repo.__class__, 'filter_by') as results:
+            res = self.app.get(url % (project.id, user.api_key))
+            assert not tr.called and not results.called
+        data = json.loads(res.data)
+
+        assert [len(task['task_runs']) for task in data] == [0, 1, 2], data
+        for task in data:
+            assert task['result'] is None, task
+            for task_run in task['task_runs']:
+                assert task_run['task_id'] == task['id'], task
@@ -1174,3 +1174,120 @@ class TestTaskrunAPI(TestAPI):
 
         assert result is None, result
         # assert result is not None, result
+        assert task_repo.get_task(task.id).state == 'completed'
+
+    @with_context
+    @patch('pybossa.api.task_run.ContributionsGuard')
+    def test_taskrun_bulk_post(self, guard):
+        """Test API TaskRun bulk creation reports the outcome of each item"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project, n_answers=1)
+        guard.return_value.retrieve_timestamps.return_value = dict(
+            (task.id, ('a while ago', None)) for task in tasks)
+        url = '/api/taskrun/bulk?api_key=%s' % project.owner.api_key
+        data = [dict(project_id=project.id, task_id=task.id, info='answer')
+                for task in tasks]
+        data.append(dict(project_id=project.id, task_id=tasks[0].id,
+                         info='again'))
+        data.append(dict(project_id=project.id + 1, task_id=tasks[1].id,
+                         info='wrong project'))
+        data.append(dict(project_id=project.id, info='no task'))
+
+        res = self.app.post(url, data=json.dumps(data))
+        results = json.loads(res.data)
+
+        assert res.status_code == 200, res.data
+        assert [r['status'] for r in results] == ['ok', 'ok', 'failed',
+                                                  'failed', 'failed'], results
+        assert results[2]['status_code'] == 403, results
+        assert results[3]['exception_msg'] == 'Invalid project_id', results
+        assert results[4]['status_code'] == 400, results
+        task_runs = task_repo.filter_task_runs_by(project_id=project.id)
+        assert sorted(tr.id for tr in task_runs) == sorted(
+            r['id'] for r in results[:2]), task_runs
+        for task in tasks:
+            assert task_repo.get_task(task.id).state == 'completed'
+
+    @with_context
+    @patch('pybossa.api.task_run.ContributionsGuard')
+    def test_taskrun_bulk_post_authorizes_each_task_run(self, guard):
+        """Test API TaskRun bulk creation rejects task runs for tasks the
+        user has already answered"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project, n_answers=2)
+        TaskRunFactory.create(task=tasks[0], user=project.owner)
+        guard.return_value.retrieve_timestamps.return_value = dict(
+            (task.id, ('a while ago', None)) for task in tasks)
+        url = '/api/taskrun/bulk?api_key=%s' % project.owner.api_key
+        data = [dict(project_id=project.id, task_id=task.id, info='answer')
+                for task in tasks]
+
+        res = self.app.post(url, data=json.dumps(data))
+        results = json.loads(res.data)
+
+        assert [r['status'] for r in results] == ['failed', 'ok'], results
+        assert results[0]['status_code'] == 403, results
+        assert task_repo.count_task_runs_with(project_id=project.id) == 2
+
+    @with_context
+    @patch('pybossa.api.task_run.ContributionsGuard')
+    def test_taskrun_bulk_post_conflict(self, guard):
+        """Test API TaskRun bulk creation only fails the task runs that
+        conflict on insert"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project)
+        guard.return_value.retrieve_timestamps.return_value = dict(
+            (task.id, ('a while ago', None)) for task in tasks)
+        url = '/api/taskrun/bulk?api_key=%s' % project.owner.api_key
+        data = [dict(project_id=project.id, task_id=task.id, info='answer')
+                for task in tasks]
+        insert_task_runs = task_repo.insert_task_runs
+
+        def replayed(task_runs):
+            # As if the first one was submitted meanwhile
+            inserted = insert_task_runs(task_runs[1:])
+            task_runs[0].id = None
+            return inserted
+
+        with patch.object(task_repo, 'insert_task_runs', side_effect=replayed):
+            res = self.app.post(url, data=json.dumps(data))
+        results = json.loads(res.data)
+
+        assert [r['status'] for r in results] == ['failed', 'ok'], results
+        assert results[0]['status_code'] == 403, results
+        assert task_repo.count_task_runs_with(project_id=project.id) == 1
+
+    @with_context
+    @patch('pybossa.api.task_run.ContributionsGuard')
+    def test_taskrun_bulk_post_requires_newtask_first(self, guard):
+        """Test API TaskRun bulk creation fails for tasks not requested"""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        guard.return_value.retrieve_timestamps.return_value = {
+            task.id: (None, None)}
+        url = '/api/taskrun/bulk?api_key=%s' % project.owner.api_key
+        data = [dict(project_id=project.id, task_id=task.id, info='answer')]
+
+        res = self.app.post(url, data=json.dumps(data))
+        results = json.loads(res.data)
+
+        assert results[0]['status'] == 'failed', results
+        assert results[0]['exception_msg'] == 'You must request a task first!'
+        assert task_repo.count_task_runs_with(project_id=project.id) == 0
+
+    @with_context
+    def test_taskrun_bulk_post_errors(self):
+        """Test API TaskRun bulk creation rejects anonymous users and
+        payloads that are not lists"""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        data = [dict(project_id=project.id, task_id=task.id, info='answer')]
+
+        res = self.app.post('/api/taskrun/bulk', data=json.dumps(data))
+        assert res.status_code == 403, res.status_code
+
+        url = '/api/taskrun/bulk?api_key=%s' % project.owner.api_key
+        res = self.app.post(url, data=json.dumps(data[0]))
+        err = json.loads(res.data)
+        assert res.status_code == 400, res.status_code
+        assert err['target'] == 'taskrun', err
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 import json
+import time
 from StringIO import StringIO
 from default import with_context
 from test_api import TestAPI
@@ -189,6 +190,112 @@ class TestTaskrunWithFile(TestAPI):
             assert success.status_code == 400, success.data
             set_content.assert_not_called()
 
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
+    def test_taskrun_several_uploads(self, set_content):
+        with patch.dict(self.flask_app.config, self.patch_config):
+            project = ProjectFactory.create()
+            task = TaskFactory.create(project=project)
+            self.app.get('/api/project/%s/newtask?api_key=%s' % (project.id, project.owner.api_key))
+
+            data = dict(
+                project_id=project.id,
+                task_id=task.id,
+                info={
+                    'one__upload_url': {
+                        'filename': 'one.txt',
+                        'content': 'abc'
+                    },
+                    'field': 'value'
+                })
+            form = {
+                'request_json': json.dumps(data),
+                'two__upload_url': (StringIO('Hi there'), 'two.txt'),
+                'three__upload_url': (StringIO('Hello'), 'three.txt')
+            }
+
+            url = '/api/taskrun?api_key=%s' % project.owner.api_key
+            success = self.app.post(url, content_type='multipart/form-data',
+                                    data=form)
+
+            assert success.status_code == 200, success.data
+            assert set_content.call_count == 3, set_content.call_count
+            res = json.loads(success.data)
+            assert res['info']['field'] == 'value'
+            for name in ['one', 'two', 'three']:
+                args = {
+                    'host': self.host,
+                    'bucket': self.bucket,
+                    'project_id': project.id,
+                    'task_id': task.id,
+                    'user_id': project.owner.id,
+                    'filename': name + '.txt'
+                }
+                expected = 'https://{host}/{bucket}/{project_id}/{task_id}/{user_id}/{filename}'.format(**args)
+                url = res['info'][name + '__upload_url']
+                assert url == expected, url
+
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.boto.s3.bucket.Bucket.delete_key')
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
+    def test_taskrun_upload_error(self, set_content, delete_key):
+        def upload(fp, **kwargs):
+            if fp.read() == 'bad':
+                raise IOError('upload failed')
+        set_content.side_effect = upload
+        with patch.dict(self.flask_app.config, self.patch_config):
+            project = ProjectFactory.create()
+            task = TaskFactory.create(project=project)
+            self.app.get('/api/project/%s/newtask?api_key=%s' % (project.id, project.owner.api_key))
+
+            data = dict(
+                project_id=project.id,
+                task_id=task.id,
+                info={
+                    'good__upload_url': {
+                        'filename': 'good.txt',
+                        'content': 'good'
+                    }
+                })
+            form = {
+                'request_json': json.dumps(data),
+                'bad__upload_url': (StringIO('bad'), 'bad.txt')
+            }
+
+            url = '/api/taskrun?api_key=%s' % project.owner.api_key
+            res = self.app.post(url, content_type='multipart/form-data',
+                                data=form)
+
+            assert res.status_code != 200, res.data
+            assert db.session.query(TaskRun).count() == 0
+            key_name = '{0}/{1}/{2}/good.txt'.format(
+                project.id, task.id, project.owner.id)
+            delete_key.assert_called_once_with(key_name, headers={},
+                                               version_id=None)
+
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
+    def test_taskrun_upload_timeout(self, set_content):
+        set_content.side_effect = lambda fp, **kwargs: time.sleep(0.3)
+        config = dict(self.patch_config, TASK_RUN_UPLOAD_TIMEOUT=0.5)
+        with patch.dict(self.flask_app.config, config):
+            project = ProjectFactory.create()
+            task = TaskFactory.create(project=project)
+            self.app.get('/api/project/%s/newtask?api_key=%s' % (project.id, project.owner.api_key))
+
+            data = dict(project_id=project.id, task_id=task.id, info={})
+            form = {'request_json': json.dumps(data)}
+            for name in 'abcdefgh':
+                form[name + '__upload_url'] = (StringIO(name), name + '.txt')
+
+            url = '/api/taskrun?api_key=%s' % project.owner.api_key
+            res = self.app.post(url, content_type='multipart/form-data',
+                                data=form)
+
+            # Each upload fits in the timeout, but not the two rounds of them
+            assert res.status_code == 504, res.data
+            assert db.session.query(TaskRun).count() == 0
+
 
 
 class TestTaskrunWithSensitiveFile(TestAPI):
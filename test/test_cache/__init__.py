@@ -16,12 +16,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import hashlib
 from mock import patch
 from pybossa.cache import (get_key_to_hash, get_hash_key, cache, memoize,
                            delete_cached, delete_memoized, memoize_essentials,
                            delete_memoized_essential, delete_cache_group,
-                           get_cache_group_key)
+                           get_cache_group_key, LocalCache, local_cache,
+                           get_cache_stats, reset_cache_stats,
+                           local_cache_enabled, _on_invalidation)
 from pybossa.sentinel import Sentinel
 import settings_test
 
@@ -436,3 +439,131 @@ class TestCacheMemoizeFunctions(object):
             return None
         my_func('a')
         assert len(test_sentinel.master.keys()) == 1
+
+
+class TestLocalCache(object):
+
+    def test_get_set(self):
+        """Test LocalCache returns the values set."""
+        lru = LocalCache(size=10)
+        lru.set('a', 1, 60)
+
+        assert lru.get('a') == (True, 1)
+        assert lru.get('b') == (False, None)
+
+    def test_expired(self):
+        """Test LocalCache does not return expired values."""
+        lru = LocalCache(size=10)
+        lru.set('a', 1, -1)
+
+        assert lru.get('a') == (False, None)
+
+    def test_evicts_least_recently_used(self):
+        """Test LocalCache evicts the least recently used values."""
+        lru = LocalCache(size=2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+
+        assert lru.get('a') == (True, 1)
+        assert lru.get('b') == (False, None)
+        assert lru.get('c') == (True, 3)
+
+    def test_delete_keys_and_prefix(self):
+        """Test LocalCache deletes keys and keys starting with a prefix."""
+        lru = LocalCache(size=10)
+        for key in ('p:1', 'p:2', 'q:1'):
+            lru.set(key, 1, 60)
+
+        lru.delete(keys=['q:1'], prefix='p:')
+
+        assert all(lru.get(key) == (False, None)
+                   for key in ('p:1', 'p:2', 'q:1'))
+
+
+class TestLocalCacheSettings(object):
+
+    def test_local_cache_follows_app_config(self):
+        """Test the local tier settings are read from the app config."""
+        from default import flask_app
+        with flask_app.app_context():
+            with patch.dict(flask_app.config, {'CACHE_LOCAL_ENABLED': True}):
+                assert local_cache_enabled()
+            with patch.dict(flask_app.config, {'CACHE_LOCAL_ENABLED': False}):
+                assert not local_cache_enabled()
+
+
+@patch('pybossa.cache.sentinel', new=test_sentinel)
+@patch('pybossa.cache.local_cache_enabled', return_value=True)
+class TestLocalCacheTier(object):
+
+    @classmethod
+    def setup_class(cls):
+        import os
+        cls.cache = os.environ.pop('PYBOSSA_REDIS_CACHE_DISABLED', None)
+
+    @classmethod
+    def teardown_class(cls):
+        if cls.cache:
+            import os
+            os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = cls.cache
+
+    def setUp(self):
+        test_sentinel.master.flushall()
+        local_cache.clear()
+        reset_cache_stats()
+
+    def test_memoize_local_hit(self, enabled):
+        """Test memoize reads hot keys from the local tier."""
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+
+        my_func('a')
+        test_sentinel.master.flushall()
+
+        assert my_func('a') == 1
+        stats = get_cache_stats()
+        assert stats['local'] == dict(hits=1, misses=1), stats
+        assert stats['redis'] == dict(hits=0, misses=1), stats
+
+    def test_delete_memoized_invalidates_local(self, enabled):
+        """Test delete_memoized removes values from the local tier."""
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+
+        my_func('a')
+        my_func('b')
+        delete_memoized(my_func, 'a')
+        assert my_func('a') == 3
+        assert my_func('b') == 2
+
+        delete_memoized(my_func)
+        assert my_func('b') == 4
+
+    def test_delete_cache_group_invalidates_local(self, enabled):
+        """Test delete_cache_group removes values from the local tier."""
+        @memoize(cache_group_keys=[[0]])
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+
+        my_func('a')
+        delete_cache_group('a')
+
+        assert my_func('a') == 2
+
+    def test_invalidation_message(self, enabled):
+        """Test invalidation messages from other processes are applied."""
+        local_cache.set('k1', 1, 60)
+        local_cache.set('p:k2', 1, 60)
+
+        _on_invalidation(dict(data=json.dumps(dict(keys=['k1'],
+                                                   prefix='p:'))))
+
+        assert local_cache.get('k1') == (False, None)
+        assert local_cache.get('p:k2') == (False, None)
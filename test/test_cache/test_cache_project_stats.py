@@ -16,7 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from default import Test, with_context
+from mock import patch
+from default import Test, with_context, flask_app
 from pybossa.cache.project_stats import *
 from factories import UserFactory, ProjectFactory, TaskFactory, \
     TaskRunFactory, AnonymousTaskRunFactory
@@ -146,3 +147,44 @@ class TestProjectsStatsCache(Test):
         assert max_hours == 1
         assert max_hours_anon is None
         assert max_hours_auth == 1
+
+    @with_context
+    def test_compute_stats(self):
+        """Test CACHE PROJECT STATS compute_stats matches the per stat
+        queries."""
+        pr = ProjectFactory.create()
+        task = TaskFactory.create(project=pr, n_answers=1)
+        TaskFactory.create(project=pr)
+        TaskRunFactory.create(project=pr, task=task)
+        AnonymousTaskRunFactory.create(project=pr)
+        d = date.today() - timedelta(days=16)
+        AnonymousTaskRunFactory.create(project=pr, created=d, finish_time=d)
+
+        stats = compute_stats(pr.id)
+
+        assert stats['n_task_runs'] == 3, stats['n_task_runs']
+        assert stats['n_volunteers'] == 2, stats['n_volunteers']
+        assert stats['users'] == stats_users(pr.id), stats['users']
+        assert stats['dates'] == stats_dates(pr.id), stats['dates']
+        assert stats['hours'] == stats_hours(pr.id), stats['hours']
+
+    @with_context
+    @patch.dict(flask_app.config, {'PROJECT_STATS_INCREMENTAL': True})
+    def test_compute_stats_incremental(self):
+        """Test CACHE PROJECT STATS compute_stats only reads new task runs,
+        and starts again when task runs were deleted."""
+        pr = ProjectFactory.create()
+        task_run = TaskRunFactory.create(project=pr)
+        assert compute_stats(pr.id)['n_task_runs'] == 1
+
+        state = json.loads(sentinel.master.get(STATS_STATE_KEY.format(pr.id)))
+        assert state['watermark'] == task_run.id, state
+
+        TaskRunFactory.create(project=pr)
+        assert compute_stats(pr.id)['n_task_runs'] == 2
+
+        db.session.delete(task_run)
+        db.session.commit()
+        stats = compute_stats(pr.id)
+        assert stats['n_task_runs'] == 1, stats['n_task_runs']
+        assert stats['users'] == stats_users(pr.id), stats['users']
@@ -16,13 +16,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from default import Test, with_context
+from default import Test, with_context, flask_app
 from pybossa.cache import projects as cached_projects
 from factories import UserFactory, ProjectFactory, TaskFactory, \
     TaskRunFactory, AnonymousTaskRunFactory
 from mock import patch
 import datetime
-from pybossa.core import result_repo
+from pybossa.core import result_repo, task_repo
+from pybossa.model.task_aggregate import TaskAggregate
 from pybossa.model.project import Project
 from pybossa.cache.project_stats import update_stats
 from nose.tools import nottest, assert_raises
@@ -743,6 +744,26 @@ class TestProjectsCache(Test):
         args = dict(task_id=12345, gold_task='7')
         assert_raises(ValueError, parse_tasks_browse_args, args)
 
+    @with_context
+    def test_browse_tasks_info_columns(self):
+        """Test CACHE PROJECTS browse_tasks returns the requested info columns
+        of the tasks in the same query"""
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project, info=dict(a='x', b=1, c='z'))
+        TaskFactory.create(project=project, info=dict(a='y'))
+        args = dict(display_info_columns=['a', 'b'])
+
+        with patch.object(cached_projects.session, 'execute',
+                          wraps=cached_projects.session.execute) as execute:
+            count, cached_tasks = cached_projects.browse_tasks(project.id,
+                                                               args)
+            n_queries = execute.call_count
+
+        infos = [task['info'] for task in cached_tasks]
+        assert infos == [dict(a='x', b=1), dict(a='y', b='')], infos
+        # One query for the count and one for the page
+        assert n_queries == 2, n_queries
+
     @with_context
     def test_browse_completed(self):
         project = ProjectFactory.create()
@@ -755,3 +776,92 @@ class TestProjectsCache(Test):
 
         assert count == 1
         assert cached_tasks[0]['id'] == task.id
+
+    def _browse_all_pages(self, project_id, order_by, per_page):
+        args = parse_tasks_browse_args(dict(order_by=order_by))
+        args['records_per_page'] = per_page
+        ids = []
+        while True:
+            page = cached_projects.browse_tasks_page(project_id, args)
+            ids.extend(task['id'] for task in page['tasks'])
+            if not page['next_cursor']:
+                return ids
+            args = parse_tasks_browse_args(dict(order_by=order_by,
+                                                after=page['next_cursor']))
+            args['records_per_page'] = per_page
+
+    @with_context
+    def test_browse_tasks_keyset_pages(self):
+        """Test CACHE PROJECTS browse_tasks_page pages through all the tasks
+        following the cursors"""
+        project = ProjectFactory.create()
+        tasks = [TaskFactory.create(project=project, priority_0=priority)
+                 for priority in [0.5, 0.1, 0.5, 0.9, 0.1]]
+        expected = [task.id for task in
+                    sorted(tasks, key=lambda t: (-t.priority_0, t.id))]
+
+        ids = self._browse_all_pages(project.id, 'priority desc', 2)
+
+        assert ids == expected, ids
+
+    @with_context
+    def test_browse_tasks_keyset_pages_mixed_order(self):
+        """Test CACHE PROJECTS browse_tasks_page pages through all the tasks
+        sorted in mixed directions"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(5, project=project, n_answers=2)
+        TaskRunFactory.create(task=tasks[1])
+        TaskRunFactory.create(task=tasks[3])
+        expected = [tasks[4].id, tasks[2].id, tasks[0].id,
+                    tasks[3].id, tasks[1].id]
+
+        ids = self._browse_all_pages(project.id,
+                                     'pcomplete asc,task_id desc', 2)
+
+        assert ids == expected, ids
+
+    def test_parse_tasks_browse_args_invalid_cursor(self):
+        """Test parse_tasks_browse_args rejects invalid cursors"""
+        args = dict(order_by='priority desc', after='not a cursor')
+        assert_raises(ValueError, parse_tasks_browse_args, args)
+
+        args = dict(order_by='priority desc', after='WzFd')
+        assert_raises(ValueError, parse_tasks_browse_args, args)
+
+    @with_context
+    def test_browse_tasks_approximate_count(self):
+        """Test CACHE PROJECTS browse_tasks_page estimates filtered counts
+        of large projects"""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(3, project=project, priority_0=0.5)
+        args = dict(priority_from=0.2)
+
+        page = cached_projects.browse_tasks_page(project.id, args)
+        assert page['total_count'] == 3, page
+        assert page['approximate'] is False, page
+
+        with patch.dict(flask_app.config,
+                        {'BROWSE_TASKS_EXACT_COUNT_LIMIT': 2}):
+            page = cached_projects.browse_tasks_page(project.id, args)
+        assert page['approximate'] is True, page
+        assert len(page['tasks']) == 3, page
+
+    @with_context
+    def test_task_aggregate_follows_task_runs(self):
+        """Test task_aggregate keeps the count and last finish time of the
+        task runs of a task"""
+        task = TaskFactory.create(n_answers=3)
+        first, last = TaskRunFactory.create_batch(2, task=task)
+
+        aggregate = TaskAggregate.query.get(task.id)
+        assert aggregate.n_task_runs == 2, aggregate.n_task_runs
+        assert aggregate.last_finish_time == max(first.finish_time,
+                                                 last.finish_time)
+
+        task_repo.delete(last)
+
+        aggregate = TaskAggregate.query.get(task.id)
+        assert aggregate.n_task_runs == 1, aggregate.n_task_runs
+        assert aggregate.last_finish_time == first.finish_time
+        count, cached_tasks = cached_projects.browse_tasks(task.project_id, {})
+        assert cached_tasks[0]['n_task_runs'] == 1, cached_tasks
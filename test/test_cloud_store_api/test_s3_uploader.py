@@ -20,6 +20,7 @@ from StringIO import StringIO
 from mock import patch, Mock, MagicMock
 import boto
 from default import Test, with_context
+from pybossa.cloud_store_api import s3
 from pybossa.cloud_store_api.s3 import *
 from pybossa.cloud_store_api.connection import ProxiedKey
 from pybossa.encryption import AESWithGCM
@@ -60,12 +61,75 @@ class TestS3Uploader(Test):
             url = s3_upload_from_string('bucket', u'hello world', 'test.txt')
             assert url == 'https://s3.storage.com/bucket/test.txt', url
 
+    def test_check_buffer_type(self):
+        check_buffer_type('hello world')
+        assert_raises(BadRequest, check_buffer_type, open('run.py').read())
+
     @with_context
-    @patch('pybossa.cloud_store_api.s3.io.open')
-    def test_upload_from_string_exception(self, open):
-        open.side_effect = IOError
-        assert_raises(IOError, s3_upload_from_string,
-                      'bucket', u'hellow world', 'test.txt')
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
+    def test_upload_from_string_invalid_type(self, set_contents):
+        with patch.dict(self.flask_app.config, self.default_config):
+            assert_raises(BadRequest, s3_upload_from_string, 'bucket',
+                          open('run.py').read(), 'test.txt')
+            set_contents.assert_not_called()
+
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
+    def test_upload_from_string_encrypted(self, set_contents):
+        config = self.default_config.copy()
+        config['FILE_ENCRYPTION_KEY'] = 'abcd'
+        uploaded = []
+        set_contents.side_effect = lambda fp, **kwargs: uploaded.append(fp.read())
+        with patch.dict(self.flask_app.config, config):
+            s3_upload_from_string('bucket', u'hello w\xf6rld', 'test.txt',
+                                  with_encryption=True)
+        cipher = AESWithGCM('abcd')
+        assert cipher.decrypt(uploaded[0]) == u'hello w\xf6rld'.encode('utf8')
+
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.create_connection')
+    def test_connection_is_reused(self, create_connection):
+        s3._connections.pool = {}
+        with patch.dict(self.flask_app.config, self.default_config):
+            conn = get_connection()
+            assert get_connection() is conn
+            create_connection.assert_called_once_with(
+                **self.default_config['S3_DEFAULT'])
+        config = {'S3_DEFAULT': {'host': 's3.other.com'}}
+        with patch.dict(self.flask_app.config, config):
+            get_connection()
+            create_connection.assert_called_with(host='s3.other.com')
+
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
+    @patch('pybossa.cloud_store_api.s3.boto.s3.bucket.Bucket.initiate_multipart_upload')
+    def test_upload_multipart(self, initiate, set_contents):
+        config = self.default_config.copy()
+        config['S3_MULTIPART_THRESHOLD'] = 10
+        config['S3_MULTIPART_CHUNK_SIZE'] = 4
+        parts = []
+        upload = initiate.return_value
+        upload.upload_part_from_file.side_effect = \
+            lambda fp, part_num, size: parts.append((part_num, fp.read(size)))
+        with patch.dict(self.flask_app.config, config):
+            url = s3_upload_from_string('bucket', u'hello world', 'test.txt')
+        assert url == 'https://s3.storage.com/bucket/test.txt', url
+        assert parts == [(1, 'hell'), (2, 'o wo'), (3, 'rld')], parts
+        upload.complete_upload.assert_called_once_with()
+        set_contents.assert_not_called()
+
+    @with_context
+    @patch('pybossa.cloud_store_api.s3.boto.s3.bucket.Bucket.initiate_multipart_upload')
+    def test_upload_multipart_failure(self, initiate):
+        config = self.default_config.copy()
+        config['S3_MULTIPART_THRESHOLD'] = 10
+        upload = initiate.return_value
+        upload.upload_part_from_file.side_effect = IOError
+        with patch.dict(self.flask_app.config, config):
+            assert_raises(IOError, s3_upload_from_string,
+                          'bucket', u'hello world', 'test.txt')
+        upload.cancel_upload.assert_called_once_with()
+        upload.complete_upload.assert_not_called()
 
     @with_context
     @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.set_contents_from_file')
@@ -112,12 +176,13 @@ class TestS3Uploader(Test):
             logger.assert_called()
 
     @with_context
-    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.get_contents_as_string')
+    @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.get_contents_to_file')
     def test_get_file_from_s3(self, get_contents):
-        get_contents.return_value = 'abcd'
+        get_contents.side_effect = lambda fp: fp.write('abcd')
         with patch.dict(self.flask_app.config, self.default_config):
-            get_file_from_s3('test_bucket', '/the/key')
+            fp = get_file_from_s3('test_bucket', '/the/key')
             get_contents.assert_called()
+            assert fp.read() == 'abcd'
 
     @with_context
     @patch('pybossa.cloud_store_api.s3.boto.s3.key.Key.get_contents_as_string')
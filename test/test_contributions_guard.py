@@ -157,3 +157,29 @@ class TestContributionsGuard(object):
         self.guard.stamp_presented_time(self.task, self.auth_user)
 
         assert self.guard.retrieve_presented_timestamp(self.task, self.auth_user) == 'now'
+
+    # Batch guard tests
+
+    @patch('pybossa.contributions_guard.make_timestamp')
+    def test_stamp_tasks_stamps_requested_and_presented_time(self, make_timestamp):
+        make_timestamp.return_value = "now"
+        other_task = Task(id=23)
+
+        self.guard.stamp_tasks([self.task, other_task], self.auth_user)
+
+        for task in (self.task, other_task):
+            assert self.guard.retrieve_timestamp(task, self.auth_user) == 'now'
+            assert self.guard.retrieve_presented_timestamp(task, self.auth_user) == 'now'
+
+    @patch('pybossa.contributions_guard.make_timestamp')
+    def test_stamp_tasks_keeps_presented_time(self, make_timestamp):
+        key = 'pybossa:task_presented:user:33:task:22'
+        make_timestamp.return_value = "before"
+        self.guard.stamp_presented_time(self.task, self.auth_user)
+        self.connection.expire(key, 10)
+        make_timestamp.return_value = "now"
+
+        self.guard.stamp_tasks([self.task], self.auth_user)
+
+        assert self.connection.get(key) == 'before'
+        assert self.connection.ttl(key) == 60 * 60
@@ -0,0 +1,131 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""This module tests the Delta exporter."""
+
+import json
+import zipfile
+from StringIO import StringIO
+
+from mock import patch
+from nose.tools import assert_raises
+from default import Test, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from pybossa.core import sentinel
+from pybossa.exporter.delta_export import (DeltaExporter, get_watermark,
+                                           reset_watermark)
+
+
+class TestDeltaExporter(Test):
+
+    def setUp(self):
+        super(TestDeltaExporter, self).setUp()
+        self.exporter = DeltaExporter()
+        self.chunks = {}
+
+    def _read_uploaded_chunks(self, uploader):
+        def upload_file(_file, container):
+            self.chunks[_file.filename] = zipfile.ZipFile(
+                StringIO(_file.stream.read()))
+            return True
+        uploader.upload_file.side_effect = upload_file
+
+    def _rows(self, chunk, table):
+        _zip = self.chunks[chunk]
+        name = [n for n in _zip.namelist() if n.endswith('_%s.ndjson' % table)]
+        return [json.loads(line) for line in _zip.read(name[0]).splitlines()]
+
+    @with_context
+    @patch('pybossa.exporter.delta_export.uploader')
+    def test_export_only_new_rows(self, uploader):
+        """Test DeltaExporter exports only what is new since the watermark."""
+        self._read_uploaded_chunks(uploader)
+        project = ProjectFactory.create()
+        task1, task2 = TaskFactory.create_batch(2, project=project,
+                                                n_answers=1)
+        task_run1 = TaskRunFactory.create(project=project, task=task1)
+
+        first = self.exporter.export(project)
+
+        assert [r['id'] for r in self._rows(first, 'task_run')] == [task_run1.id]
+        assert [r['task_id'] for r in self._rows(first, 'result')] == [task1.id]
+        assert [r['task_id'] for r in self._rows(first, 'consensus')] == [task1.id]
+        watermark = get_watermark(project.id, sentinel.master)
+        assert watermark['task_run_id'] == task_run1.id, watermark
+        assert watermark['chunk'] == first, watermark
+
+        task_run2 = TaskRunFactory.create(project=project, task=task2)
+
+        second = self.exporter.export(project)
+
+        assert second != first
+        assert [r['id'] for r in self._rows(second, 'task_run')] == [task_run2.id]
+        assert [r['task_id'] for r in self._rows(second, 'result')] == [task2.id]
+        assert [r['task_id'] for r in self._rows(second, 'consensus')] == [task2.id]
+
+    @with_context
+    @patch('pybossa.exporter.delta_export.uploader')
+    def test_export_nothing_new(self, uploader):
+        """Test DeltaExporter does not upload empty chunks."""
+        self._read_uploaded_chunks(uploader)
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+        self.exporter.export(project)
+
+        assert self.exporter.export(project) is None
+        assert uploader.upload_file.call_count == 1
+
+    @with_context
+    @patch('pybossa.exporter.delta_export.uploader')
+    def test_export_upload_failed(self, uploader):
+        """Test DeltaExporter keeps the watermark if the upload fails."""
+        uploader.upload_file.return_value = False
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+
+        assert_raises(IOError, self.exporter.export, project)
+
+        assert get_watermark(project.id, sentinel.master)['task_run_id'] == 0
+
+    @with_context
+    @patch('pybossa.exporter.delta_export.uploader')
+    def test_reset_watermark(self, uploader):
+        """Test DeltaExporter exports everything again after a reset."""
+        self._read_uploaded_chunks(uploader)
+        project = ProjectFactory.create()
+        task_run = TaskRunFactory.create(project=project)
+        self.exporter.export(project)
+
+        reset_watermark(project.id, sentinel.master)
+        chunk = self.exporter.export(project)
+
+        assert [r['id'] for r in self._rows(chunk, 'task_run')] == [task_run.id]
+
+    @with_context
+    @patch('pybossa.exporter.delta_export._wait_for_transactions')
+    @patch('pybossa.exporter.delta_export.uploader')
+    def test_export_postponed(self, uploader, wait):
+        """Test DeltaExporter waits for the running transactions before
+        moving the watermark."""
+        wait.return_value = False
+        project = ProjectFactory.create()
+        TaskRunFactory.create(project=project)
+
+        assert self.exporter.export(project) is None
+
+        uploader.upload_file.assert_not_called()
+        assert get_watermark(project.id, sentinel.master)['task_run_id'] == 0
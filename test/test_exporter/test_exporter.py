@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""This module tests the Exporter streaming helpers."""
+
+import json
+import zipfile
+from StringIO import StringIO
+from flatten_json import flatten
+from default import Test, with_context
+from factories import ProjectFactory, TaskFactory
+from pybossa.exporter import Exporter, RowFlattener, zip_entry
+from pybossa.exporter.json_export import JsonExporter
+
+
+class TestRowFlattener(object):
+
+    def test_flatten_as_flatten_json(self):
+        """Test RowFlattener flattens rows as flatten_json does."""
+        row = {'a': {'nested_x': 'N', 'nested_y': [1, {'z': 2}]},
+               'b': 1,
+               'c': None,
+               'd': [],
+               'ignored': {'x': 1}}
+        flattener = RowFlattener(root_keys_to_ignore=['ignored'])
+
+        assert flattener.flatten(row) == flatten(row, root_keys_to_ignore=['ignored'])
+        # Second time the cached keys are used
+        assert flattener.flatten(row) == flatten(row, root_keys_to_ignore=['ignored'])
+
+    def test_flatten_unicode_keys(self):
+        """Test RowFlattener supports non ascii keys."""
+        flattener = RowFlattener()
+
+        flat = flattener.flatten({u'caf\xe9': {u'cr\xe8me': 1}})
+
+        assert flat == {u'caf\xe9_cr\xe8me': 1}, flat
+
+
+class TestZipEntry(object):
+
+    def test_zip_entry(self):
+        """Test zip_entry writes chunks straight into a zip entry."""
+        out = StringIO()
+        _zip = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        with zip_entry(_zip, 'data.csv') as entry:
+            for i in range(1000):
+                entry.write('%d,row\n' % i)
+        with zip_entry(_zip, 'data.json') as entry:
+            entry.write(u'["caf\xe9"]')
+        _zip.close()
+
+        _zip = zipfile.ZipFile(StringIO(out.getvalue()))
+        assert _zip.testzip() is None
+        assert _zip.namelist() == ['data.csv', 'data.json']
+        lines = _zip.read('data.csv').splitlines()
+        assert len(lines) == 1000
+        assert lines[-1] == '999,row'
+        assert json.loads(_zip.read('data.json')) == [u'caf\xe9']
+
+
+class TestExporterData(Test):
+
+    @with_context
+    def test_get_data_streams_rows(self):
+        """Test Exporter _get_data yields the rows as dictize does."""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project,
+                                         info={'a': {'b': 1}})
+
+        data = Exporter()._get_data('task', project.id)
+
+        assert not isinstance(data, list)
+        assert list(data) == [task.dictize() for task in tasks]
+
+    @with_context
+    def test_get_data_flat_info_only(self):
+        """Test Exporter _get_data flattens the info of the rows."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, info={'a': {'b': 1}})
+
+        data = list(Exporter()._get_data('task', project.id, flat=True,
+                                         info_only=True))
+
+        assert data == [{'a_b': 1, 'task_id': task.id}], data
+
+    @with_context
+    def test_gen_json(self):
+        """Test JsonExporter gen_json yields a valid JSON array."""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project)
+
+        data = json.loads(''.join(JsonExporter().gen_json('task', project.id)))
+
+        assert [t['id'] for t in data] == [t.id for t in tasks], data
+
+    @with_context
+    def test_gen_json_empty(self):
+        """Test JsonExporter gen_json yields an empty array without rows."""
+        project = ProjectFactory.create()
+
+        data = ''.join(JsonExporter().gen_json('task', project.id))
+
+        assert data == '[]', data
@@ -0,0 +1,158 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""This module tests the Parquet exporter."""
+
+import json
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+from zipfile import ZipFile
+
+from mock import patch
+from default import Test, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory, UserFactory
+from pybossa.exporter.consensus_exporter import export_consensus
+from pybossa.exporter.parquet_export import (parquet_available, write_parquet,
+                                             TaskParquetExporter)
+from pybossa.jobs import export_tasks
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pass
+
+
+def read_parquet(data):
+    return pq.read_table(pa.BufferReader(data))
+
+
+@unittest.skipUnless(parquet_available(), 'pyarrow is not installed')
+class TestWriteParquet(Test):
+
+    @with_context
+    def test_write_parquet_typed_columns(self):
+        """Test write_parquet keeps the types of the columns."""
+        rows = [{'id': 1, 'created': '2018-01-01T10:00:00.123456',
+                 'info': {'a': 1, 'b': u'x', 'c': [1, 2]}},
+                {'id': 2, 'created': '2018-01-02T10:00:00',
+                 'info': {'a': 2.5, 'b': 3, 'd': True}}]
+        out = StringIO()
+
+        write_parquet(lambda: iter(rows), out)
+
+        table = read_parquet(out.getvalue())
+        types = {field.name: field.type for field in table.schema}
+        assert types['id'] == pa.int64(), types
+        assert types['created'] == pa.timestamp('us'), types
+        assert types['info__a'] == pa.float64(), types
+        assert types['info__b'] == pa.string(), types
+        assert types['info__c'] == pa.string(), types
+        assert types['info__d'] == pa.bool_(), types
+        data = table.to_pydict()
+        assert list(data['created']) == [datetime(2018, 1, 1, 10, 0, 0, 123456),
+                                         datetime(2018, 1, 2, 10, 0, 0)]
+        assert list(data['info__b']) == [u'x', u'3']
+        assert json.loads(data['info__c'][0]) == [1, 2]
+        assert data['info__d'][0] is None
+
+    @with_context
+    def test_write_parquet_row_groups(self):
+        """Test write_parquet writes rows in row groups."""
+        rows = [{'id': i} for i in range(5)]
+        out = StringIO()
+
+        with patch.dict(self.flask_app.config,
+                        {'EXPORT_PARQUET_ROW_GROUP_SIZE': 2}):
+            write_parquet(lambda: iter(rows), out)
+
+        parquet_file = pq.ParquetFile(pa.BufferReader(out.getvalue()))
+        assert parquet_file.num_row_groups == 3
+        assert list(parquet_file.read().to_pydict()['id']) == range(5)
+
+
+@unittest.skipUnless(parquet_available(), 'pyarrow is not installed')
+class TestTaskParquetExporter(Test):
+
+    @with_context
+    def test_make_zip_task_runs(self):
+        """Test TaskParquetExporter exports task runs."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        task_run = TaskRunFactory.create(project=project, task=task,
+                                         info={'answer': {'value': 1}})
+
+        with TaskParquetExporter().make_zip(project, 'task_run') as fp:
+            assert fp.filename.endswith('_task_run_parquet.zip')
+            zipfile = ZipFile(fp)
+            data = zipfile.read(zipfile.namelist()[0])
+
+        table = read_parquet(data)
+        types = {field.name: field.type for field in table.schema}
+        assert types['id'] == pa.int64(), types
+        assert types['info__answer__value'] == pa.int64(), types
+        assert table.to_pydict()['id'][0] == task_run.id
+
+    @with_context
+    def test_export_consensus_parquet(self):
+        """Test consensus is exported as Parquet."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, info={'test': 2}, n_answers=1)
+        task_run = TaskRunFactory.create(task=task, info={'hello': u'你好'})
+
+        with export_consensus(project, 'tsk', 'parquet', False, None) as fp:
+            zipfile = ZipFile(fp)
+            data = zipfile.read(zipfile.namelist()[0])
+
+        row = read_parquet(data).to_pydict()
+        assert row['task_id'][0] == task.id
+        task_run_info = json.loads(row['task_run__info'][0])
+        assert task_run_info[task_run.user.name] == {'hello': u'你好'}
+
+    @with_context
+    @patch('pybossa.jobs.mail')
+    def test_export_tasks_parquet(self, mail):
+        """Test JOB export_tasks attaches a Parquet export."""
+        user = UserFactory.create(admin=True)
+        project = ProjectFactory.create(name='test_project')
+        TaskFactory.create(project=project)
+
+        export_tasks(user.email_addr, project.short_name, 'task', False,
+                     'parquet')
+
+        message = mail.send.call_args[0][0]
+        assert message.subject == 'Data exported for your project: test_project'
+        assert message.attachments[0].filename.endswith('_task_parquet.zip')
+
+
+class TestExportTasksParquetUnavailable(Test):
+
+    @with_context
+    @patch('pybossa.jobs.mail')
+    @patch('pybossa.exporter.parquet_export.pq', None)
+    def test_export_tasks_parquet_unavailable(self, mail):
+        """Test JOB export_tasks fails if pyarrow is not installed."""
+        user = UserFactory.create(admin=True)
+        project = ProjectFactory.create(name='test_project')
+
+        export_tasks(user.email_addr, project.short_name, 'task', False,
+                     'parquet')
+
+        message = mail.send.call_args[0][0]
+        assert message.subject == 'Data export failed for your project: test_project'
+        assert not message.attachments
@@ -26,7 +26,11 @@ from pybossa.exporter.json_export import JsonExporter
 from factories import ProjectFactory, UserFactory, TaskFactory, TaskRunFactory
 from werkzeug.datastructures import FileStorage
 from pybossa.uploader.local import LocalUploader
+from StringIO import StringIO
+import csv
+import json
 import unittest
+import zipfile
 
 class TestTaskCsvExporter(Test):
 
@@ -127,11 +131,19 @@ class TestExporters(Test):
             assert key in obj_keys, key
 
 
+    @staticmethod
+    def _read_uploaded_zips(uploader):
+        """Make the uploader mock keep the content of the uploaded zips."""
+        zips = {}
+        def upload_file(_file, container):
+            zips[_file.filename] = zipfile.ZipFile(StringIO(_file.stream.read()))
+        uploader.upload_file.side_effect = upload_file
+        return zips
+
     @with_context
-    @patch('pybossa.exporter.csv_export.pd.DataFrame')
     @patch('pybossa.exporter.csv_export.uploader')
     @patch('pybossa.exporter.json_export.uploader')
-    def test_exporters_generates_zip(self, json_uploader, csv_uploader, dataframe ):
+    def test_exporters_generates_zip(self, json_uploader, csv_uploader):
         """Test that CsvExporter and JsonExporter generate zip works."""
         user = UserFactory.create(admin=True)
         project = ProjectFactory.create(name='test_project')
@@ -143,34 +155,41 @@ class TestExporters(Test):
         task_run = TaskRunFactory.create(project=project, task=task1)
         task_run = TaskRunFactory.create(project=project, task=task2)
 
+        csv_zips = self._read_uploaded_zips(csv_uploader)
         csv_exporter = CsvExporter()
         json_exporter = JsonExporter()
         csv_exporter.pregenerate_zip_files(project)
-        call_dataframe = dataframe.call_args_list
         call_csv_params = csv_uploader.upload_file.call_args_list
         expected_csv_params = set(['1_project1_task_run_csv.zip', '1_project1_result_csv.zip', '1_project1_task_csv.zip'])
         assert self._check_func_called_with_params(call_csv_params, expected_csv_params)
 
-        task1_data = call_dataframe[0][0][0][0]
-        task2_data = call_dataframe[0][0][0][1]
+        task_zip = csv_zips['1_project1_task_csv.zip']
+        assert sorted(task_zip.namelist()) == ['project1_task.csv',
+                                               'project1_task_info_only.csv']
+        reader = csv.DictReader(StringIO(task_zip.read('project1_task.csv')))
+        task1_data, task2_data = sorted(reader, key=lambda row: int(row['id']))
 
         expected_headers = ['info', 'fav_user_ids', 'user_pref', 'n_answers', 'quorum', 'calibration',
-            'created', 'state', 'gold_answers_best_job', 'gold_answers_best_boss', 'exported',
+            'created', 'state', 'gold_answers_best_job', 'gold_answers_best_boss', 'gold_answers', 'exported',
             'project_id', 'id', 'priority_0', 'expiration']
-        obj_keys = task1_data.keys()
-
-        self._compare_object_keys(obj_keys, expected_headers)
+        self._compare_object_keys(reader.fieldnames, expected_headers)
+        assert reader.fieldnames == sorted(reader.fieldnames), reader.fieldnames
         assert task1_data['gold_answers_best_job'] == expected_gold_answer['best_job']
         assert task1_data['gold_answers_best_boss'] == expected_gold_answer['best_boss']
+        assert task1_data['gold_answers'] == ''
+        assert task2_data['gold_answers'] == ''
+        assert task2_data['gold_answers_best_job'] == ''
+        assert int(task2_data['id']) == task2.id
 
-        expected_headers = ['info', 'fav_user_ids', 'user_pref', 'n_answers', 'quorum', 'calibration',
-            'created', 'state', 'gold_answers', 'exported', 'project_id', 'id', 'priority_0', 'expiration']
-        obj_keys = task2_data.keys()
-
-        self._compare_object_keys(obj_keys, expected_headers)
-        assert task2_data['gold_answers'] == None
-
+        json_zips = self._read_uploaded_zips(json_uploader)
         json_exporter.pregenerate_zip_files(project)
         call_json_params = json_uploader.upload_file.call_args_list
         expected_json_params = set(['1_project1_task_run_json.zip', '1_project1_result_json.zip', '1_project1_task_json.zip'])
         assert self._check_func_called_with_params(call_json_params, expected_json_params)
+
+        task_zip = json_zips['1_project1_task_json.zip']
+        tasks = json.loads(task_zip.read('project1_task.json'))
+        assert [t['id'] for t in tasks] == [task1.id, task2.id], tasks
+        assert tasks[0]['gold_answers'] == expected_gold_answer
+        task_run_zip = json_zips['1_project1_task_run_json.zip']
+        assert len(json.loads(task_run_zip.read('project1_task_run.json'))) == 2
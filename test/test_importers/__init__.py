@@ -105,10 +105,64 @@ class TestImporterPublicMethods(Test):
         importer_factory.return_value = mock_importer
         project = ProjectFactory.create()
         form_data = dict(type='flickr', album_id='1234')
-        with patch.object(task_repo, 'save', side_effect=Exception('a')):
+        with patch.object(task_repo, 'insert_tasks', side_effect=Exception('a')):
             result = self.importer.create_tasks(task_repo, project, **form_data)
         assert '1 task import failed due to a' in result.message, result.message
 
+    @with_context
+    def test_create_tasks_not_creates_duplicated_tasks_in_same_import(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'question': 'question'}},
+                                            {'info': {'question': 'question'}},
+                                            {'info': {'question': 'other'}}]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='flickr', album_id='1234')
+
+        result = self.importer.create_tasks(task_repo, project, **form_data)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert len(tasks) == 2, len(tasks)
+        assert result.total == 2, result.total
+
+    @with_context
+    def test_create_tasks_in_batches(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'question': i}}
+                                            for i in range(5)]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='flickr', album_id='1234')
+
+        with patch.dict(self.flask_app.config, {'TASK_IMPORT_BATCH_SIZE': 2}):
+            result = self.importer.create_tasks(task_repo, project, **form_data)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert len(tasks) == 5, len(tasks)
+        assert result.total == 5, result.total
+        assert sorted(t.info['question'] for t in tasks) == range(5)
+
+    @with_context
+    def test_create_tasks_batch_exception_only_fails_bad_tasks(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'question': 'question1'}},
+                                            {'info': {'question': 'question2'}}]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='flickr', album_id='1234')
+        insert_tasks = task_repo.insert_tasks
+
+        def fail_batches(project_id, tasks):
+            if len(tasks) > 1 or tasks[0].info['question'] == 'question1':
+                raise Exception('a')
+            return insert_tasks(project_id, tasks)
+
+        with patch.object(task_repo, 'insert_tasks', side_effect=fail_batches):
+            result = self.importer.create_tasks(task_repo, project, **form_data)
+
+        assert result.total == 1, result.total
+        assert '1 task import failed due to a' in result.message, result.message
+
     @with_context
     def test_count_tasks_to_import_returns_number_of_tasks_to_import(self, importer_factory):
         mock_importer = Mock()
@@ -202,3 +202,50 @@ class TestBulkTaskCSVImport(object):
         task = tasks.next()
 
         assert csv_file.encoding == 'utf-8'
+
+    @with_context
+    @patch('pybossa.importers.csv.CSV_CHUNK_SIZE', 4)
+    def test_tasks_streams_rows_split_across_chunks(self, request):
+        csv_file = FakeResponse(text=u'Foo,Bar\n"multi\nline",2\r\n3,4\n',
+                                status_code=200,
+                                headers={'content-type': 'text/plain'},
+                                encoding='utf-8')
+        request.return_value = csv_file
+
+        tasks = list(self.importer.tasks())
+
+        assert tasks == [{'info': {u'Foo': u'multi\nline', u'Bar': u'2'}},
+                         {'info': {u'Foo': u'3', u'Bar': u'4'}}], tasks
+        request.assert_called_with('http://myfakecsvurl.com', stream=True)
+
+    @with_context
+    def test_tasks_sets_headers_before_iterating(self, request):
+        csv_file = FakeResponse(text='Foo,Bar\n1,2', status_code=200,
+                                headers={'content-type': 'text/plain'},
+                                encoding='utf-8')
+        request.return_value = csv_file
+
+        self.importer.tasks()
+
+        assert self.importer.headers() == [u'Foo', u'Bar']
+
+    @with_context
+    def test_count_tasks_does_not_convert_rows(self, request):
+        csv_file = FakeResponse(text='Foo,user_pref\n1,{invalid json',
+                                status_code=200,
+                                headers={'content-type': 'text/plain'},
+                                encoding='utf-8')
+        request.return_value = csv_file
+
+        number_of_tasks = self.importer.count_tasks()
+
+        assert number_of_tasks == 1, number_of_tasks
+
+    @with_context
+    def test_count_tasks_raises_exception_if_headers_row_mismatch(self, request):
+        csv_file = FakeResponse(text='Foo,Bar,Baz\n1,2,3,4', status_code=200,
+                                headers={'content-type': 'text/plain'},
+                                encoding='utf-8')
+        request.return_value = csv_file
+
+        assert_raises(BulkImportException, self.importer.count_tasks)
@@ -110,3 +110,23 @@ class TestBulkTaskLocalCSVImport(Test):
         with patch.dict(self.flask_app.config, config):
             number_of_tasks = self.importer.count_tasks()
             assert number_of_tasks is 1, number_of_tasks
+
+    @with_context
+    @patch('pybossa.importers.csv.get_import_csv_file')
+    def test_count_tasks_with_multiline_values(self, s3_get):
+        with patch('pybossa.importers.csv.io.open', mock_open(read_data=u'Foo,Bar\n"a\nb",2\n3,4\n'), create=True):
+            number_of_tasks = self.importer.count_tasks()
+            assert number_of_tasks == 2, number_of_tasks
+
+    @with_context
+    @patch('pybossa.importers.csv.get_import_csv_file')
+    def test_tasks_are_streamed(self, s3_get):
+        with patch('pybossa.importers.csv.io.open', mock_open(read_data=u'Foo,Bar\n1,2\n3,4\n'), create=True):
+            tasks = self.importer.tasks()
+            assert self.importer.headers() == [u'Foo', u'Bar']
+            assert not isinstance(tasks, list)
+            assert tasks.next() == {'info': {u'Foo': u'1', u'Bar': u'2'}}
+            s3_get.return_value.close.assert_not_called()
+            assert tasks.next() == {'info': {u'Foo': u'3', u'Bar': u'4'}}
+            assert_raises(StopIteration, tasks.next)
+            s3_get.return_value.close.assert_called()
@@ -0,0 +1,110 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import json
+from mock import patch
+from nose.tools import assert_raises
+from sqlalchemy.exc import ProgrammingError
+from helper import web
+from default import with_context, flask_app
+from factories import ProjectFactory, TaskFactory, UserFactory
+from pybossa import instrumentation
+from pybossa.core import db
+
+
+class TestInstrumentation(web.Helper):
+
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        instrumentation.reset_stats()
+
+    def test_statement_shape(self):
+        """Test statement_shape removes literals and IN lists."""
+        shape = instrumentation.statement_shape(
+            "SELECT * FROM task  WHERE id IN (1, 2, 3)\n AND info = 'x'")
+        assert shape == 'SELECT * FROM task WHERE id IN (?) AND info = ?', shape
+
+    @with_context
+    def test_disabled(self):
+        """Test nothing is recorded by default."""
+        project = ProjectFactory.create()
+        res = self.app.get('/api/project/%s' % project.id)
+
+        assert 'Server-Timing' not in res.headers
+        assert instrumentation.get_stats()['endpoints'] == {}
+
+    @with_context
+    @patch.dict(flask_app.config, {'INSTRUMENTATION_ENABLED': True,
+                                   'INSTRUMENTATION_SERVER_TIMING': True})
+    def test_request_stats(self):
+        """Test SQL statements and Redis commands are counted per endpoint."""
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project)
+        res = self.app.get('/api/project/%s/newtask' % project.id)
+
+        timing = res.headers['Server-Timing']
+        assert timing.startswith('sql;dur='), timing
+        assert 'redis;dur=' in timing, timing
+        stats = instrumentation.get_stats()['endpoints']['api.new_task']
+        assert stats['requests'] == 1, stats
+        assert stats['sql_count_max'] > 0, stats
+        assert stats['redis_count_max'] > 0, stats
+        assert sum(stats['time_histogram']) == 1, stats
+
+    @with_context
+    @patch.dict(flask_app.config, {'INSTRUMENTATION_ENABLED': True})
+    def test_failed_statement(self):
+        """Test failed statements do not leave their start time behind."""
+        with flask_app.test_request_context('/'):
+            instrumentation._before_request()
+            conn = db.session.connection()
+            assert_raises(ProgrammingError, conn.execute,
+                          'SELECT * FROM missing_table')
+            assert not conn.info.get('instrumentation_start'), conn.info
+            db.session.rollback()
+
+    @with_context
+    @patch.dict(flask_app.config, {'INSTRUMENTATION_ENABLED': True,
+                                   'INSTRUMENTATION_N_PLUS_ONE': 2,
+                                   'INSTRUMENTATION_SLOW_REQUEST': 0})
+    def test_n_plus_one_and_slow_requests(self):
+        """Test repeated statement shapes and slow requests are reported."""
+        project = ProjectFactory.create()
+        self.app.get('/api/project/%s' % project.id)
+
+        stats = instrumentation.get_stats()
+        slow = stats['slow_requests']
+        assert len(slow) == 1, slow
+        assert slow[0]['path'] == '/api/project/%s' % project.id, slow
+        n_plus_one = stats['endpoints'][slow[0]['endpoint']]['n_plus_one']
+        assert n_plus_one == slow[0]['n_plus_one'], stats
+
+    @with_context
+    def test_diagnostics_endpoint(self):
+        """Test the instrumentation stats are only available to admins."""
+        admin = UserFactory.create(admin=True)
+        user = UserFactory.create()
+        url = '/diagnostics/instrumentation?api_key=%s'
+
+        res = self.app.get(url % user.api_key)
+        assert res.status_code == 403, res.status_code
+
+        res = self.app.get(url % admin.api_key)
+        assert res.status_code == 200, res.status_code
+        data = json.loads(res.data)
+        assert data['enabled'] is False, data
+        assert 'endpoints' in data and 'cache' in data, data
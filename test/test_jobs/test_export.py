@@ -17,7 +17,8 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 from default import Test, with_context, flask_app
 from factories import ProjectFactory, UserFactory, TaskFactory, TaskRunFactory
-from pybossa.jobs import get_export_task_jobs, project_export, export_tasks
+from pybossa.jobs import (get_export_task_jobs, project_export, export_tasks,
+                          project_delta_export)
 from mock import patch, MagicMock
 
 
@@ -80,6 +81,25 @@ class TestExport(Test):
         msg = "The job should be enqueued in high priority."
         assert job['queue'] == 'high', msg
 
+    @with_context
+    @patch.dict(flask_app.config, {'EXPORT_INCREMENTAL': True})
+    def test_get_export_task_jobs_incremental(self):
+        """Test JOB export task jobs schedules delta exports if enabled."""
+        project = ProjectFactory.create()
+        jobs = list(get_export_task_jobs(queue='low'))
+
+        assert len(jobs) == 1, len(jobs)
+        assert jobs[0]['name'] == project_delta_export, jobs[0]
+        assert jobs[0]['args'] == [project.id]
+
+    @with_context
+    @patch('pybossa.core.delta_exporter')
+    def test_project_delta_export(self, delta_exporter):
+        """Test JOB project_delta_export works."""
+        project = ProjectFactory.create()
+        project_delta_export(project.id)
+        delta_exporter.export.assert_called_once_with(project)
+
     @with_context
     @patch('pybossa.core.json_exporter')
     @patch('pybossa.core.csv_exporter')
@@ -18,10 +18,11 @@
 
 from pybossa.leaderboard.jobs import leaderboard
 from pybossa.leaderboard.data import get_leaderboard
-from pybossa.core import db
+from pybossa.leaderboard import scores
+from pybossa.core import db, sentinel, user_repo
 from pybossa.jobs import get_leaderboard_jobs
-from factories import UserFactory, TaskRunFactory
-from default import Test, with_context
+from factories import UserFactory, TaskFactory, TaskRunFactory
+from default import Test, with_context, flask_app
 from mock import patch, MagicMock
 from sqlalchemy.exc import ProgrammingError
 
@@ -237,3 +238,96 @@ class TestLeaderboard(Test):
         results = db.session.execute('select * from "users_rank_foo-dash"');
         for r in results:
             assert r.restrict is False, r
+
+
+@patch.dict(flask_app.config, {'LEADERBOARD_INCREMENTAL': True,
+                               'LEADERBOARDS': ['n']})
+class TestIncrementalLeaderboard(Test):
+
+    @with_context
+    def test_scores_follow_task_runs(self):
+        """Test incremental leaderboard scores follow task runs."""
+        users = UserFactory.create_batch(3)
+        restricted = UserFactory.create(restrict=True)
+        for score, user in zip([2, 3, 1], users):
+            TaskRunFactory.create_batch(score, user=user)
+        TaskRunFactory.create(user=restricted)
+
+        # Followed by the project owners, who have not contributed
+        top_users = get_leaderboard()[:3]
+
+        assert [u['name'] for u in top_users] == [users[1].name,
+                                                  users[0].name,
+                                                  users[2].name], top_users
+        assert [u['score'] for u in top_users] == [3, 2, 1], top_users
+        assert [u['rank'] for u in top_users] == [1, 2, 3], top_users
+
+    @with_context
+    def test_current_user_window(self):
+        """Test incremental leaderboard returns the window around a user."""
+        users = UserFactory.create_batch(10)
+        for score, user in enumerate(users):
+            TaskRunFactory.create_batch(score, user=user)
+
+        top_users = get_leaderboard(top_users=2, user_id=users[4].id,
+                                    window=1)
+
+        assert [u['name'] for u in top_users] == [
+            users[9].name, users[8].name,
+            users[5].name, users[4].name, users[3].name], top_users
+        assert [u['rank'] for u in top_users] == [1, 2, 5, 6, 7], top_users
+
+    @with_context
+    def test_tied_users_share_rank(self):
+        """Test incremental leaderboard gives tied users the same rank."""
+        users = UserFactory.create_batch(4)
+        for score, user in zip([3, 2, 2, 1], users):
+            TaskRunFactory.create_batch(score, user=user)
+
+        top_users = get_leaderboard(top_users=4)
+        assert [u['rank'] for u in top_users] == [1, 2, 2, 4], top_users
+
+        top_users = get_leaderboard(top_users=1, user_id=users[2].id)
+        assert top_users[-1]['rank'] == 2, top_users
+
+        top_users = get_leaderboard(top_users=1, user_id=users[3].id,
+                                    window=1)
+        assert [u['rank'] for u in top_users] == [1, 2, 4, 5], top_users
+
+    @with_context
+    def test_empty_leaderboard_not_rebuilt_on_read(self):
+        """Test an empty incremental leaderboard is not rebuilt on each
+        read."""
+        with patch.object(scores, 'rebuild', wraps=scores.rebuild) as rebuild:
+            assert scores.get_ranks() == []
+            assert scores.get_ranks() == []
+            assert rebuild.call_count == 1, rebuild.call_count
+
+    @with_context
+    def test_info_scores_follow_users(self):
+        """Test incremental leaderboards for info keys follow user updates."""
+        user = UserFactory.create(info=dict(n=1))
+        other = UserFactory.create(info=dict(n=2))
+        assert get_leaderboard(info='n')[0]['name'] == other.name
+
+        user.info['n'] = 3
+        user_repo.update(user)
+        assert get_leaderboard(info='n')[0]['name'] == user.name
+
+        user.restrict = True
+        user_repo.update(user)
+        top_users = get_leaderboard(info='n')
+        assert [u['name'] for u in top_users] == [other.name], top_users
+
+    @with_context
+    def test_rebuild_repairs_scores(self):
+        """Test JOB leaderboard rebuilds incremental scores."""
+        user = UserFactory.create()
+        task = TaskFactory.create()
+        TaskRunFactory.create_batch(2, user=user, task=task)
+        sentinel.master.delete(scores.get_key())
+
+        # The user and the project owner
+        assert leaderboard() == 'Leaderboard rebuilt with 2 users'
+        assert get_leaderboard()[0]['score'] == 2
+        assert list(get_leaderboard_jobs()) == []
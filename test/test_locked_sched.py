@@ -23,6 +23,10 @@ from pybossa.sched import (
     Schedulers,
     get_task_users_key,
     acquire_lock,
+    acquire_any_lock,
+    acquire_locks,
+    get_lock_expirations,
+    get_user_tasks,
     has_lock,
     get_task_id_and_duration_for_project_user,
     get_task_id_project_id_key,
@@ -93,6 +97,55 @@ class TestLockedSched(sched.Helper):
         t3 = get_locked_task(project.id, 1, offset=2)
         assert t3 is None
 
+    @with_context
+    def test_get_locked_task_prefetch(self):
+        owner = UserFactory.create(id=500)
+        project = ProjectFactory.create(owner=owner)
+        project.info['sched'] = Schedulers.locked
+        project_repo.save(project)
+
+        tasks = TaskFactory.create_batch(4, project=project, n_answers=1)
+
+        t1 = get_locked_task(project.id, 1, limit=3, prefetch=True)
+        assert [t.id for t in t1] == [t.id for t in tasks[:3]], t1
+        t2 = get_locked_task(project.id, 2, limit=3, prefetch=True)
+        assert [t.id for t in t2] == [tasks[3].id], t2
+        # locks already held are returned again
+        t3 = get_locked_task(project.id, 1, limit=3, prefetch=True)
+        assert sorted(t.id for t in t3) == [t.id for t in tasks[:3]], t3
+
+    @with_context
+    def test_get_locked_task_limit_without_prefetch(self):
+        owner = UserFactory.create(id=500)
+        project = ProjectFactory.create(owner=owner)
+        project.info['sched'] = Schedulers.locked
+        project_repo.save(project)
+
+        TaskFactory.create_batch(3, project=project, n_answers=1)
+
+        assert len(get_locked_task(project.id, 1, limit=3)) == 1
+
+    @with_context
+    def test_prefetch_api(self):
+        owner = UserFactory.create(id=500)
+        project = ProjectFactory.create(owner=owner)
+        project.info['sched'] = Schedulers.locked
+        project.info['timeout'] = 120
+        project_repo.save(project)
+
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=1)
+
+        self.set_proj_passwd_cookie(project, owner)
+        res = self.app.get('api/project/{}/prefetch?limit=2&api_key={}'
+                           .format(project.id, owner.api_key))
+        data = json.loads(res.data)
+        assert [t['id'] for t in data] == [t.id for t in tasks[:2]], data
+        for task in data:
+            assert 100 < task['lock_expires'] <= 120, task
+        guard = ContributionsGuard(sentinel.master)
+        assert guard.check_task_stamped(tasks[0], {'user_id': owner.id})
+        assert guard.check_task_stamped(tasks[1], {'user_id': owner.id})
+
     @with_context
     def test_taskrun_submission(self):
         """ Test submissions with locked scheduler """
@@ -190,6 +243,53 @@ class TestLockedSched(sched.Helper):
         acquire_lock(task_id, user_id, limit, timeout)
         assert has_lock(task_id, user_id, limit)
 
+    @with_context
+    def test_acquire_any_lock_skips_full_tasks(self):
+        timeout = 100
+        acquire_lock(1, 10, 1, timeout)
+        task_id = acquire_any_lock([(1, 1), (2, 1), (3, 1)], 11, timeout)
+        assert task_id == 2, task_id
+        assert has_lock(2, 11, timeout)
+        assert not has_lock(1, 11, timeout)
+        assert not has_lock(3, 11, timeout)
+        assert '2' in get_user_tasks(11, timeout)
+
+    @with_context
+    def test_acquire_any_lock_none_available(self):
+        timeout = 100
+        acquire_lock(1, 10, 1, timeout)
+        acquire_lock(2, 10, 1, timeout)
+        assert acquire_any_lock([(1, 1), (2, 1)], 11, timeout) is None
+        assert not get_user_tasks(11, timeout)
+
+    @with_context
+    def test_acquire_any_lock_already_held(self):
+        timeout = 100
+        acquire_lock(1, 10, 1, timeout)
+        assert acquire_any_lock([(1, 1), (2, 1)], 10, timeout) == 1
+
+    @with_context
+    def test_acquire_any_lock_unlimited(self):
+        timeout = 100
+        acquire_lock(1, 10, 1, timeout)
+        assert acquire_any_lock([(1, float('inf'))], 11, timeout) == 1
+
+    @with_context
+    def test_acquire_locks(self):
+        timeout = 100
+        acquire_lock(2, 10, 1, timeout)
+        task_ids = acquire_locks([(1, 1), (2, 1), (3, 1), (4, 1)], 11,
+                                 timeout, 2)
+        assert task_ids == [1, 3], task_ids
+        expirations = get_lock_expirations([1, 2, 3], 11)
+        assert sorted(expirations.keys()) == [1, 3], expirations
+        assert all(0 < seconds <= timeout for seconds in expirations.values())
+
+    @with_context
+    def test_acquire_any_lock_releases_expired(self):
+        acquire_lock(1, 10, 1, -10)
+        assert acquire_any_lock([(1, 1)], 11, 100) == 1
+
     @with_context
     def test_get_task_id_and_duration_for_project_user_missing(self):
         user = UserFactory.create()
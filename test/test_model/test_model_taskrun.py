@@ -16,7 +16,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
+from datetime import datetime
 from default import Test, db, with_context
+from factories import TaskRunFactory
 from nose.tools import assert_raises
 from sqlalchemy.exc import IntegrityError
 from pybossa.model.user import User
@@ -59,3 +61,20 @@ class TestModelTaskRun(Test):
         db.session.add(task_run)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+    @with_context
+    def test_task_run_timestamp_columns(self):
+        """Test created and finish_time are mirrored as timestamps."""
+        task_run = TaskRunFactory.create(created='2019-04-01T10:00:00.000001',
+                                         finish_time='2019-04-01T10:00:30.5')
+
+        assert task_run.created_ts == datetime(2019, 4, 1, 10, 0, 0, 1)
+        assert task_run.finish_time_ts == datetime(2019, 4, 1, 10, 0, 30,
+                                                   500000)
+        assert 'finish_time_ts' not in task_run.dictize()
+
+        task_run.finish_time = 'not a date'
+        db.session.commit()
+
+        assert task_run.finish_time_ts is None
+        assert task_run.created_ts == datetime(2019, 4, 1, 10, 0, 0, 1)
@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2019 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+from sqlalchemy.sql import text
+from default import Test, db, with_context, flask_app
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from pybossa import partitioning
+from pybossa.repositories import ProjectRepository, TaskRepository
+
+
+class TestPartitioning(Test):
+
+    def setUp(self):
+        with flask_app.app_context():
+            if not partitioning.is_supported(db.session):
+                raise unittest.SkipTest('PostgreSQL 13 or later is needed')
+        super(TestPartitioning, self).setUp()
+
+    def _partition_of(self, table, id):
+        sql = text('SELECT tableoid::regclass::text FROM %s WHERE id=:id'
+                   % table)
+        return db.session.execute(sql, dict(id=id)).scalar()
+
+    def _exists(self, name):
+        sql = text('SELECT to_regclass(:name)')
+        return db.session.execute(sql, dict(name=name)).scalar() is not None
+
+    @with_context
+    def test_partition_tables(self):
+        """Test existing tasks and task runs are moved to the partitions of
+        their project."""
+        task_run = TaskRunFactory.create()
+        project_id = task_run.project_id
+
+        partitioning.partition_tables(db.session)
+        db.session.commit()
+
+        assert partitioning.is_partitioned(db.session)
+        assert self._partition_of('task', task_run.task_id) == \
+            'task_p%s' % project_id
+        assert self._partition_of('task_run', task_run.id) == \
+            'task_run_p%s' % project_id
+
+        partitioning.unpartition_tables(db.session)
+        db.session.commit()
+
+        assert not partitioning.is_partitioned(db.session)
+        assert self._partition_of('task_run', task_run.id) == 'task_run'
+
+    @with_context
+    def test_project_partitions(self):
+        """Test projects get their partitions when created and lose them
+        when deleted."""
+        partitioning.partition_tables(db.session)
+        db.session.commit()
+
+        project = ProjectFactory.create()
+        task_run = TaskRunFactory.create(project=project,
+                                         task=TaskFactory.create(
+                                             project=project))
+        assert self._partition_of('task_run', task_run.id) == \
+            'task_run_p%s' % project.id
+
+        TaskRepository(db).delete_taskruns_from_project(project)
+        assert self._partition_of('task_run', task_run.id) is None
+
+        ProjectRepository(db).delete(project)
+        assert not self._exists('task_p%s' % project.id)
+        assert not self._exists('task_run_p%s' % project.id)
@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+from mock import patch, MagicMock
+from default import Test, db, with_context, flask_app
+from factories import ProjectFactory
+from pybossa import read_routing
+from pybossa.repositories import ProjectRepository
+
+
+class TestReadRouting(Test):
+
+    def setUp(self):
+        super(TestReadRouting, self).setUp()
+        self.replica = MagicMock(info=dict(read_replica=True))
+        self.replica.execute.return_value.scalar.return_value = 0
+        self.replicas = patch.object(read_routing, '_replicas',
+                                     [('replica', self.replica)])
+        self.replicas.start()
+        read_routing._lags.clear()
+
+    def tearDown(self):
+        self.replicas.stop()
+        read_routing._lags.clear()
+        super(TestReadRouting, self).tearDown()
+
+    @with_context
+    def test_no_request_uses_primary(self):
+        """Test reads outside requests use the primary."""
+        assert read_routing.read_session(db) is db.session
+
+    @with_context
+    def test_get_request_uses_replica(self):
+        """Test repository reads of GET requests use a replica."""
+        with flask_app.test_request_context('/', method='GET'):
+            flask_app.preprocess_request()
+            assert ProjectRepository(db).read_session is self.replica
+
+    @with_context
+    def test_unsafe_request_uses_primary(self):
+        """Test requests that may write read from the primary."""
+        with flask_app.test_request_context('/', method='POST'):
+            flask_app.preprocess_request()
+            assert read_routing.read_session(db) is db.session
+
+    @with_context
+    def test_sticks_to_primary_after_write(self):
+        """Test a request reads from the primary after it writes."""
+        with flask_app.test_request_context('/', method='GET'):
+            flask_app.preprocess_request()
+            assert read_routing.read_session(db) is self.replica
+            ProjectFactory.create()
+            assert read_routing.read_session(db) is db.session
+
+    @with_context
+    @patch.dict(flask_app.config, {'READ_REPLICA_MAX_LAG': 10})
+    def test_stale_replica_uses_primary(self):
+        """Test replicas lagging too far behind are skipped."""
+        self.replica.execute.return_value.scalar.return_value = 60
+        with flask_app.test_request_context('/', method='GET'):
+            assert read_routing.read_session(db) is db.session
+
+    @with_context
+    def test_unavailable_replica_uses_primary(self):
+        """Test replicas that cannot be reached are skipped until the next
+        check."""
+        self.replica.execute.side_effect = Exception('connection refused')
+        with flask_app.test_request_context('/', method='GET'):
+            assert read_routing.read_session(db) is db.session
+        with flask_app.test_request_context('/', method='GET'):
+            assert read_routing.read_session(db) is db.session
+        assert self.replica.execute.call_count == 1
+
+    @with_context
+    @patch.dict(flask_app.config, {'READ_REPLICA_ROUTING': False})
+    def test_disabled(self):
+        """Test nothing is routed with READ_REPLICA_ROUTING disabled."""
+        with flask_app.test_request_context('/', method='GET'):
+            assert read_routing.read_session(db) is db.session
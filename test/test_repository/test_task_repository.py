@@ -20,7 +20,8 @@
 from default import Test, db, with_context
 from mock import patch
 from nose.tools import assert_raises
-from factories import TaskFactory, TaskRunFactory, ProjectFactory
+from factories import (TaskFactory, TaskRunFactory, ProjectFactory,
+                       AnonymousTaskRunFactory)
 from pybossa.repositories import TaskRepository, ProjectRepository
 from pybossa.exc import WrongObjectError, DBIntegrityError
 from pybossa.model.task import Task
@@ -590,6 +591,108 @@ class TestTaskRepositorySaveDeleteUpdate(Test):
         assert self.task_repo.get_task_run(taskrun.id) == taskrun, "TaskRun not saved"
 
 
+    @with_context
+    def test_insert_tasks(self):
+        """Test insert_tasks persists tasks and their counters"""
+        from pybossa.model.counter import Counter
+
+        project = ProjectFactory.create()
+        tasks = [Task(project_id=project.id, info={'n': i}, n_answers=2)
+                 for i in range(3)]
+
+        task_ids = self.task_repo.insert_tasks(project.id, tasks)
+
+        assert len(task_ids) == 3, task_ids
+        assert [t.id for t in tasks] == task_ids
+        for i, task_id in enumerate(task_ids):
+            task = self.task_repo.get_task(task_id)
+            assert task.info == {'n': i}, task.info
+            assert task.n_answers == 2
+            assert task.state == 'ongoing'
+            assert task.priority_0 == 0
+            assert task.created is not None
+            assert task.user_pref is None
+        counters = db.session.query(Counter).filter_by(project_id=project.id).all()
+        assert sorted(c.task_id for c in counters) == sorted(task_ids)
+        assert all(c.n_task_runs == 0 for c in counters)
+
+    @with_context
+    def test_insert_tasks_empty(self):
+        """Test insert_tasks does nothing without tasks"""
+        assert self.task_repo.insert_tasks(1, []) == []
+
+    @with_context
+    def test_insert_tasks_skips_duplicates(self):
+        """Test insert_tasks skips the duplicates of ongoing tasks"""
+        project = ProjectFactory.create()
+        ongoing = TaskFactory.create(project=project, info={'a': 1, 'b': 2})
+        TaskFactory.create(project=project, info={'c': 3}, state='completed')
+        tasks = [Task(project_id=project.id, info=info)
+                 for info in [{'b': 2, 'a': 1}, {'c': 3}, {'d': 4}, {'d': 4}]]
+
+        task_ids = self.task_repo.insert_tasks(project.id, tasks)
+
+        assert len(task_ids) == 2, task_ids
+        assert [t.id for t in tasks] == [None, task_ids[0], task_ids[1], None]
+        assert self.task_repo.count_tasks_with(project_id=project.id) == 4
+        assert self.task_repo.find_duplicate(project.id, {'a': 1, 'b': 2}) \
+            == ongoing.id
+
+    @with_context
+    def test_insert_task_runs_skips_conflicts(self):
+        """Test insert_task_runs skips the task runs conflicting with an
+        existing one and inserts the others"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project)
+        AnonymousTaskRunFactory.create(task=tasks[0])
+        task_runs = [AnonymousTaskRunFactory.build(task=task)
+                     for task in tasks]
+
+        inserted = self.task_repo.insert_task_runs(task_runs)
+
+        assert inserted == [task_runs[1]], inserted
+        assert task_runs[0].id is None
+        assert self.task_repo.get_task_run(task_runs[1].id).task_id == tasks[1].id
+        assert self.task_repo.count_task_runs_with(task_id=tasks[0].id) == 1
+
+    @with_context
+    def test_save_deduplicated(self):
+        """Test save_deduplicated raises a DuplicateTaskError for the
+        duplicate of an ongoing task"""
+        from pybossa.exc import DuplicateTaskError
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, info={'a': 1, 'b': 2})
+        TaskFactory.create(project=project, info={'c': 3}, state='completed')
+
+        duplicate = Task(project_id=project.id, info={'b': 2, 'a': 1})
+        with assert_raises(DuplicateTaskError) as context:
+            self.task_repo.save_deduplicated(duplicate)
+        assert context.exception.task_id == task.id
+
+        self.task_repo.save_deduplicated(
+            Task(project_id=project.id, info={'c': 3}))
+        assert self.task_repo.count_tasks_with(project_id=project.id) == 3
+
+    @with_context
+    def test_duplicate_takes_over_info_hash(self):
+        """Test the oldest duplicate of an ongoing task is deduplicated
+        against once the task is completed or deleted"""
+        project = ProjectFactory.create()
+        first, second, third = TaskFactory.create_batch(
+            3, project=project, info={'a': 1})
+        assert self.task_repo.find_duplicate(project.id, {'a': 1}) == first.id
+
+        first.state = 'completed'
+        self.task_repo.update(first)
+        assert self.task_repo.find_duplicate(project.id, {'a': 1}) == second.id
+
+        self.task_repo.delete(second)
+        assert self.task_repo.find_duplicate(project.id, {'a': 1}) == third.id
+
+        first.state = 'ongoing'
+        self.task_repo.update(first)
+        assert self.task_repo.find_duplicate(project.id, {'a': 1}) == third.id
+
     @with_context
     @patch('pybossa.core.project_repo')
     def test_save_fails_if_integrity_error(self, mock_project_repo):
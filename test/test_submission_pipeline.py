@@ -0,0 +1,104 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from default import Test, with_context, flask_app
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from pybossa.core import result_repo, task_repo, sentinel
+from pybossa import submission_pipeline
+
+
+@patch.dict(flask_app.config, {'TASK_RUN_DEFERRED_SIDE_EFFECTS': True})
+class TestSubmissionPipeline(Test):
+
+    def _submit(self, **kwargs):
+        task_run = TaskRunFactory.create(**kwargs)
+        submission_pipeline.push(task_run, task_run.info)
+        return task_run
+
+    @with_context
+    @patch('pybossa.jobs.enqueue_job')
+    def test_side_effects_deferred(self, enqueue_job):
+        """Test task runs do not complete tasks until processed."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=2)
+        self._submit(project=project, task=task)
+        self._submit(project=project, task=task)
+
+        assert task_repo.get_task(task.id).state == 'ongoing'
+        assert result_repo.filter_by(task_id=task.id) == []
+        assert enqueue_job.call_count == 1, enqueue_job.call_count
+
+        assert submission_pipeline.process_pending() == 2
+
+        assert task_repo.get_task(task.id).state == 'completed'
+        results = result_repo.filter_by(task_id=task.id)
+        assert len(results) == 1, results
+        assert sentinel.master.llen(submission_pipeline.PENDING_KEY) == 0
+        assert not sentinel.master.exists(submission_pipeline.SCHEDULED_KEY)
+
+    @with_context
+    @patch('pybossa.jobs.enqueue_job')
+    def test_unpublished_project_tasks_completed(self, enqueue_job):
+        """Test tasks of unpublished projects are completed, without a
+        result."""
+        project = ProjectFactory.create(published=False)
+        task = TaskFactory.create(project=project, n_answers=1)
+        self._submit(project=project, task=task)
+
+        assert submission_pipeline.process_pending() == 1
+
+        assert task_repo.get_task(task.id).state == 'completed'
+        assert result_repo.filter_by(task_id=task.id) == []
+
+    @with_context
+    @patch('pybossa.jobs.enqueue_job')
+    def test_process_batch_idempotent(self, enqueue_job):
+        """Test processing a batch again does not duplicate results."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=1)
+        task_run = TaskRunFactory.create(project=project, task=task)
+        entry = dict(id=task_run.id, project_id=project.id, task_id=task.id,
+                     user_id=task_run.user_id, answer=task_run.info)
+
+        submission_pipeline.process_batch([entry], sentinel.master)
+        submission_pipeline.process_batch([entry], sentinel.master)
+
+        results = result_repo.filter_by(task_id=task.id)
+        assert len(results) == 1, results
+        assert results[0].task_run_ids == [task_run.id]
+
+    @with_context
+    @patch('pybossa.jobs.enqueue_job')
+    @patch('pybossa.api.task_run.update_gold_stats')
+    def test_gold_stats_updated_once(self, update_gold_stats, enqueue_job):
+        """Test gold stats are updated at most once per task run."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, calibration=1,
+                                  gold_answers={'a': 1})
+        task_run = TaskRunFactory.create(project=project, task=task,
+                                         info={'a': 1})
+        entry = dict(id=task_run.id, project_id=project.id, task_id=task.id,
+                     user_id=task_run.user_id, answer={'a': 1})
+
+        submission_pipeline.process_batch([entry], sentinel.master)
+        submission_pipeline.process_batch([entry], sentinel.master)
+
+        update_gold_stats.assert_called_once_with(task_run.user_id, task.id,
+                                                  {'info': {'a': 1}})
+        assert task_repo.get_task(task.id).state == 'ongoing'
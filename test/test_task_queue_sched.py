@@ -0,0 +1,193 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from helper import sched
+from default import with_context
+from pybossa.core import project_repo, sentinel
+from factories import TaskFactory, ProjectFactory, UserFactory, TaskRunFactory
+from pybossa.sched import (
+    Schedulers,
+    get_queued_task,
+    rebuild_task_queue
+)
+from pybossa import task_queue
+
+
+class TestTaskQueue(sched.Helper):
+
+    @with_context
+    def test_get_task_ids_ordered_by_priority_and_id(self):
+        conn = sentinel.master
+        task_queue.push_tasks(1, [(3, 0.5, 0), (1, 0.1, 0), (2, 0.5, 0),
+                                  (4, 0, 1)], conn)
+        assert task_queue.get_task_ids(1, 0, 10, conn) == [2, 3, 1]
+        assert task_queue.get_task_ids(1, 0, 10, conn, gold=True) == [4]
+        assert task_queue.get_task_ids(1, 1, 1, conn) == [3]
+
+    @with_context
+    def test_push_task_moves_between_queues(self):
+        conn = sentinel.master
+        task_queue.push_task(1, 1, 0, 0, conn)
+        task_queue.push_task(1, 1, 0, 1, conn)
+        assert task_queue.get_task_ids(1, 0, 10, conn) == []
+        assert task_queue.get_task_ids(1, 0, 10, conn, gold=True) == [1]
+
+    @with_context
+    def test_remove_tasks(self):
+        conn = sentinel.master
+        task_queue.push_tasks(1, [(1, 0, 0), (2, 0, 1), (3, 0, 0)], conn)
+        task_queue.remove_tasks(1, [1, 2], conn)
+        assert task_queue.get_task_ids(1, 0, 10, conn) == [3]
+        assert task_queue.get_task_ids(1, 0, 10, conn, gold=True) == []
+
+    @with_context
+    def test_reset(self):
+        conn = sentinel.master
+        task_queue.mark_ready(1, conn)
+        task_queue.push_tasks(1, [(1, 0, 0)], conn)
+        task_queue.reset(1, conn)
+        assert not task_queue.is_ready(1, conn)
+        assert task_queue.get_task_ids(1, 0, 10, conn) == []
+
+
+class TestQueuedSched(sched.Helper):
+
+    def _create_project(self):
+        owner = UserFactory.create(id=500)
+        project = ProjectFactory.create(owner=owner)
+        project.info['sched'] = Schedulers.queued
+        project_repo.save(project)
+        return project
+
+    @with_context
+    def test_get_queued_task(self):
+        project = self._create_project()
+        task1 = TaskFactory.create(project=project, info='task 1', n_answers=2)
+        task2 = TaskFactory.create(project=project, info='task 2', n_answers=2)
+
+        t1 = get_queued_task(project.id, 11)
+        t2 = get_queued_task(project.id, 1)
+        assert t1[0].id == task1.id
+        assert t2[0].id == task1.id
+        t3 = get_queued_task(project.id, 2)
+        t4 = get_queued_task(project.id, 3)
+        assert t3[0].id == task2.id
+        assert t4[0].id == task2.id
+
+        t5 = get_queued_task(project.id, 11)
+        assert t5[0].id == task1.id
+
+        t6 = get_queued_task(project.id, 4)
+        assert not t6
+
+    @with_context
+    def test_get_queued_task_priority(self):
+        project = self._create_project()
+        TaskFactory.create(project=project, info='task 1', priority_0=0.1)
+        task2 = TaskFactory.create(project=project, info='task 2', priority_0=0.9)
+
+        t1 = get_queued_task(project.id, 1)
+        assert t1[0].id == task2.id
+
+    @with_context
+    def test_queue_rebuilt_when_missing(self):
+        project = self._create_project()
+        task = TaskFactory.create(project=project, info='task 1')
+        task_queue.reset(project.id, sentinel.master)
+
+        t1 = get_queued_task(project.id, 1)
+        assert t1[0].id == task.id
+        assert task_queue.is_ready(project.id, sentinel.master)
+
+    @with_context
+    def test_queue_served_from_db_while_rebuilt(self):
+        project = self._create_project()
+        task = TaskFactory.create(project=project, info='task 1')
+        task_queue.reset(project.id, sentinel.master)
+        assert task_queue.start_build(project.id, sentinel.master, 60)
+
+        assert not rebuild_task_queue(project.id)
+        t1 = get_queued_task(project.id, 1)
+        assert t1[0].id == task.id
+        assert not task_queue.is_ready(project.id, sentinel.master)
+
+    @with_context
+    def test_task_created_while_rebuilt_is_queued(self):
+        project = self._create_project()
+        task_queue.reset(project.id, sentinel.master)
+        assert task_queue.start_build(project.id, sentinel.master, 60)
+        task = TaskFactory.create(project=project, info='task 1')
+
+        task_queue.finish_build(project.id, sentinel.master)
+        assert task_queue.is_ready(project.id, sentinel.master)
+        assert not task_queue.is_building(project.id, sentinel.master)
+        assert task_queue.get_task_ids(project.id, 0, 10, sentinel.master) == [task.id]
+
+    @with_context
+    def test_completed_task_removed_from_queue(self):
+        project = self._create_project()
+        task1 = TaskFactory.create(project=project, info='task 1', n_answers=1)
+        task2 = TaskFactory.create(project=project, info='task 2', n_answers=1)
+        rebuild_task_queue(project.id)
+
+        TaskRunFactory.create(task=task1)
+        assert task_queue.get_task_ids(project.id, 0, 10, sentinel.master) == [task2.id]
+
+    @with_context
+    def test_skip_answered_tasks(self):
+        project = self._create_project()
+        task1 = TaskFactory.create(project=project, info='task 1', n_answers=2)
+        task2 = TaskFactory.create(project=project, info='task 2', n_answers=2)
+        rebuild_task_queue(project.id)
+        user = UserFactory.create()
+        TaskRunFactory.create(task=task1, user=user)
+
+        t1 = get_queued_task(project.id, user.id)
+        assert t1[0].id == task2.id
+
+    @with_context
+    def test_stale_tasks_dropped(self):
+        project = self._create_project()
+        task1 = TaskFactory.create(project=project, info='task 1')
+        task2 = TaskFactory.create(project=project, info='task 2')
+        rebuild_task_queue(project.id)
+        task_queue.push_task(project.id, 9999, 1, 0, sentinel.master)
+
+        t1 = get_queued_task(project.id, 1)
+        assert t1[0].id == task1.id
+        assert 9999 not in task_queue.get_task_ids(project.id, 0, 10,
+                                                   sentinel.master)
+
+    @with_context
+    def test_queue_reset_when_scheduler_changes(self):
+        project = self._create_project()
+        TaskFactory.create(project=project, info='task 1')
+        rebuild_task_queue(project.id)
+
+        project.info['sched'] = Schedulers.locked
+        project_repo.update(project)
+        assert not task_queue.is_ready(project.id, sentinel.master)
+
+    @with_context
+    def test_gold_only(self):
+        project = self._create_project()
+        TaskFactory.create(project=project, info='task 1')
+        gold = TaskFactory.create(project=project, info='gold', calibration=1)
+
+        t1 = get_queued_task(project.id, 1, gold_only=True)
+        assert t1[0].id == gold.id